@@ -1,11 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends, Response
+from fastapi import APIRouter, HTTPException, Depends, Response, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from pydantic import BaseModel
 from ..services.elevenlabs import ElevenLabsService
+from ..services.upstream_governor import UpstreamUnavailableError
+from ..services.chat_service import chat_service
+from ..services.audio_formats import DEFAULT_OUTPUT_FORMAT, media_type, TranscodeError
+from ..services.admission import AdmissionRejected, admit_turn, client_address
+import asyncio
 import logging
-from supabase import create_client, Client # type: ignore
 import os
+import traceback
 import io
 import re
 
@@ -16,11 +21,15 @@ logger.setLevel(logging.INFO)
 # Initialize router
 router = APIRouter(prefix="/tts", tags=["text-to-speech"])
 
-# Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv("NEXT_PUBLIC_SUPABASE_URL"),
-    os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
-)
+# Upper bound on concurrent upstream requests per chunked TTS call
+MAX_PARALLEL_CHUNKS = int(os.getenv("TTS_MAX_PARALLEL_CHUNKS", "6"))
+
+# Characters after which the first spoken chunk may end at a comma
+FIRST_CHUNK_CHARS = int(os.getenv("VOICE_CHAT_FIRST_CHUNK_CHARS", "60"))
+# Events buffered per voice chat connection before producers wait for the client
+VOICE_CHAT_QUEUE_SIZE = int(os.getenv("VOICE_CHAT_QUEUE_SIZE", "32"))
+# Time an in-flight audio header/binary pair gets to finish before a failed turn reports its error
+VOICE_CHAT_SEND_TIMEOUT = 10.0
 
 # Pydantic models
 class TTSRequest(BaseModel):
@@ -28,6 +37,19 @@ class TTSRequest(BaseModel):
     voice_id: Optional[str] = None
     optimize_streaming_latency: int = 0
     model_id: str = "eleven_flash_v2_5"
+    max_parallel_chunks: int = 3
+    # See OUTPUT_FORMATS, e.g. mp3_22050_32 for weak links, opus_48000_32, pcm_16000
+    output_format: str = DEFAULT_OUTPUT_FORMAT
+
+class VoiceChatRequest(BaseModel):
+    message: str
+    avatar_name: str
+    avatar_instructions: Optional[str] = None
+    user_id: Optional[str] = None
+    model_id: str = "eleven_flash_v2_5"
+    optimize_streaming_latency: int = 0
+    max_parallel_chunks: int = 3
+    output_format: str = DEFAULT_OUTPUT_FORMAT
 
 # Reuse ElevenLabs service dependency
 async def get_elevenlabs_service():
@@ -39,12 +61,77 @@ async def get_elevenlabs_service():
 
 def clean_text_for_synthesis(text: str) -> str:
     """Remove citation references from text"""
-    # Remove [ref X] patterns
-    cleaned = re.sub(r'\[ref \d+\]', '', text)
+    # Remove [ref X] and {ref:X} patterns
+    cleaned = re.sub(r'\[ref \d+\]|\{ref:\d+\}', '', text)
     # Remove extra whitespace
     cleaned = ' '.join(cleaned.split())
     return cleaned
 
+def split_into_sentences(text: str, max_chunk_chars: int = 300) -> List[str]:
+    """Split cleaned text into sentence-sized chunks for incremental synthesis"""
+    sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', text) if s.strip()]
+
+    chunks = []
+    for sentence in sentences:
+        # Break overly long sentences at clause boundaries, then at word boundaries
+        while len(sentence) > max_chunk_chars:
+            split_at = max(
+                sentence.rfind(', ', 0, max_chunk_chars),
+                sentence.rfind('; ', 0, max_chunk_chars)
+            )
+            if split_at <= 0:
+                split_at = sentence.rfind(' ', 0, max_chunk_chars)
+            if split_at <= 0:
+                split_at = max_chunk_chars
+            chunks.append(sentence[:split_at + 1].strip())
+            sentence = sentence[split_at + 1:].strip()
+        if sentence:
+            chunks.append(sentence)
+    return chunks
+
+class SentenceBuffer:
+    """
+    Collects streamed text and releases sentence-sized chunks as they complete.
+
+    The first chunk may be released at a clause boundary once it is long
+    enough, so speech can start before the first sentence ends.
+    """
+    def __init__(self, max_chunk_chars: int = 300, first_chunk_chars: int = FIRST_CHUNK_CHARS):
+        self.max_chunk_chars = max_chunk_chars
+        self.first_chunk_chars = first_chunk_chars
+        self.text = ""
+        self.released = False
+
+    def _release(self, end: int) -> List[str]:
+        ready, self.text = self.text[:end], self.text[end:]
+        chunks = split_into_sentences(clean_text_for_synthesis(ready), self.max_chunk_chars)
+        self.released = self.released or bool(chunks)
+        return chunks
+
+    def feed(self, delta: str) -> List[str]:
+        self.text += delta
+        # A sentence is complete once whitespace follows its terminator
+        ends = [m.end() for m in re.finditer(r'[.!?](?=\s)', self.text)]
+        if ends:
+            return self._release(ends[-1])
+        if not self.released and len(self.text) >= self.first_chunk_chars:
+            clause = max(self.text.rfind(', '), self.text.rfind('; '))
+            if clause > 0:
+                return self._release(clause + 1)
+        if len(self.text) > self.max_chunk_chars:
+            split_at = self.text.rfind(' ', 0, self.max_chunk_chars)
+            return self._release(split_at if split_at > 0 else self.max_chunk_chars)
+        return []
+
+    def flush(self) -> List[str]:
+        return self._release(len(self.text))
+
+def _media_type_or_400(output_format: str) -> str:
+    try:
+        return media_type(output_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/{voice_id}")
 async def text_to_speech(
     voice_id: str,
@@ -69,16 +156,18 @@ async def text_to_speech(
                 status_code=400,
                 detail="Voice ID is required"
             )
+        audio_type = _media_type_or_400(request.output_format)
         
         # Generate speech with cleaned text
-        audio_content = await service.generate_speech(
+        audio_content = await service.generate_speech_cached(
             text=cleaned_text,
             voice_id=voice_id,
             model_id=request.model_id,
-            optimize_streaming_latency=request.optimize_streaming_latency
+            optimize_streaming_latency=request.optimize_streaming_latency,
+            output_format=request.output_format
         )
         
-        logger.info(f"Generated audio content size: {len(audio_content)} bytes")
+        logger.info(f"Generated audio content size: {len(audio_content)} bytes ({request.output_format})")
         
         # Create an in-memory bytes buffer
         audio_buffer = io.BytesIO(audio_content)
@@ -86,9 +175,9 @@ async def text_to_speech(
         # Return streaming response
         response = StreamingResponse(
             audio_buffer,
-            media_type="audio/mpeg",
+            media_type=audio_type,
             headers={
-                "Content-Type": "audio/mpeg",
+                "Content-Type": audio_type,
                 "Accept-Ranges": "bytes",
                 "Content-Disposition": "inline"
             }
@@ -98,11 +187,221 @@ async def text_to_speech(
         
     except HTTPException:
         raise
+    except UpstreamUnavailableError as e:
+        logger.error(f"TTS upstream unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+    except TranscodeError as e:
+        logger.error(f"Error transcoding speech: {str(e)}")
+        raise HTTPException(status_code=501, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating speech: {str(e)}")
         logger.error(f"Full error details: {e.__class__.__name__}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate speech: {str(e)}")
 
+@router.post("/{voice_id}/chunked")
+async def text_to_speech_chunked(
+    voice_id: str,
+    request: TTSRequest,
+    user_id: str
+) -> StreamingResponse:
+    """
+    Convert text to speech sentence by sentence, streaming audio as each chunk is ready
+    """
+    audio_type = _media_type_or_400(request.output_format)
+    cleaned_text = clean_text_for_synthesis(request.text)
+    chunks = split_into_sentences(cleaned_text)
+    if not chunks:
+        raise HTTPException(status_code=400, detail="No text to synthesize")
+
+    logger.info(f"Starting chunked TTS request for voice_id: {voice_id} ({len(chunks)} chunks)")
+
+    # The service is owned by the generator: dependency teardown runs before
+    # the streaming body is sent, so a Depends-provided client would be closed.
+    service = ElevenLabsService()
+
+    async def audio_stream():
+        try:
+            async for audio in service.generate_speech_chunks(
+                chunks,
+                voice_id=voice_id,
+                model_id=request.model_id,
+                optimize_streaming_latency=request.optimize_streaming_latency,
+                max_parallel=min(max(request.max_parallel_chunks, 1), MAX_PARALLEL_CHUNKS),
+                output_format=request.output_format
+            ):
+                yield audio
+        except Exception as e:
+            logger.error(f"Error streaming chunked speech: {str(e)}")
+            raise
+        finally:
+            await service.close()
+
+    return StreamingResponse(
+        audio_stream(),
+        media_type=audio_type,
+        headers={
+            "Content-Type": audio_type,
+            "Content-Disposition": "inline"
+        }
+    )
+
+@router.websocket("/{voice_id}/chat")
+async def voice_chat(websocket: WebSocket, voice_id: str):
+    """
+    Voice round trip on one connection: the chat answer is streamed as text
+    and each sentence is synthesized as soon as it completes.
+
+    The client sends a JSON VoiceChatRequest per question. The server replies
+    with JSON events: {"type": "citations"}, {"type": "delta", "text"} per
+    token, {"type": "done", "response"}, and for each spoken chunk an
+    {"type": "audio", "index", "text", "bytes", "media_type"} header followed
+    by one binary frame in the requested output_format, then
+    {"type": "audio_done"}. Errors are sent as
+    {"type": "error", "detail"}. Outgoing events go through a bounded queue,
+    so a slow client slows the LLM and TTS producers instead of growing memory.
+
+    Each turn is admitted against the chat and TTS pools; a shed turn gets
+    {"type": "error", "status", "detail", "retry_after"} and the connection
+    stays open.
+    """
+    await websocket.accept()
+    client_key = client_address(websocket.client.host if websocket.client else None, websocket.headers.get("x-forwarded-for"))
+    service = ElevenLabsService()
+    try:
+        while True:
+            try:
+                request = VoiceChatRequest(**await websocket.receive_json())
+                media_type(request.output_format)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_json({"type": "error", "detail": f"Invalid request: {str(e)}"})
+                continue
+            try:
+                async with admit_turn(request.user_id or client_key or "anonymous", client_key=client_key):
+                    await _voice_chat_turn(websocket, service, voice_id, request)
+            except AdmissionRejected as e:
+                await websocket.send_json({
+                    "type": "error",
+                    "status": e.status,
+                    "detail": e.reason,
+                    "retry_after": e.retry_after
+                })
+    except WebSocketDisconnect:
+        logger.info("Voice chat client disconnected")
+    finally:
+        await service.close()
+
+async def _voice_chat_turn(websocket: WebSocket, service: ElevenLabsService, voice_id: str, request: VoiceChatRequest):
+    outbox: asyncio.Queue = asyncio.Queue(maxsize=VOICE_CHAT_QUEUE_SIZE)
+    sentences: asyncio.Queue = asyncio.Queue(maxsize=VOICE_CHAT_QUEUE_SIZE)
+    spoken: List[str] = []
+
+    async def produce_text():
+        chat = await chat_service.aget()
+        buffer = SentenceBuffer()
+        try:
+            async for event in chat.stream_response(
+                message=request.message,
+                avatar_name=request.avatar_name,
+                avatar_instructions=request.avatar_instructions,
+                user_id=request.user_id
+            ):
+                if event["type"] == "delta":
+                    for sentence in buffer.feed(event["text"]):
+                        await sentences.put(sentence)
+                await outbox.put(event)
+            for sentence in buffer.flush():
+                await sentences.put(sentence)
+        finally:
+            await sentences.put(None)
+
+    async def sentence_source():
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                return
+            spoken.append(sentence)
+            yield sentence
+
+    async def produce_audio():
+        index = 0
+        async for audio in service.generate_speech_chunks(
+            sentence_source(),
+            voice_id=voice_id,
+            model_id=request.model_id,
+            optimize_streaming_latency=request.optimize_streaming_latency,
+            max_parallel=min(max(request.max_parallel_chunks, 1), MAX_PARALLEL_CHUNKS),
+            output_format=request.output_format
+        ):
+            await outbox.put((index, audio))
+            index += 1
+        await outbox.put({"type": "audio_done"})
+
+    # The sender is only cancelled between events, never between an audio
+    # header and its binary frame
+    stopping = asyncio.Event()
+    sending = False
+
+    async def send():
+        nonlocal sending
+        while not stopping.is_set():
+            item = await outbox.get()
+            if item is None:
+                return
+            sending = True
+            if isinstance(item, tuple):
+                index, audio = item
+                await websocket.send_json({
+                    "type": "audio",
+                    "index": index,
+                    "text": spoken[index],
+                    "bytes": len(audio),
+                    "media_type": media_type(request.output_format)
+                })
+                await websocket.send_bytes(audio)
+            else:
+                await websocket.send_json(item)
+            sending = False
+
+    async def stop_sender():
+        stopping.set()
+        if sending:
+            await asyncio.wait({sender}, timeout=VOICE_CHAT_SEND_TIMEOUT)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        if sending:
+            # The pair never finished; the client can't tell what comes next
+            raise WebSocketDisconnect()
+
+    sender = asyncio.create_task(send())
+    producers = [asyncio.create_task(produce_text()), asyncio.create_task(produce_audio())]
+    producing = asyncio.gather(*producers)
+    try:
+        # A failed sender means the client is gone; stop producing instead of blocking on the queue
+        await asyncio.wait({producing, sender}, return_when=asyncio.FIRST_COMPLETED)
+        if sender.done():
+            sender.result()
+        await producing
+        await outbox.put(None)
+        await sender
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        if sender.done() and sender.exception() is not None:
+            raise WebSocketDisconnect()
+        logger.error(f"Error in voice chat: {str(e)}")
+        logger.error(f"Full traceback: {traceback.format_exc()}")
+        await stop_sender()
+        error = {"type": "error", "detail": str(e)}
+        if isinstance(e, UpstreamUnavailableError):
+            error["retry_after"] = e.retry_after
+        await websocket.send_json(error)
+    finally:
+        producing.cancel()
+        for task in (*producers, sender):
+            task.cancel()
+
 @router.get("/health")
 async def check_health(
     service: ElevenLabsService = Depends(get_elevenlabs_service)
@@ -1,9 +1,13 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Form
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, BinaryIO
 from ..services.elevenlabs import ElevenLabsService
+from ..services.uploads import spool_upload, file_size, UploadTooLargeError
+from ..services.job_runner import Job, JobRunner, JobQueueFullError
+from ..services.preview_service import PreviewService
+from ..services.supabase_client import supabase_client, get_supabase
 from pydantic import BaseModel
 import logging
-from supabase import create_client, Client # type: ignore
+import asyncio
 import os
 import uuid
 
@@ -14,12 +18,18 @@ logger.setLevel(logging.INFO)
 # Initialize router
 router = APIRouter(prefix="/voices", tags=["voices"])
 
-# Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv("NEXT_PUBLIC_SUPABASE_URL"),
-    os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+# Background runner for voice training; state transitions are persisted to Supabase
+training_jobs = JobRunner(
+    name="voice-training",
+    max_workers=int(os.getenv("VOICE_TRAINING_WORKERS", "2")),
+    max_queue=int(os.getenv("VOICE_TRAINING_QUEUE_SIZE", "50")),
+    get_supabase=get_supabase,
+    table="voice_training_jobs"
 )
 
+# Maximum accepted size for a voice training sample
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+
 # Pydantic models for request/response validation
 class VoicePreference(BaseModel):
     voice_id: str
@@ -48,7 +58,21 @@ async def list_voices(
     """
     try:
         voices = await service.get_voices()
-        return voices
+
+        # Attach precomputed previews; listing never triggers synthesis, and
+        # works without them when Supabase is unavailable
+        try:
+            supabase = await supabase_client.aget()
+            manifest = await PreviewService(supabase, service).load_manifest(
+                [v["voice_id"] for v in voices]
+            )
+        except Exception as e:
+            logger.warning(f"Could not load preview manifest: {str(e)}")
+            manifest = {}
+        return [
+            {**v, "cached_preview_url": manifest.get(v["voice_id"], {}).get("preview_url")}
+            for v in voices
+        ]
     except Exception as e:
         logger.error(f"Error listing voices: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch voices")
@@ -69,6 +93,7 @@ async def select_voice(
             raise HTTPException(status_code=404, detail="Voice not found")
             
         # Save preference to database
+        supabase = await supabase_client.aget()
         result = supabase.table("voice_preferences").upsert({
             "user_id": user_id,
             "voice_id": preference.voice_id,
@@ -83,17 +108,94 @@ async def select_voice(
         logger.error(f"Error saving voice preference: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to save voice preference")
 
-@router.post("/train")
+async def run_voice_training(
+    job: Job,
+    name: str,
+    description: Optional[str],
+    preview_text: str,
+    sample: BinaryIO,
+    content_type: str,
+    user_id: str
+) -> Dict[str, Any]:
+    """
+    Background body of a voice training job
+    """
+    service = ElevenLabsService()
+    try:
+        supabase = await supabase_client.aget()
+
+        # Create labels
+        labels = {"description": description} if description else None
+        logger.info(f"Sending to ElevenLabs with labels: {labels}")
+
+        # Add voice to ElevenLabs
+        await training_jobs.set_step(job, "adding_voice")
+        voice_data = await service.add_voice(name, [sample], labels, content_type=content_type)
+        voice_id = voice_data.get('voice_id')
+        logger.info(f"Voice created with ID: {voice_id}")
+
+        async def create_preview() -> str:
+            # Store the preview at a content-hashed path under the user's folder
+            logger.info(f"Generating preview sample with text: {preview_text}")
+            voice = await service.get_voice(voice_id)
+            record = await PreviewService(supabase, service).ensure_preview(
+                voice, preview_text, owner=user_id
+            )
+            return record["preview_url"]
+
+        # The preview and the default settings are independent of each other
+        await training_jobs.set_step(job, "preparing_voice")
+        preview_url, voice_settings = await asyncio.gather(
+            create_preview(),
+            service.get_voice_settings(voice_id)
+        )
+        voice_data['preview_url'] = preview_url
+
+        await training_jobs.set_step(job, "saving_preference")
+
+        # Deactivate any existing active voices for this user
+        await asyncio.to_thread(
+            lambda: supabase.table("voice_preferences").update({
+                "is_active": False
+            }).eq("user_id", user_id).execute()
+        )
+
+        # Save as user's active voice preference
+        voice_preference = {
+            "user_id": user_id,
+            "voice_id": voice_id,
+            "voice_name": name,
+            "preview_text": preview_text,
+            "preview_url": preview_url,
+            "is_custom": True,
+            "is_active": True,
+            "settings": voice_settings
+        }
+
+        result = await asyncio.to_thread(
+            lambda: supabase.table("voice_preferences").insert(voice_preference).execute()
+        )
+        voice_data['voice_preference'] = result.data[0]
+
+        logger.info("Voice training completed successfully")
+        return voice_data
+
+    finally:
+        sample.close()
+        await service.close()
+
+@router.post("/train", status_code=202)
 async def train_voice(
     name: str = Form(...),
     description: Optional[str] = Form(None),
     preview_text: str = Form(...),
     file: UploadFile = File(...),
-    user_id: uuid.UUID = Form(...),
-    service: ElevenLabsService = Depends(get_elevenlabs_service)
+    user_id: uuid.UUID = Form(...)
 ) -> Dict[str, Any]:
     """
-    Upload a single audio file for custom voice training
+    Upload a single audio file for custom voice training.
+
+    Training runs as a background job; poll /voices/jobs/{job_id} for the result.
     """
     try:
         logger.info(f"Starting voice training for user {user_id}")
@@ -107,83 +209,47 @@ async def train_voice(
                 detail=f"Invalid file type: {file.content_type}. Must be audio."
             )
             
-        # Read and validate file
+        # Stream the upload into a bounded spool, enforcing the size limit as we read
         logger.info(f"Reading file: {file.filename}, content_type: {file.content_type}")
-        content = await file.read()
-        file_size = len(content)
-        logger.info(f"File size: {file_size} bytes")
-        
-        # Check file size
-        MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-        if file_size > MAX_FILE_SIZE:
-            logger.error(f"File too large: {file_size} bytes")
+        try:
+            sample = await spool_upload(file, max_size=MAX_FILE_SIZE)
+        except UploadTooLargeError as e:
+            logger.error(f"File too large: more than {e.max_size} bytes")
             raise HTTPException(
                 status_code=400,
-                detail=f"File too large. Maximum size is 10MB, got {file_size / 1024 / 1024:.1f}MB"
+                detail=f"File too large. Maximum size is 10MB, got {e.size / 1024 / 1024:.1f}MB"
             )
-            
-        # Create labels
-        labels = {"description": description} if description else None
-        logger.info(f"Sending to ElevenLabs with labels: {labels}")
-        
-        try:
-            # Add voice to ElevenLabs
-            logger.info("Calling ElevenLabs add_voice")
-            voice_data = await service.add_voice(name, [content], labels)
-            voice_id = voice_data.get('voice_id')
-            logger.info(f"Voice created with ID: {voice_id}")
+        logger.info(f"File size: {file_size(sample)} bytes")
 
-            # Generate preview sample
-            logger.info(f"Generating preview sample with text: {preview_text}")
-            preview_audio = await service.generate_preview_sample(voice_id, preview_text)
-            
-            # Save preview sample to storage
-            preview_path = f"{str(user_id)}/{voice_id}/preview.mp3"
-            logger.info(f"Uploading preview to path: {preview_path}")
-            
-            # Upload preview to Supabase storage
-            preview_result = supabase.storage.from_("voice-samples").upload(
-                preview_path,
-                preview_audio,
-                {"content-type": "audio/mpeg", "x-upsert": "true"}
+        # The job owns the spooled sample from here on and closes it when done
+        async def job_body(job: Job) -> Dict[str, Any]:
+            return await run_voice_training(
+                job,
+                name=name,
+                description=description,
+                preview_text=preview_text,
+                sample=sample,
+                content_type=file.content_type,
+                user_id=str(user_id)
             )
-            
-            # Get public URL for preview
-            preview_url = supabase.storage.from_("voice-samples").get_public_url(preview_path)
-            voice_data['preview_url'] = preview_url
 
-            # Get default voice settings
-            voice_settings = await service.get_voice_settings(voice_id)
-            
-            # Deactivate any existing active voices for this user
-            supabase.table("voice_preferences").update({
-                "is_active": False
-            }).eq("user_id", str(user_id)).execute()
-            
-            # Save as user's active voice preference
-            voice_preference = {
-                "user_id": str(user_id),
-                "voice_id": voice_id,
-                "voice_name": name,
-                "preview_text": preview_text,
-                "preview_url": preview_url,
-                "is_custom": True,
-                "is_active": True,
-                "settings": voice_settings
-            }
-            
-            result = supabase.table("voice_preferences").insert(voice_preference).execute()
-            voice_data['voice_preference'] = result.data[0]
-            
-            logger.info("Voice training completed successfully")
-            return voice_data
-            
-        except Exception as e:
-            logger.error(f"ElevenLabs API error: {str(e)}")
+        try:
+            job = await training_jobs.submit(
+                job_body, kind="voice_training", user_id=str(user_id), cleanup=sample.close
+            )
+        except JobQueueFullError:
+            sample.close()
             raise HTTPException(
-                status_code=400,
-                detail=f"ElevenLabs API error: {str(e)}"
+                status_code=503,
+                detail="Voice training queue is full, please try again later",
+                headers={"Retry-After": "30"}
             )
+
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/voices/jobs/{job.id}?user_id={user_id}"
+        }
             
     except HTTPException:
         raise
@@ -191,6 +257,48 @@ async def train_voice(
         logger.error(f"Error training voice: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def run_preview_refresh(job: Job) -> Dict[str, Any]:
+    """
+    Background body of a preview precompute job
+    """
+    service = ElevenLabsService()
+    try:
+        voices = await service.get_voices(force_refresh=True)
+        supabase = await supabase_client.aget()
+        return await PreviewService(supabase, service).precompute_all(voices)
+    finally:
+        await service.close()
+
+@router.post("/previews/refresh", status_code=202)
+async def refresh_previews() -> Dict[str, Any]:
+    """
+    Queue precomputation of previews for every listed voice
+    """
+    try:
+        job = await training_jobs.submit(run_preview_refresh, kind="preview_refresh")
+    except JobQueueFullError:
+        raise HTTPException(
+            status_code=503,
+            detail="Job queue is full, please try again later",
+            headers={"Retry-After": "30"}
+        )
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/voices/jobs/{job.id}"
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_training_job(job_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get the state of a voice training job; training jobs are only shown to
+    the user that submitted them
+    """
+    job = await training_jobs.get(job_id, user_id=user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 @router.get("/status/{voice_id}")
 async def get_voice_status(
     voice_id: str,
@@ -1,9 +1,22 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from .api import voice, synthesis
-from .routes import chat
+from .routes import chat, documents
+from .services.upstream_governor import governor
+from .services.lazy import warm_up, readiness
+from .services.shared_cache import shared_cache
+from .services.metrics import metrics
+from .services.admission import AdmissionMiddleware, ADMISSION_RULES, admission_stats
+from .services.message_cdc import message_cdc, CDC_ENABLED
+from .services.profiling import profiler, ProfilerBusyError, LOOP_LAG_MONITOR
+from .services.uploads import remove_orphaned_spools
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from typing import Optional
+import asyncio
+import hmac
 import logging
 import os
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +29,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Admission control for chat and TTS; added first so CORS wraps its rejections
+app.add_middleware(AdmissionMiddleware, rules=ADMISSION_RULES)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +45,7 @@ app.add_middleware(
 app.include_router(voice.router)
 app.include_router(synthesis.router)
 app.include_router(chat.router, prefix="/api")
+app.include_router(documents.router, prefix="/api")
 
 @app.on_event("startup")
 async def startup_event():
@@ -53,12 +70,169 @@ async def startup_event():
         
     logger.info("All required environment variables found")
 
+    # Jobs and uploads of workers that exited mid-job are failed and removed
+    remove_orphaned_spools()
+    await voice.training_jobs.start()
+    await documents.document_jobs.start()
+    await chat.index_jobs.start()
+
+    if CDC_ENABLED:
+        if not os.getenv("DATABASE_URL"):
+            raise RuntimeError("CDC_ENABLED requires DATABASE_URL")
+        # Every worker starts one; an advisory lock lets only one consume
+        await message_cdc.start()
+
+    if LOOP_LAG_MONITOR:
+        profiler.loop_monitor.start()
+
+    # Heavy clients (Supabase, Pinecone, LangChain) are built lazily; warm them
+    # in worker threads so the app accepts traffic without waiting on them
+    app.state.warm_up_task = asyncio.create_task(background_startup())
+
+async def background_startup():
+    """
+    Startup work that runs after the app is accepting traffic
+    """
+    await warm_up()
+
+    # Bring voice previews up to date in the background, from one worker per host
+    precompute = os.getenv("VOICE_PREVIEW_PRECOMPUTE", "true").lower() == "true"
+    if precompute and await shared_cache.aacquire_lease("preview-precompute", ttl=600):
+        await voice.training_jobs.submit(voice.run_preview_refresh, kind="preview_refresh")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Stop background workers
+    """
+    await voice.training_jobs.stop()
+    await documents.document_jobs.stop()
+    await chat.index_jobs.stop()
+    await message_cdc.stop()
+    await profiler.loop_monitor.stop()
+
 @app.get("/health")
 async def health_check():
     """
-    Basic health check endpoint
+    Liveness check: the process is up and serving requests. Reports
+    "saturated" while any admission pool has every slot busy.
     """
+    admission = admission_stats()
+    saturated = any(pool["saturated"] for pool in admission.values())
     return {
-        "status": "healthy",
-        "message": "Voice API is running"
-    } 
\ No newline at end of file
+        "status": "saturated" if saturated else "healthy",
+        "message": "Voice API is running",
+        "admission": admission,
+        "upstreams": governor.stats(),
+        "cdc": message_cdc.status() if CDC_ENABLED else None
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness check: required clients have been initialized
+    """
+    status = readiness()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics")
+async def metrics_report():
+    """
+    Latency percentiles (ms) and counters recorded by this worker process
+    """
+    return {"pid": os.getpid(), "metrics": metrics.snapshot()}
+
+# Profiling endpoints are only served when ADMIN_TOKEN is set, and require it
+# in the X-Admin-Token header. Each worker profiles itself, so the response
+# describes the process that served the request (see the pid).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def _download(body, name: str, media_type: str = "text/plain") -> Response:
+    filename = f"{name}-{os.getpid()}-{int(time.time())}"
+    return Response(
+        content=body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/admin/profile/cpu", dependencies=[Depends(require_admin)])
+async def profile_cpu(seconds: float = 10, interval_ms: float = 5, loop_only: bool = False):
+    """
+    Sampled CPU profile of this worker for N seconds, as collapsed stacks
+    (flamegraph.pl, speedscope, inferno)
+    """
+    try:
+        sampler = await profiler.sample_cpu(seconds, interval_ms, loop_only)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _download(sampler.collapsed(), "cpu.collapsed")
+
+@app.get("/admin/profile/cprofile", dependencies=[Depends(require_admin)])
+async def profile_requests(seconds: float = 10, format: str = "text", sort: str = "cumulative", limit: int = 50):
+    """
+    cProfile of this worker's event loop thread for N seconds; work run in
+    threads (to_thread, executors) shows only as the call awaiting it.
+    "text" is a pstats listing, "prof" a pstats file for snakeviz or flameprof
+    """
+    if format not in ("text", "prof"):
+        raise HTTPException(status_code=400, detail="format must be text or prof")
+    try:
+        profile = await profiler.cprofile(seconds)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "prof":
+        return _download(profiler.pstats_bytes(profile), "requests.prof", "application/octet-stream")
+    return PlainTextResponse(profiler.pstats_text(profile, sort, limit))
+
+@app.get("/admin/profile/loop", dependencies=[Depends(require_admin)])
+async def profile_loop(limit: int = 20, format: str = "json"):
+    """
+    Event loop lag and recent blocking calls with their stacks; "collapsed"
+    downloads the stalls as stacks weighted by milliseconds blocked
+    """
+    if format == "collapsed":
+        return _download(profiler.loop_monitor.collapsed(), "loop-stalls.collapsed")
+    return {"pid": os.getpid(), **profiler.loop_monitor.report(limit)}
+
+@app.post("/admin/profile/loop", dependencies=[Depends(require_admin)])
+async def configure_loop_monitor(enabled: bool = True, threshold_ms: Optional[float] = None):
+    """Start or stop the loop lag monitor, optionally changing its threshold"""
+    monitor = profiler.loop_monitor
+    if threshold_ms is not None:
+        monitor.threshold = threshold_ms / 1000
+    if enabled:
+        monitor.start()
+    else:
+        await monitor.stop()
+    return {"pid": os.getpid(), **monitor.report(0)}
+
+@app.post("/admin/profile/memory/start", dependencies=[Depends(require_admin)])
+async def start_memory_tracing(frames: int = 25):
+    """Start tracemalloc; snapshots report growth from this point"""
+    return {"pid": os.getpid(), **profiler.start_memory(frames)}
+
+@app.post("/admin/profile/memory/stop", dependencies=[Depends(require_admin)])
+async def stop_memory_tracing():
+    return {"pid": os.getpid(), **profiler.stop_memory()}
+
+@app.get("/admin/profile/memory", dependencies=[Depends(require_admin)])
+async def memory_snapshot(top: int = 25, key_type: str = "lineno", reset_baseline: bool = False, format: str = "json"):
+    """
+    Top allocation sites and growth since the baseline; "collapsed"
+    downloads live allocations as stacks weighted by bytes
+    """
+    if key_type not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="key_type must be lineno, filename or traceback")
+    try:
+        if format == "collapsed":
+            return _download(await asyncio.to_thread(profiler.memory_collapsed), "memory.collapsed")
+        report = await asyncio.to_thread(profiler.memory_snapshot, top, key_type, reset_baseline)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"pid": os.getpid(), **report}
@@ -1,9 +1,16 @@
-from fastapi import APIRouter, HTTPException # type: ignore
+from fastapi import APIRouter, HTTPException, Depends # type: ignore
 from pydantic import BaseModel # type: ignore
+import asyncio
 import logging
 import traceback
-from ..services.chat_service import ChatService
-from ..services.pinecone_service import PineconeService
+from ..services.chat_service import ChatService, get_chat_service
+from ..services.pinecone_service import PineconeService, get_pinecone_service
+from ..services.upstream_governor import UpstreamUnavailableError
+from ..services.memory_service import MemoryService, get_memory_service
+from ..services.message_cdc import CDC_ENABLED
+from ..services.job_runner import Job, JobRunner, JobQueueFullError
+from ..services.sharding import is_message_shard
+from ..services.supabase_client import get_supabase
 import os
 from typing import Dict, Any, Optional
 
@@ -11,12 +18,22 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-chat_service = ChatService()
+# Long index maintenance (reconciles, shard and centroid rebuilds) runs one at
+# a time in the background; state is persisted to Supabase
+index_jobs = JobRunner(
+    name="index-maintenance",
+    max_workers=1,
+    max_queue=int(os.getenv("INDEX_JOB_QUEUE_SIZE", "10")),
+    get_supabase=get_supabase,
+    table="index_jobs"
+)
 
 class ChatRequest(BaseModel):
     message: str
     avatar_name: str
     avatar_instructions: Optional[str] = None
+    # Enables conversation memory for this user and avatar
+    user_id: Optional[str] = None
 
 class UpsertMessageRequest(BaseModel):
     message: str
@@ -26,7 +43,7 @@ class UpsertMessageRequest(BaseModel):
 async def test_pinecone():
     try:
         logger.info("=== Testing Pinecone Connection ===")
-        pinecone_service = PineconeService()
+        await asyncio.to_thread(get_pinecone_service)
         return {"status": "success", "message": "Pinecone connection successful"}
     except Exception as e:
         logger.error(f"Error testing Pinecone: {str(e)}")
@@ -34,7 +51,10 @@ async def test_pinecone():
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(
+    request: ChatRequest,
+    chat_service: ChatService = Depends(get_chat_service)
+):
     try:
         logger.info("=== Chat Request Received ===")
         logger.info(f"Message: {request.message}")
@@ -45,20 +65,25 @@ async def chat(request: ChatRequest):
         response_data = await chat_service.generate_response(
             message=request.message,
             avatar_name=request.avatar_name,
-            avatar_instructions=request.avatar_instructions
+            avatar_instructions=request.avatar_instructions,
+            user_id=request.user_id
         )
         logger.info("Response generated successfully")
         return response_data
+    except UpstreamUnavailableError as e:
+        logger.error(f"Chat upstream unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
     except Exception as e:
         logger.error(f"Error in chat endpoint: {type(e).__name__}")
         logger.error(f"Full traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/batch-process")
-async def batch_process_messages():
+async def batch_process_messages(
+    pinecone_service: PineconeService = Depends(get_pinecone_service)
+):
     """Endpoint to trigger batch processing of messages into Pinecone"""
     try:
-        pinecone_service = PineconeService()
         stats = await pinecone_service.batch_process_messages()
         return {
             "status": "success",
@@ -71,17 +96,158 @@ async def batch_process_messages():
         }
 
 @router.post("/chat/upsert-message")
-async def upsert_message(request: UpsertMessageRequest):
+async def upsert_message(
+    request: UpsertMessageRequest,
+    pinecone_service: PineconeService = Depends(get_pinecone_service)
+):
     try:
         logger.info("=== Upserting Message to Pinecone ===")
         logger.info(f"Message content: {request.message[:50]}...")  # First 50 chars
         logger.info(f"Metadata: {request.metadata}")
+
+        if CDC_ENABLED:
+            # The database change feed indexes the message; embedding it here too would double the work
+            return {"status": "skipped", "reason": "Indexed by change data capture"}
         
-        pinecone_service = PineconeService()
         await pinecone_service.upsert_message(request.message, request.metadata)
         
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Error upserting message: {str(e)}")
         logger.error(f"Full traceback: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put("/chat/messages/{message_id}")
+async def update_message(
+    message_id: str,
+    request: UpsertMessageRequest,
+    pinecone_service: PineconeService = Depends(get_pinecone_service)
+):
+    """Re-embed an edited message, replacing all of its chunks"""
+    try:
+        metadata = {**request.metadata, "message_id": message_id}
+        if metadata.get("message_type") == "dm":
+            # A message moved out of search scope is removed rather than skipped
+            deleted = await pinecone_service.delete_messages([message_id])
+            return {"status": "success", "deleted": deleted}
+
+        vectors = await pinecone_service.upsert_messages([{"content": request.message, "metadata": metadata}])
+        return {"status": "success", "vectors": vectors}
+    except Exception as e:
+        logger.error(f"Error updating message {message_id}: {str(e)}")
+        logger.error(f"Full traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/chat/messages/{message_id}")
+async def delete_message(
+    message_id: str,
+    pinecone_service: PineconeService = Depends(get_pinecone_service)
+):
+    try:
+        deleted = await pinecone_service.delete_messages([message_id])
+        return {"status": "success", "deleted": deleted}
+    except Exception as e:
+        logger.error(f"Error deleting message {message_id}: {str(e)}")
+        logger.error(f"Full traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/reconcile", status_code=202)
+async def reconcile_messages(
+    pinecone_service: PineconeService = Depends(get_pinecone_service)
+):
+    """
+    Sync the index with Supabase, re-embedding only changed messages.
+
+    Every message is compared, so this runs as a background job; poll
+    /api/chat/jobs/{job_id} for the result.
+    """
+    async def job_body(job: Job) -> Dict[str, Any]:
+        return await pinecone_service.reconcile()
+
+    return await _submit_index_job(job_body, "reconcile")
+
+@router.get("/chat/shards")
+async def list_shards(
+    pinecone_service: PineconeService = Depends(get_pinecone_service)
+):
+    """Vector counts per message shard"""
+    try:
+        return {"status": "success", "data": await pinecone_service.shard_stats()}
+    except Exception as e:
+        logger.error(f"Error listing shards: {str(e)}")
+        logger.error(f"Full traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/shards/{namespace}/rebuild", status_code=202)
+async def rebuild_shard(
+    namespace: str,
+    pinecone_service: PineconeService = Depends(get_pinecone_service)
+):
+    """
+    Re-embed one message shard without touching the others.
+
+    The rebuild runs as a background job; poll /api/chat/jobs/{job_id} for the result.
+    """
+    if not is_message_shard(namespace):
+        raise HTTPException(status_code=400, detail=f"{namespace!r} is not a message shard")
+
+    async def job_body(job: Job) -> Dict[str, Any]:
+        return await pinecone_service.rebuild_shard(namespace)
+
+    return await _submit_index_job(job_body, "shard_rebuild")
+
+async def _submit_index_job(job_body, kind: str) -> Dict[str, Any]:
+    """Queue index maintenance and describe the job for a 202 response"""
+    try:
+        job = await index_jobs.submit(job_body, kind=kind)
+    except JobQueueFullError:
+        raise HTTPException(
+            status_code=503,
+            detail="Index job queue is full, please try again later",
+            headers={"Retry-After": "60"}
+        )
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/chat/jobs/{job.id}"
+    }
+
+@router.get("/chat/jobs/{job_id}")
+async def get_index_job(job_id: str) -> Dict[str, Any]:
+    """
+    Get the state of an index maintenance job
+    """
+    job = await index_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.post("/chat/centroids/rebuild", status_code=202)
+async def rebuild_centroids(
+    pinecone_service: PineconeService = Depends(get_pinecone_service)
+):
+    """
+    Recompute channel centroids used for two-stage retrieval.
+
+    The rebuild walks the whole index, so it runs as a background job; poll
+    /api/chat/jobs/{job_id} for the result.
+    """
+    async def job_body(job: Job) -> Dict[str, Any]:
+        return await pinecone_service.rebuild_centroids()
+
+    return await _submit_index_job(job_body, "centroid_rebuild")
+
+@router.delete("/chat/memory/{user_id}/{avatar_name}")
+async def clear_memory(
+    user_id: str,
+    avatar_name: str,
+    memory_service: MemoryService = Depends(get_memory_service)
+):
+    """Forget the conversation between a user and an avatar"""
+    try:
+        await memory_service.clear(user_id, avatar_name)
+        return {"status": "success"}
+    except Exception as e:
+        logger.error(f"Error clearing memory: {str(e)}")
+        logger.error(f"Full traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,92 @@
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends # type: ignore
+from typing import Dict, Any, List, Optional
+from ..services.document_ingest import DocumentIngestService, SUPPORTED_EXTENSIONS
+from ..services.job_runner import Job, JobRunner, JobQueueFullError
+from ..services.pinecone_service import PineconeService, get_pinecone_service
+from ..services.supabase_client import get_supabase
+from ..services.uploads import save_upload, UploadTooLargeError
+import logging
+import os
+import traceback
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Maximum accepted size per uploaded document
+MAX_DOCUMENT_SIZE = int(os.getenv("MAX_DOCUMENT_SIZE", str(25 * 1024 * 1024)))  # 25MB
+
+# Document ingestion runs in the background; state is persisted to Supabase
+document_jobs = JobRunner(
+    name="document-ingest",
+    max_workers=int(os.getenv("DOCUMENT_INGEST_WORKERS", "1")),
+    max_queue=int(os.getenv("DOCUMENT_INGEST_QUEUE_SIZE", "20")),
+    get_supabase=get_supabase,
+    table="document_ingest_jobs"
+)
+
+@router.post("/documents/ingest", status_code=202)
+async def ingest_documents(
+    files: List[UploadFile] = File(...),
+    user_id: Optional[str] = Form(None),
+    force: bool = Form(False),
+    pinecone_service: PineconeService = Depends(get_pinecone_service)
+) -> Dict[str, Any]:
+    """
+    Upload PDFs or text files into the avatar knowledge base
+    """
+    saved = []
+    try:
+        for upload in files:
+            suffix = os.path.splitext(upload.filename or "")[1].lower()
+            if suffix not in SUPPORTED_EXTENSIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Unsupported file type: {upload.filename}. Must be one of {', '.join(sorted(SUPPORTED_EXTENSIONS))}"
+                )
+            path = await save_upload(upload, max_size=MAX_DOCUMENT_SIZE, suffix=suffix)
+            saved.append({"path": path, "source": upload.filename})
+    except UploadTooLargeError as e:
+        _remove_files(saved)
+        raise HTTPException(status_code=400, detail=f"File too large. Maximum size is {e.max_size // (1024 * 1024)}MB")
+    except HTTPException:
+        _remove_files(saved)
+        raise
+
+    async def job_body(job: Job) -> Dict[str, Any]:
+        return await DocumentIngestService(pinecone_service).ingest_files(saved, user_id=user_id, force=force)
+
+    try:
+        job = await document_jobs.submit(
+            job_body, kind="document_ingest", user_id=user_id, cleanup=lambda: _remove_files(saved)
+        )
+    except JobQueueFullError:
+        _remove_files(saved)
+        raise HTTPException(
+            status_code=503,
+            detail="Document ingest queue is full, please try again later",
+            headers={"Retry-After": "60"}
+        )
+
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/documents/jobs/{job.id}" + (f"?user_id={user_id}" if user_id else "")
+    }
+
+@router.get("/documents/jobs/{job_id}")
+async def get_ingest_job(job_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get the state of a document ingest job; jobs submitted with a user_id
+    are only shown to that user
+    """
+    job = await document_jobs.get(job_id, user_id=user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+def _remove_files(saved: List[Dict[str, str]]):
+    for f in saved:
+        try:
+            os.unlink(f["path"])
+        except OSError:
+            logger.warning(f"Could not remove temp file {f['path']}: {traceback.format_exc()}")
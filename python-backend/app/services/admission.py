@@ -0,0 +1,354 @@
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Pattern, Tuple
+import asyncio
+import heapq
+import ipaddress
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import time
+from .upstream_governor import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Peers whose X-Forwarded-For is believed: the Next.js server relays chat
+# requests from the compose network, so private ranges are trusted by default
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip())
+    for network in os.getenv(
+        "ADMISSION_TRUSTED_PROXIES", "127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16"
+    ).split(",")
+    if network.strip()
+]
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str] = None) -> Optional[str]:
+    """
+    Address to apply the per-client limit to. A request from a trusted proxy
+    is attributed to the nearest untrusted X-Forwarded-For hop; without one
+    there is no client to tell apart (every user arrives from the proxy), so
+    None is returned and the per-client limit does not apply.
+    """
+    if not peer:
+        return None
+    if not _is_trusted_proxy(peer):
+        return peer
+    hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return None
+
+def _limits(name: str, concurrent: int, per_user: int, queue: int, slo: float) -> Dict[str, Any]:
+    prefix = f"ADMISSION_{name.upper()}"
+    return {
+        "max_concurrent": int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrent))),
+        "max_per_user": int(os.getenv(f"{prefix}_PER_USER", str(per_user))),
+        # Several users can share an address (NAT, office), so this is looser
+        "max_per_client": int(os.getenv(f"{prefix}_PER_CLIENT", str(per_user * 4))),
+        "max_queue": int(os.getenv(f"{prefix}_QUEUE", str(queue))),
+        "slo_seconds": float(os.getenv(f"{prefix}_SLO_SECONDS", str(slo)))
+    }
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; status is 429 (per-user) or 503 (overload)"""
+    def __init__(self, status: int, reason: str, retry_after: float):
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+class AdmissionController:
+    """
+    Concurrency limits with a bounded priority queue and wait deadlines.
+
+    A request runs immediately when a slot is free and nobody of equal or
+    higher priority is waiting. Otherwise its wait is estimated from the
+    queue ahead of it and the recent service time; if that would exceed the
+    SLO, or the queue is full, it is shed at once with a Retry-After hint
+    instead of timing out later. Waiters that pass their deadline are shed
+    too. Background requests are capped at max_background slots so they
+    never crowd out interactive ones, and their service time is tracked
+    apart from interactive requests: a rebuild holding a slot for minutes
+    must not make chat look minutes long.
+
+    Per-user limits use a key the client supplies (user ID), which is only
+    as good as the caller's honesty; the per-client limit on the caller's
+    address (see client_address) is the one a caller cannot sidestep by
+    inventing user IDs.
+    """
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int,
+        max_per_user: int,
+        max_queue: int,
+        slo_seconds: float,
+        max_background: int = 1,
+        max_per_client: Optional[int] = None
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_per_client = max_per_client or max_per_user * 4
+        self.max_queue = max_queue
+        self.slo_seconds = slo_seconds
+        self.max_background = max_background
+        self.active = 0
+        self.active_background = 0
+        self._per_user: Dict[str, int] = {}
+        self._per_client: Dict[str, int] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        # Exponentially weighted mean of time a request holds a slot, per priority
+        self._service_seconds = {PRIORITY_INTERACTIVE: 1.0, PRIORITY_BACKGROUND: 1.0}
+        self.admitted = 0
+        self.shed = {"per_user": 0, "queue_full": 0, "slo": 0, "deadline": 0}
+
+    def _estimated_wait(self, ahead: int, priority: int = PRIORITY_INTERACTIVE) -> float:
+        if priority == PRIORITY_BACKGROUND:
+            slots = self.max_background
+        else:
+            # Slots held by background work are not turning over at interactive speed
+            slots = self.max_concurrent - self.active_background
+        return math.ceil((ahead + 1) / max(1, slots)) * self._service_seconds[priority]
+
+    def _waiting_ahead(self, priority: int) -> int:
+        return sum(1 for p, _, future in self._waiters if p <= priority and not future.done())
+
+    def _can_start(self, priority: int) -> bool:
+        if self.active >= self.max_concurrent:
+            return False
+        if priority == PRIORITY_BACKGROUND and self.active_background >= self.max_background:
+            return False
+        return True
+
+    def _start(self, priority: int):
+        self.active += 1
+        if priority == PRIORITY_BACKGROUND:
+            self.active_background += 1
+        self.admitted += 1
+
+    def _stop(self, priority: int):
+        self.active -= 1
+        if priority == PRIORITY_BACKGROUND:
+            self.active_background -= 1
+        self._wake()
+
+    @staticmethod
+    def _release(counts: Dict[str, int], key: str):
+        counts[key] -= 1
+        if not counts[key]:
+            del counts[key]
+
+    def _wake(self):
+        """Hand free slots to the best waiters that are allowed to start"""
+        skipped = []
+        while self._waiters and self.active < self.max_concurrent:
+            entry = heapq.heappop(self._waiters)
+            priority, _, future = entry
+            if future.done():
+                continue
+            if not self._can_start(priority):
+                skipped.append(entry)
+                continue
+            self._start(priority)
+            future.set_result(True)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    def _reject(self, kind: str, status: int, reason: str, retry_after: float):
+        self.shed[kind] += 1
+        logger.warning(f"Admission {self.name}: shedding request ({reason})")
+        raise AdmissionRejected(status, reason, retry_after)
+
+    async def _acquire(self, priority: int):
+        if self._waiting_ahead(priority) == 0 and self._can_start(priority):
+            self._start(priority)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject(
+                "queue_full", 503, "Server busy: queue full", self._estimated_wait(len(self._waiters), priority)
+            )
+        estimate = self._estimated_wait(self._waiting_ahead(priority), priority)
+        if estimate > self.slo_seconds:
+            self._reject("slo", 503, f"Server busy: estimated wait {estimate:.1f}s exceeds SLO", estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.slo_seconds)
+        except asyncio.TimeoutError:
+            # A slot may have been granted just as the deadline passed
+            if not future.done():
+                future.cancel()
+                self._reject("deadline", 503, "Server busy: queue deadline exceeded", self._service_seconds[priority])
+        except asyncio.CancelledError:
+            # Client went away while queued; give back a slot granted meanwhile
+            if future.done() and not future.cancelled():
+                self._stop(priority)
+            else:
+                future.cancel()
+            raise
+
+    @asynccontextmanager
+    async def admit(self, user_key: str, priority: int = PRIORITY_INTERACTIVE, client_key: Optional[str] = None):
+        """
+        Hold a slot for the duration of the block, or raise AdmissionRejected.
+
+        user_key is the (client-supplied) user ID and client_key the
+        caller's address, None when unknown; each has its own concurrency
+        limit.
+        """
+        # Queued requests count against the user's limit too
+        if self._per_user.get(user_key, 0) >= self.max_per_user:
+            self._reject(
+                "per_user", 429, "Too many concurrent requests for this user", self._service_seconds[priority]
+            )
+        if client_key and self._per_client.get(client_key, 0) >= self.max_per_client:
+            self._reject(
+                "per_user", 429, "Too many concurrent requests from this client", self._service_seconds[priority]
+            )
+        self._per_user[user_key] = self._per_user.get(user_key, 0) + 1
+        if client_key:
+            self._per_client[client_key] = self._per_client.get(client_key, 0) + 1
+        try:
+            await self._acquire(priority)
+        except BaseException:
+            self._release(self._per_user, user_key)
+            if client_key:
+                self._release(self._per_client, client_key)
+            raise
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_seconds[priority] = 0.8 * self._service_seconds[priority] + 0.2 * (time.monotonic() - start)
+            self._release(self._per_user, user_key)
+            if client_key:
+                self._release(self._per_client, client_key)
+            self._stop(priority)
+
+    def stats(self) -> Dict[str, Any]:
+        waiting = sum(1 for _, _, future in self._waiters if not future.done())
+        return {
+            "active": self.active,
+            "waiting": waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "saturation": round(self.active / max(1, self.max_concurrent), 2),
+            "saturated": self.active >= self.max_concurrent,
+            "estimated_wait_seconds": round(self._estimated_wait(waiting), 2) if waiting else 0.0,
+            "service_seconds": {
+                "interactive": round(self._service_seconds[PRIORITY_INTERACTIVE], 2),
+                "background": round(self._service_seconds[PRIORITY_BACKGROUND], 2)
+            },
+            "slo_seconds": self.slo_seconds,
+            "admitted": self.admitted,
+            "shed": dict(self.shed)
+        }
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying admission controllers to matching HTTP routes.
+
+    The slot is held until the response body has been sent, so streaming
+    responses count for their whole duration. Callers are identified by the
+    X-User-Id header or user_id query parameter, falling back to client IP;
+    the client IP is limited separately since the user ID can be forged.
+    Behind a trusted proxy the client IP comes from X-Forwarded-For.
+
+    WebSocket scopes pass through: a connection would hold its slot while
+    idle between questions, so the voice chat handler admits each turn
+    itself (see admit_turn).
+    """
+    def __init__(self, app, rules: List[Tuple[str, Pattern, AdmissionController, int]]):
+        self.app = app
+        self.rules = rules
+
+    def _match(self, scope) -> Optional[Tuple[AdmissionController, int]]:
+        for method, pattern, controller, priority in self.rules:
+            if scope["method"] == method and pattern.fullmatch(scope["path"]):
+                return controller, priority
+        return None
+
+    @staticmethod
+    def _client_key(scope) -> Optional[str]:
+        client = scope.get("client")
+        forwarded_for = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                forwarded_for = value.decode("latin-1")
+        return client_address(client[0] if client else None, forwarded_for)
+
+    @staticmethod
+    def _user_key(scope) -> str:
+        for name, value in scope.get("headers", []):
+            if name == b"x-user-id" and value:
+                return value.decode("latin-1")
+        match = re.search(r"(?:^|&)user_id=([^&]+)", scope.get("query_string", b"").decode("latin-1"))
+        if match:
+            return match.group(1)
+        client = scope.get("client")
+        return client[0] if client else "anonymous"
+
+    async def __call__(self, scope, receive, send):
+        matched = self._match(scope) if scope["type"] == "http" else None
+        if matched is None:
+            await self.app(scope, receive, send)
+            return
+
+        controller, priority = matched
+        try:
+            async with controller.admit(self._user_key(scope), priority, client_key=self._client_key(scope)):
+                await self.app(scope, receive, send)
+        except AdmissionRejected as e:
+            body = json.dumps({"detail": e.reason}).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": e.status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(e.retry_after))).encode())
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+
+# One controller per downstream pool: chat/retrieval work and speech synthesis
+chat_admission = AdmissionController("chat", **_limits("chat", concurrent=16, per_user=2, queue=64, slo=8.0))
+tts_admission = AdmissionController("tts", **_limits("tts", concurrent=8, per_user=2, queue=32, slo=5.0))
+
+ADMISSION_RULES = [
+    ("POST", re.compile(r"/api/chat"), chat_admission, PRIORITY_INTERACTIVE),
+    ("POST", re.compile(r"/api/batch-process"), chat_admission, PRIORITY_BACKGROUND),
+    ("POST", re.compile(r"/api/chat/reconcile"), chat_admission, PRIORITY_BACKGROUND),
+    ("POST", re.compile(r"/api/chat/shards/[^/]+/rebuild"), chat_admission, PRIORITY_BACKGROUND),
+    ("POST", re.compile(r"/api/chat/centroids/rebuild"), chat_admission, PRIORITY_BACKGROUND),
+    ("POST", re.compile(r"/tts/[^/]+(/chunked)?"), tts_admission, PRIORITY_INTERACTIVE),
+]
+
+@asynccontextmanager
+async def admit_turn(user_key: str, client_key: Optional[str] = None):
+    """
+    Admit one voice chat turn, which needs both the chat and the TTS pool.
+    Pools are always taken in the same order, so turns cannot deadlock.
+    """
+    async with chat_admission.admit(user_key, client_key=client_key):
+        async with tts_admission.admit(user_key, client_key=client_key):
+            yield
+
+def admission_stats() -> Dict[str, Any]:
+    return {controller.name: controller.stats() for controller in (chat_admission, tts_admission)}
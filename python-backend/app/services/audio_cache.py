@@ -0,0 +1,48 @@
+from typing import Optional
+from .shared_cache import SharedCache, shared_cache
+from .audio_formats import DEFAULT_OUTPUT_FORMAT
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+class AudioCache:
+    """
+    Cache for synthesized audio chunks, shared by all worker processes
+    """
+    def __init__(self, namespace: str = "tts", ttl: Optional[float] = None, store: Optional[SharedCache] = None):
+        self.namespace = namespace
+        self.ttl = ttl or float(os.getenv("TTS_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+        self.store = store or shared_cache
+
+    @staticmethod
+    def make_key(
+        text: str,
+        voice_id: str,
+        model_id: str,
+        optimize_streaming_latency: int = 0,
+        output_format: str = DEFAULT_OUTPUT_FORMAT
+    ) -> str:
+        """Build a stable cache key for one synthesized chunk in one output format"""
+        raw = f"{voice_id}|{model_id}|{optimize_streaming_latency}|{text}"
+        # The default format keeps its original keys so existing entries stay valid
+        if output_format != DEFAULT_OUTPUT_FORMAT:
+            raw = f"{output_format}|{raw}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.store.get(self.namespace, key)
+
+    def set(self, key: str, audio: bytes):
+        self.store.set(self.namespace, key, audio, ttl=self.ttl)
+
+    async def aget(self, key: str) -> Optional[bytes]:
+        return await self.store.aget(self.namespace, key)
+
+    async def aset(self, key: str, audio: bytes):
+        await self.store.aset(self.namespace, key, audio, ttl=self.ttl)
+
+# Shared across requests; ElevenLabsService instances are per-request
+tts_cache = AudioCache()
@@ -0,0 +1,92 @@
+from typing import Dict, Any, List, Optional
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_OUTPUT_FORMAT = "mp3_44100_128"
+
+# Concurrent local ffmpeg transcodes per worker process
+TRANSCODE_WORKERS = int(os.getenv("TTS_TRANSCODE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# Formats ElevenLabs returns directly are requested with ?output_format=;
+# the rest are transcoded locally from "source" with ffmpeg.
+OUTPUT_FORMATS: Dict[str, Dict[str, Any]] = {
+    "mp3_44100_128": {"upstream": True, "media_type": "audio/mpeg"},
+    "mp3_44100_64": {"upstream": True, "media_type": "audio/mpeg"},
+    # Low-bitrate speech for constrained mobile links
+    "mp3_22050_32": {"upstream": True, "media_type": "audio/mpeg"},
+    # Raw 16-bit little-endian mono PCM for local playback pipelines
+    "pcm_16000": {"upstream": True, "media_type": "audio/pcm;rate=16000;encoding=s16le"},
+    "pcm_22050": {"upstream": True, "media_type": "audio/pcm;rate=22050;encoding=s16le"},
+    "pcm_24000": {"upstream": True, "media_type": "audio/pcm;rate=24000;encoding=s16le"},
+    "ulaw_8000": {"upstream": True, "media_type": "audio/basic"},
+    # Ogg Opus, transcoded locally
+    "opus_48000_32": {
+        "upstream": False,
+        "source": "mp3_44100_128",
+        "media_type": "audio/ogg; codecs=opus",
+        "ffmpeg_args": ["-f", "ogg", "-c:a", "libopus", "-b:a", "32k", "-ar", "48000", "-ac", "1", "-application", "voip"]
+    },
+    "opus_48000_64": {
+        "upstream": False,
+        "source": "mp3_44100_128",
+        "media_type": "audio/ogg; codecs=opus",
+        "ffmpeg_args": ["-f", "ogg", "-c:a", "libopus", "-b:a", "64k", "-ar", "48000", "-ac", "1"]
+    }
+}
+
+class TranscodeError(RuntimeError):
+    """Raised when local transcoding fails or ffmpeg is unavailable"""
+
+def get_output_format(name: Optional[str]) -> Dict[str, Any]:
+    """Look up a format by name, raising ValueError for unknown names"""
+    fmt = OUTPUT_FORMATS.get(name or DEFAULT_OUTPUT_FORMAT)
+    if fmt is None:
+        raise ValueError(f"Unsupported output_format {name!r}; expected one of {sorted(OUTPUT_FORMATS)}")
+    return fmt
+
+def media_type(name: Optional[str]) -> str:
+    return get_output_format(name)["media_type"]
+
+_slots: Optional[asyncio.Semaphore] = None
+
+async def transcode(audio: bytes, name: str) -> bytes:
+    """
+    Transcode source audio to a local-only format with ffmpeg.
+
+    ffmpeg runs as a subprocess, so the event loop stays free; at most
+    TRANSCODE_WORKERS run at once per worker process.
+    """
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(TRANSCODE_WORKERS)
+
+    args: List[str] = get_output_format(name)["ffmpeg_args"]
+    async with _slots:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG_BINARY, "-hide_banner", "-loglevel", "error",
+                "-i", "pipe:0", *args, "pipe:1",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise TranscodeError(f"{FFMPEG_BINARY} not found; install ffmpeg to use {name}")
+        try:
+            output, errors = await process.communicate(audio)
+        except asyncio.CancelledError:
+            # The caller went away (e.g. client disconnect); don't leave ffmpeg running
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            raise
+
+    if process.returncode != 0:
+        raise TranscodeError(f"ffmpeg failed for {name}: {errors.decode('utf-8', 'replace')[-500:]}")
+    logger.info(f"Transcoded {len(audio)} bytes to {name}: {len(output)} bytes")
+    return output
@@ -0,0 +1,164 @@
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+import os
+import time
+from .supabase_client import get_supabase
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CENTROID_TABLE = "channel_centroids"
+# Channels picked by centroid before the filtered message search; 0 searches
+# every channel (flat). Enable once centroids are populated, e.g. after
+# POST /api/chat/centroids/rebuild.
+CENTROID_TOP_CHANNELS = int(os.getenv("CENTROID_TOP_CHANNELS", "0"))
+# Seconds the in-process centroid matrix is reused before reloading
+CENTROID_CACHE_TTL = float(os.getenv("CENTROID_CACHE_TTL_SECONDS", "300"))
+CENTROID_PAGE_SIZE = 500
+
+# numpy is imported inside functions so importing this module stays cheap
+
+def centroid_matrix(sums):
+    """
+    Stack channels' summed chunk vectors into a float32 matrix of unit rows
+    (the direction of the sum is the centroid's). Built once per load, not
+    per query.
+    """
+    import numpy as np # type: ignore
+
+    matrix = np.asarray(sums, dtype=np.float32)
+    if matrix.ndim != 2:
+        return np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def rank_channels(
+    query: Sequence[float],
+    channel_ids: List[str],
+    matrix,
+    top_c: int,
+    positions=None
+) -> List[Tuple[str, float]]:
+    """
+    Top channels by cosine similarity between the query and the unit rows
+    of a centroid_matrix, optionally only among the given row positions.
+    """
+    import numpy as np # type: ignore
+
+    if not channel_ids or top_c <= 0:
+        return []
+    query = np.asarray(query, dtype=np.float32)
+    scores = (matrix @ query) / (float(np.linalg.norm(query)) or 1.0)
+    if positions is not None:
+        positions = np.asarray(positions, dtype=np.intp)
+        if not len(positions):
+            return []
+        order = positions[np.argsort(-scores[positions])[:top_c]]
+    elif top_c < len(scores):
+        candidates = np.argpartition(-scores, top_c)[:top_c]
+        order = candidates[np.argsort(-scores[candidates])]
+    else:
+        order = np.argsort(-scores)
+    return [(channel_ids[i], float(scores[i])) for i in order]
+
+class ChannelCentroids:
+    """
+    Per-channel summary vectors for two-stage retrieval.
+
+    Each row keeps the running sum and count of a channel's chunk vectors.
+    Upserts add to it atomically in Postgres (add_to_channel_centroid), so
+    workers don't race; edits and deletes are not subtracted, and
+    PineconeService.rebuild_centroids recomputes exact sums from the index.
+    Queries rank channels against an in-process matrix of unit centroids,
+    built when the rows are loaded and reloaded after a TTL.
+    """
+    def __init__(self, ttl: float = CENTROID_CACHE_TTL):
+        self.ttl = ttl
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._matrix = None
+        self._loaded_at: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _load(self):
+        supabase = get_supabase()
+        rows = []
+        offset = 0
+        while True:
+            page = (await asyncio.to_thread(
+                lambda: supabase.table(CENTROID_TABLE).select("channel_id, vector_sum")
+                .order("channel_id").range(offset, offset + CENTROID_PAGE_SIZE - 1).execute()
+            )).data
+            rows.extend(page)
+            if len(page) < CENTROID_PAGE_SIZE:
+                break
+            offset += CENTROID_PAGE_SIZE
+
+        # Rows written before an embedding size change are skipped until rebuilt
+        dims = max((len(row["vector_sum"]) for row in rows), default=0)
+        rows = [row for row in rows if len(row["vector_sum"]) == dims]
+        ids = [str(row["channel_id"]) for row in rows]
+        matrix = await asyncio.to_thread(centroid_matrix, [row["vector_sum"] for row in rows])
+        self._ids, self._matrix = ids, matrix
+        self._positions = {channel_id: i for i, channel_id in enumerate(ids)}
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(rows)} channel centroids")
+
+    async def _ensure_fresh(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+                await self._load()
+
+    async def select(
+        self,
+        query: Sequence[float],
+        top_c: int,
+        channel_ids: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """Most relevant channels for a query, optionally limited to the given ones"""
+        await self._ensure_fresh()
+        ids, matrix = self._ids, self._matrix
+        positions = None
+        if channel_ids is not None:
+            positions = sorted(self._positions[c] for c in channel_ids if c in self._positions)
+        return await asyncio.to_thread(rank_channels, query, ids, matrix, top_c, positions)
+
+    async def add(self, deltas: Dict[str, Tuple[str, List[float], int]]):
+        """Add channel_id -> (namespace, vector sum, vector count) to the stored sums"""
+        supabase = get_supabase()
+        for channel_id, (namespace, vector_sum, count) in deltas.items():
+            await asyncio.to_thread(
+                lambda: supabase.rpc("add_to_channel_centroid", {
+                    "p_channel_id": channel_id,
+                    "p_namespace": namespace,
+                    "p_delta": vector_sum,
+                    "p_count": count
+                }).execute()
+            )
+
+    async def replace(self, namespace: str, sums: Dict[str, Tuple[List[float], int]]):
+        """Overwrite the centroids of a namespace with exact sums"""
+        supabase = get_supabase()
+        await asyncio.to_thread(
+            lambda: supabase.table(CENTROID_TABLE).delete().eq("namespace", namespace).execute()
+        )
+        rows = [
+            {"channel_id": channel_id, "namespace": namespace, "vector_sum": vector_sum, "vector_count": count}
+            for channel_id, (vector_sum, count) in sums.items()
+        ]
+        for i in range(0, len(rows), CENTROID_PAGE_SIZE):
+            batch = rows[i:i + CENTROID_PAGE_SIZE]
+            await asyncio.to_thread(lambda: supabase.table(CENTROID_TABLE).upsert(batch).execute())
+        self.invalidate()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+# Shared by every request in the process
+channel_centroids = ChannelCentroids()
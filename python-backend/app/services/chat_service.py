@@ -1,10 +1,26 @@
-from langchain_openai import ChatOpenAI # type: ignore
-from langchain.schema import HumanMessage, SystemMessage # type: ignore
 import os
+import asyncio
 import logging
-from .pinecone_service import PineconeService
-from typing import List, Dict, Any
-from supabase import create_client, Client # type: ignore
+import traceback
+from .pinecone_service import get_pinecone_service, MESSAGES_NAMESPACE, DOCUMENTS_NAMESPACE
+from .supabase_client import get_supabase
+from .model_router import ModelRouter, classify
+from .lazy import lazy_resource
+from .shared_cache import shared_cache
+from .reranker import reranker, RERANK_CANDIDATES, RERANK_TOP_N
+from .metrics import metrics
+from .memory_service import memory_service
+from typing import List, Dict, Any, Optional, AsyncIterator
+import hashlib
+import time
+
+# Chat history, plus ingested documents unless disabled
+SEARCH_NAMESPACES = [MESSAGES_NAMESPACE]
+if os.getenv("DOCUMENT_SEARCH_ENABLED", "true").lower() == "true":
+    SEARCH_NAMESPACES.append(DOCUMENTS_NAMESPACE)
+
+# Answers are cached across workers when a TTL is set; 0 disables the cache
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "0"))
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -15,16 +31,13 @@ class ChatService:
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key:
                 raise ValueError("OPENAI_API_KEY not found in environment variables")
-            self.chat = ChatOpenAI(
-                model="gpt-4o-mini",
-                openai_api_key=api_key,
-                temperature=0.7
-            )
-            self.pinecone_service = PineconeService()
-            self.supabase = create_client(
-                os.getenv("NEXT_PUBLIC_SUPABASE_URL"),
-                os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
-            )
+            self.api_key = api_key
+            # Tiered models with hedging and fallback
+            self.router = ModelRouter(api_key)
+            self.pinecone_service = get_pinecone_service()
+            self.supabase = get_supabase()
+            # Keeps fire-and-forget memory writes referenced until they finish
+            self._background_tasks = set()
         except Exception as e:
             logger.error("Error initializing ChatService")
             raise
@@ -62,59 +75,120 @@ class ChatService:
                 
         return "\n".join(context_parts)
 
-    async def generate_response(self, message: str, avatar_name: str, avatar_instructions: str = None) -> Dict[str, Any]:
+    @staticmethod
+    def _answer_cache_key(message: str, avatar_name: str, avatar_instructions: Optional[str]) -> Optional[str]:
+        """Key answers by avatar and the whitespace/case-normalized question"""
+        if ANSWER_CACHE_TTL <= 0:
+            return None
+        normalized = " ".join(message.lower().split())
+        raw = f"{avatar_name}|{avatar_instructions or ''}|{normalized}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def _memory_window(self, user_id: str, avatar_name: str) -> Optional[Dict[str, Any]]:
+        """Conversation memory for the prompt; chat stays stateless if memory is unavailable"""
         try:
-            logger.debug(f"Using avatar name: {avatar_name}")
-            logger.debug("Searching for similar messages...")
-            similar_messages = await self.pinecone_service.query_similar(message, top_k=5)
+            service = await memory_service.aget()
+            return await service.get_window(user_id, avatar_name)
+        except Exception as e:
+            logger.error(f"Error loading conversation memory: {str(e)}")
+            return None
+
+    async def _remember(self, user_id: str, avatar_name: str, message: str, response: str):
+        try:
+            service = await memory_service.aget()
+            await service.record_turn(user_id, avatar_name, message, response)
+        except Exception as e:
+            logger.error(f"Error recording conversation turn: {str(e)}")
+            logger.error(f"Full traceback: {traceback.format_exc()}")
+
+    async def _prepare_prompt(
+        self,
+        message: str,
+        avatar_name: str,
+        avatar_instructions: Optional[str],
+        user_id: Optional[str]
+    ):
+        """Retrieve references and memory and build the LLM messages, citations and references"""
+        from langchain.schema import AIMessage, HumanMessage, SystemMessage # type: ignore
+
+        logger.debug(f"Using avatar name: {avatar_name}")
+        # Load memory while retrieval runs
+        memory_task = asyncio.create_task(self._memory_window(user_id, avatar_name)) if user_id else None
+        logger.debug("Searching for similar messages...")
+        # Retrieve many, re-rank few. Hits are hydrated with current names
+        # and message metadata in one lookup.
+        retrieval_start = time.perf_counter()
+        try:
+            candidates = await self.pinecone_service.query_similar(
+                message, top_k=RERANK_CANDIDATES, namespaces=SEARCH_NAMESPACES, hydrate=True, user_id=user_id
+            )
+            metrics.observe("retrieval_ms", (time.perf_counter() - retrieval_start) * 1000)
+            similar_messages = await reranker.rerank(
+                message,
+                [msg for msg in candidates if msg["similarity_score"] >= 0.22],  # Same floor as before
+                top_n=RERANK_TOP_N,
+                author_name=avatar_name
+            )
+        except BaseException:
+            # Don't leave the memory load running when retrieval fails or is cancelled
+            if memory_task:
+                memory_task.cancel()
+            raise
+        
+        # Format numbered references
+        filtered_messages = []
+        citations = []
+        references = []
+        
+        for i, msg in enumerate(similar_messages, 1):
+            citation_id = f"cite_{i}"
+            metadata = msg["metadata"]
+            message_type = metadata["message_type"]
+            user_name = metadata.get("user_name", "Unknown User")
             
-            # Filter and format numbered references
-            filtered_messages = []
-            citations = []
-            references = []
+            # Format reference for LLM
+            if message_type == "document":
+                source = metadata.get("source", "Unknown Document")
+                page = metadata.get("page")
+                location = f", page {int(page) + 1}" if page is not None else ""
+                ref_text = f"Reference [{i}] (from document {source}{location}): {msg['content']}"
+                user_name = source
+            elif message_type == "channel":
+                channel_name = metadata.get("channel_name", "Unknown Channel")
+                ref_text = f"Reference [{i}] (from {user_name} in #{channel_name}): {msg['content']}"
+            else:
+                receiver_name = metadata.get("receiver_name", "Unknown User")
+                ref_text = f"Reference [{i}] (from {user_name} in DM): {msg['content']}"
             
-            for i, msg in enumerate(similar_messages, 1):
-                if msg["similarity_score"] >= 0.22:  # Same threshold as before
-                    citation_id = f"cite_{i}"
-                    metadata = msg["metadata"]
-                    message_type = metadata["message_type"]
-                    user_name = metadata.get("user_name", "Unknown User")
-                    
-                    # Format reference for LLM
-                    if message_type == "channel":
-                        channel_name = metadata.get("channel_name", "Unknown Channel")
-                        ref_text = f"Reference [{i}] (from {user_name} in #{channel_name}): {msg['content']}"
-                    else:
-                        receiver_name = metadata.get("receiver_name", "Unknown User")
-                        ref_text = f"Reference [{i}] (from {user_name} in DM): {msg['content']}"
-                    
-                    filtered_messages.append(ref_text)
-                    
-                    # Prepare citation data
-                    citations.append({
-                        "id": citation_id,
-                        "messageId": metadata.get("message_id", ""),
-                        "similarityScore": msg["similarity_score"],
-                        "previewText": msg["content"][:100],  # First 100 chars
-                        "metadata": {
-                            "timestamp": metadata.get("timestamp", ""),
-                            "userId": metadata.get("user_id", ""),
-                            "userName": user_name,
-                            "channelId": metadata.get("channel_id") if message_type == "channel" else None,
-                            "channelName": channel_name if message_type == "channel" else None,
-                            "isDirectMessage": message_type == "direct_message",
-                            "receiverId": metadata.get("receiver_id") if message_type == "direct_message" else None,
-                            "receiverName": receiver_name if message_type == "direct_message" else None
-                        }
-                    })
-                    references.append({
-                        "citationId": citation_id,
-                        "inlinePosition": i,
-                        "referenceText": str(i)
-                    })
+            filtered_messages.append(ref_text)
             
-            # Create base system message with actual avatar name
-            system_message = f"""You are {avatar_name}, respond from their point of view.
+            # Prepare citation data
+            citations.append({
+                "id": citation_id,
+                "messageId": metadata.get("message_id", ""),
+                "similarityScore": msg["similarity_score"],
+                "previewText": msg["content"][:100],  # First 100 chars
+                "metadata": {
+                    "timestamp": metadata.get("timestamp", ""),
+                    "userId": metadata.get("user_id", ""),
+                    "userName": user_name,
+                    "channelId": metadata.get("channel_id") if message_type == "channel" else None,
+                    "channelName": channel_name if message_type == "channel" else None,
+                    "isDirectMessage": message_type == "direct_message",
+                    "receiverId": metadata.get("receiver_id") if message_type == "direct_message" else None,
+                    "receiverName": receiver_name if message_type == "direct_message" else None,
+                    "documentId": metadata.get("document_id") if message_type == "document" else None,
+                    "page": metadata.get("page") if message_type == "document" else None
+                }
+            })
+            references.append({
+                "citationId": citation_id,
+                "inlinePosition": i,
+                "referenceText": str(i)
+            })
+        
+        # Create base system message with actual avatar name
+        system_message = f"""You are {avatar_name}, respond from their point of view.
 
 You have access to previous messages as numbered references. You should actively use these references to support your responses. 
 When you mention ANY information from the references, you MUST cite them using the {{ref:N}} format where N is the reference number.
@@ -133,36 +207,112 @@ Do not explicitly say "Reference [N]" or "available references" in your final re
 Instead, use phrases like "from what I could find..." or "based on the material I have..." when citing. If you cannot find specific information, 
 respond deterministically (e.g., "From what I can find, that information is not specified.")."""
 
-            # Add references
-            system_message += "\n\nAvailable references:\n" + "\n".join(filtered_messages)
-            
-               # Add avatar instructions if provided
-            if avatar_instructions:
-                system_message += f"\n\nPersonality Instructions:\n{avatar_instructions}"
-
-            # Create messages array
-            messages = [
-                SystemMessage(content=system_message),
-                HumanMessage(content=message)
+        # Add references
+        system_message += "\n\nAvailable references:\n" + "\n".join(filtered_messages)
+        
+           # Add avatar instructions if provided
+        if avatar_instructions:
+            system_message += f"\n\nPersonality Instructions:\n{avatar_instructions}"
+
+        memory = await memory_task if memory_task else None
+        history = []
+        if memory:
+            if memory["summary"]:
+                system_message += f"\n\nSummary of your earlier conversation with this user:\n{memory['summary']}"
+            history = [
+                HumanMessage(content=turn["content"]) if turn["role"] == "user" else AIMessage(content=turn["content"])
+                for turn in memory["turns"]
             ]
-            
-            logger.debug("Generating response with citations")
-            response = await self.chat.agenerate([messages])
+
+        # Create messages array
+        messages = [
+            SystemMessage(content=system_message),
+            *history,
+            HumanMessage(content=message)
+        ]
+        return messages, citations, references
+
+    async def generate_response(
+        self,
+        message: str,
+        avatar_name: str,
+        avatar_instructions: str = None,
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        # Answers depend on conversation history once memory is in play
+        cache_key = None if user_id else self._answer_cache_key(message, avatar_name, avatar_instructions)
+        if cache_key:
+            cached = await shared_cache.aget_json("answers", cache_key)
+            if cached is not None:
+                logger.debug("Answer cache hit")
+                return cached
+
+        try:
+            messages, citations, references = await self._prepare_prompt(
+                message, avatar_name, avatar_instructions, user_id
+            )
+
+            tier = classify(message, has_context=bool(references))
+            logger.debug(f"Generating response with citations on the {tier} tier")
+            response = await self.router.generate(messages, tier)
             
             # Add debug logging
             logger.debug("LLM Response:")
-            logger.debug(response.generations[0][0].text)
+            logger.debug(response["text"])
             logger.debug("Citations:")
             logger.debug(citations)
             logger.debug("References:")
             logger.debug(references)
             
-            return {
-                "response": response.generations[0][0].text,
+            result = {
+                "response": response["text"],
                 "citations": citations,
                 "references": references
             }
+            if cache_key:
+                await shared_cache.aset_json("answers", cache_key, result, ttl=ANSWER_CACHE_TTL)
+            if user_id:
+                self._remember_later(user_id, avatar_name, message, result["response"])
+            return result
             
         except Exception as e:
             logger.error(f"Error generating response: {type(e).__name__}")
-            raise
\ No newline at end of file
+            raise
+
+    async def stream_response(
+        self,
+        message: str,
+        avatar_name: str,
+        avatar_instructions: Optional[str] = None,
+        user_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream an answer as events: one {"type": "citations"} as soon as
+        retrieval finishes, {"type": "delta", "text"} per token, and a final
+        {"type": "done", "response"} with the full text
+        """
+        messages, citations, references = await self._prepare_prompt(
+            message, avatar_name, avatar_instructions, user_id
+        )
+        yield {"type": "citations", "citations": citations, "references": references}
+
+        parts = []
+        async for delta in self.router.astream(messages, classify(message, has_context=bool(references))):
+            parts.append(delta)
+            yield {"type": "delta", "text": delta}
+
+        response = "".join(parts)
+        if user_id:
+            self._remember_later(user_id, avatar_name, message, response)
+        yield {"type": "done", "response": response}
+
+    def _remember_later(self, user_id: str, avatar_name: str, message: str, response: str):
+        task = asyncio.create_task(self._remember(user_id, avatar_name, message, response))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+# Shared instance, constructed on first use or during background warm-up
+chat_service = lazy_resource("chat", ChatService)
+
+def get_chat_service() -> ChatService:
+    return chat_service.get()
@@ -0,0 +1,140 @@
+from typing import Dict, Any, Iterable, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+from .supabase_client import get_supabase
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# After this many seconds the next lookup pulls rows changed since the last refresh
+DIRECTORY_CACHE_TTL = float(os.getenv("DIRECTORY_CACHE_TTL_SECONDS", "300"))
+DIRECTORY_PAGE_SIZE = 1000
+# IDs per Supabase in_() filter, which travels in the URL
+DIRECTORY_IN_BATCH_SIZE = 200
+
+USER_COLUMNS = "id, username, display_name, updated_at"
+CHANNEL_COLUMNS = "id, name, workspace_id, is_private, updated_at"
+
+class _Table:
+    """Cached rows of one table, keyed by ID, with an updated_at watermark"""
+    def __init__(self, name: str, columns: str):
+        self.name = name
+        self.columns = columns
+        self.rows: Dict[str, Dict[str, Any]] = {}
+        self.watermark: Optional[str] = None
+        self.refreshed_at: Optional[float] = None
+
+    def apply(self, row: Dict[str, Any]):
+        self.rows[str(row["id"])] = row
+        updated_at = row.get("updated_at")
+        if updated_at and (self.watermark is None or updated_at > self.watermark):
+            self.watermark = updated_at
+
+class DirectoryCache:
+    """
+    Process-wide cache of user and channel names.
+
+    The first lookup loads both tables; after the TTL, lookups pull only rows
+    whose updated_at moved past the watermark. IDs not yet cached (e.g. a
+    user who signed up since the last refresh) are fetched on demand in one
+    batched query. Callers that know of a rename can push it with apply_*.
+    """
+    def __init__(self, ttl: float = DIRECTORY_CACHE_TTL):
+        self.ttl = ttl
+        self.users = _Table("users", USER_COLUMNS)
+        self.channels = _Table("channels", CHANNEL_COLUMNS)
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _refresh_table(self, table: _Table):
+        supabase = get_supabase()
+        full = table.refreshed_at is None
+        offset = 0
+        fetched = 0
+        while True:
+            def query():
+                q = supabase.table(table.name).select(table.columns)
+                if not full and table.watermark:
+                    q = q.gt("updated_at", table.watermark)
+                return q.order("id").range(offset, offset + DIRECTORY_PAGE_SIZE - 1).execute()
+            page = (await asyncio.to_thread(query)).data
+            for row in page:
+                table.apply(row)
+            fetched += len(page)
+            if len(page) < DIRECTORY_PAGE_SIZE:
+                break
+            offset += DIRECTORY_PAGE_SIZE
+        table.refreshed_at = time.monotonic()
+        logger.info(f"Directory {'loaded' if full else 'refreshed'} {table.name}: {fetched} rows")
+
+    async def _ensure_fresh(self, table: _Table):
+        if table.refreshed_at is not None and time.monotonic() - table.refreshed_at < self.ttl:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another task may have refreshed while we waited
+            if table.refreshed_at is None or time.monotonic() - table.refreshed_at >= self.ttl:
+                await self._refresh_table(table)
+
+    async def _lookup(self, table: _Table, ids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        await self._ensure_fresh(table)
+        wanted = {str(i) for i in ids if i}
+        missing = [i for i in wanted if i not in table.rows]
+        supabase = get_supabase() if missing else None
+        for start in range(0, len(missing), DIRECTORY_IN_BATCH_SIZE):
+            batch = missing[start:start + DIRECTORY_IN_BATCH_SIZE]
+            response = await asyncio.to_thread(
+                lambda: supabase.table(table.name).select(table.columns).in_("id", batch).execute()
+            )
+            for row in response.data:
+                table.apply(row)
+        return {i: table.rows[i] for i in wanted if i in table.rows}
+
+    async def get_users(self, ids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        return await self._lookup(self.users, ids)
+
+    async def get_channels(self, ids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        return await self._lookup(self.channels, ids)
+
+    async def name_maps(
+        self,
+        user_ids: Iterable[Any],
+        channel_ids: Iterable[Any]
+    ) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """user_id -> username and channel_id -> name for the given IDs"""
+        users, channels = await asyncio.gather(self.get_users(user_ids), self.get_channels(channel_ids))
+        return (
+            {user_id: row["username"] for user_id, row in users.items()},
+            {channel_id: row["name"] for channel_id, row in channels.items()}
+        )
+
+    async def all_name_maps(self) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Name maps for every cached user and channel, refreshing if stale"""
+        await asyncio.gather(self._ensure_fresh(self.users), self._ensure_fresh(self.channels))
+        return (
+            {user_id: row["username"] for user_id, row in self.users.rows.items()},
+            {channel_id: row["name"] for channel_id, row in self.channels.rows.items()}
+        )
+
+    async def all_channels(self) -> Dict[str, Dict[str, Any]]:
+        """Every cached channel row, refreshing if stale"""
+        await self._ensure_fresh(self.channels)
+        return dict(self.channels.rows)
+
+    def apply_user(self, row: Dict[str, Any]):
+        self.users.apply(row)
+
+    def apply_channel(self, row: Dict[str, Any]):
+        self.channels.apply(row)
+
+    def invalidate(self):
+        """Force a full reload on the next lookup"""
+        for table in (self.users, self.channels):
+            table.rows.clear()
+            table.watermark = None
+            table.refreshed_at = None
+
+# Shared by every service in the process
+directory_cache = DirectoryCache()
@@ -0,0 +1,265 @@
+from typing import Dict, Any, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+import asyncio
+import hashlib
+import logging
+import os
+import traceback
+from .pinecone_service import PineconeService, UPSERT_BATCH_SIZE, DOCUMENTS_NAMESPACE
+from .upstream_governor import governor, background_priority
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DOCUMENTS_TABLE = "ingested_documents"
+SUPPORTED_EXTENSIONS = {".pdf", ".txt", ".md"}
+
+DOCUMENT_CHUNK_SIZE = int(os.getenv("DOCUMENT_CHUNK_SIZE", "1000"))
+DOCUMENT_CHUNK_OVERLAP = int(os.getenv("DOCUMENT_CHUNK_OVERLAP", "200"))
+# Chunks per embedding request
+EMBED_BATCH_SIZE = int(os.getenv("DOCUMENT_EMBED_BATCH_SIZE", "100"))
+# Parsing processes per server worker. Every gunicorn worker (WEB_CONCURRENCY,
+# cpu_count by default) has its own pool, so each gets its share of the CPUs
+_SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+INGEST_PROCESSES = int(os.getenv(
+    "DOCUMENT_INGEST_PROCESSES", str(max(1, min(2, (os.cpu_count() or 1) // max(1, _SERVER_WORKERS))))
+))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=INGEST_PROCESSES)
+    return _executor
+
+def parse_and_chunk(path: str, chunk_size: int, chunk_overlap: int) -> List[Dict[str, Any]]:
+    """
+    Load a PDF or text file and split it into chunks.
+
+    Runs in a worker process: PDF parsing and splitting are CPU-bound.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter # type: ignore
+
+    if path.lower().endswith(".pdf"):
+        from langchain_community.document_loaders.pdf import PyPDFLoader # type: ignore
+        pages = PyPDFLoader(path).load()
+    else:
+        from langchain_community.document_loaders import TextLoader # type: ignore
+        pages = TextLoader(path, autodetect_encoding=True).load()
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+    for page in pages:
+        for text in splitter.split_text(page.page_content):
+            if text.strip():
+                chunks.append({"text": text, "page": page.metadata.get("page")})
+    return chunks
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def collect_files(paths: List[str]) -> List[Path]:
+    """Expand directories into the supported files they contain"""
+    files = []
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            files.extend(
+                p for p in sorted(path.rglob("*"))
+                if p.is_file() and p.suffix.lower() in SUPPORTED_EXTENSIONS
+            )
+        elif path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS:
+            files.append(path)
+        else:
+            logger.warning(f"Skipping unsupported path: {raw}")
+    return files
+
+class DocumentIngestService:
+    """
+    Ingests PDFs and text files into the ``documents`` namespace.
+
+    Files are parsed and chunked in a process pool, chunks are embedded in
+    batches and upserted as doc_<document_id>#<n>, where the document ID
+    is derived from the owner and the source name, so same-named files of
+    different users don't overwrite each other. A manifest table keyed by
+    document ID records each file's content hash, so unchanged files are
+    skipped on re-ingest.
+    """
+    def __init__(self, pinecone_service: PineconeService):
+        self.pinecone_service = pinecone_service
+        self.supabase = pinecone_service.supabase
+
+    @staticmethod
+    def document_id(source: str, owner: Optional[str] = None) -> str:
+        # Shared documents keep the IDs they had before IDs included the owner
+        raw = f"{owner}|{source}" if owner else source
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+    async def _load_manifest(self, document_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        # Document IDs are hex, so they are safe in a PostgREST in() list
+        # unlike file names
+        response = await asyncio.to_thread(
+            lambda: self.supabase.table(DOCUMENTS_TABLE).select("*").in_("document_id", document_ids).execute()
+        )
+        return {row["document_id"]: row for row in response.data}
+
+    async def _current_versions(self, sources: List[str], owner: Optional[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Manifest row per source for this owner. A user's document indexed
+        before IDs included the owner is returned under its old ID, so
+        re-ingesting it replaces the old vectors.
+        """
+        ids = {source: self.document_id(source, owner) for source in sources}
+        legacy = {source: self.document_id(source) for source in sources} if owner else {}
+        manifest = await self._load_manifest(sorted(set(ids.values()) | set(legacy.values())))
+
+        current = {}
+        for source in sources:
+            row = manifest.get(ids[source])
+            if row is None and source in legacy:
+                old = manifest.get(legacy[source])
+                if old is not None and str(old.get("user_id")) == str(owner):
+                    row = old
+            if row is not None:
+                current[source] = row
+        return current
+
+    async def ingest_files(
+        self,
+        files: List[Dict[str, str]],
+        user_id: Optional[str] = None,
+        force: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Ingest files given as {"path": local path, "source": display name}
+        """
+        stats = {"total": len(files), "ingested": 0, "unchanged": 0, "failed": 0, "chunks": 0}
+        if not files:
+            return stats
+
+        with background_priority():
+            hashes = await asyncio.gather(*(asyncio.to_thread(file_hash, f["path"]) for f in files))
+            manifest = await self._current_versions([f["source"] for f in files], user_id)
+
+            changed = []
+            for f, content_hash in zip(files, hashes):
+                current = manifest.get(f["source"])
+                if not force and current and current.get("content_hash") == content_hash:
+                    stats["unchanged"] += 1
+                else:
+                    changed.append((f, content_hash, current))
+
+            # Parse all changed files in parallel across processes
+            loop = asyncio.get_running_loop()
+            parsed = await asyncio.gather(*(
+                loop.run_in_executor(
+                    _get_executor(), parse_and_chunk, f["path"], DOCUMENT_CHUNK_SIZE, DOCUMENT_CHUNK_OVERLAP
+                )
+                for f, _, _ in changed
+            ), return_exceptions=True)
+
+            for (f, content_hash, current), chunks in zip(changed, parsed):
+                if isinstance(chunks, Exception):
+                    logger.error(f"Error parsing {f['source']}: {chunks}")
+                    stats["failed"] += 1
+                    continue
+                try:
+                    await self._index_document(f["source"], content_hash, chunks, current, user_id)
+                    stats["ingested"] += 1
+                    stats["chunks"] += len(chunks)
+                except Exception as e:
+                    logger.error(f"Error indexing {f['source']}: {str(e)}")
+                    logger.error(f"Full traceback: {traceback.format_exc()}")
+                    stats["failed"] += 1
+
+        logger.info(f"Document ingest finished: {stats}")
+        return stats
+
+    async def ingest_paths(self, paths: List[str], user_id: Optional[str] = None, force: bool = False) -> Dict[str, Any]:
+        """Ingest files and directories from the local filesystem"""
+        files = collect_files(paths)
+        return await self.ingest_files(
+            [{"path": str(p), "source": str(p)} for p in files],
+            user_id=user_id,
+            force=force
+        )
+
+    async def _index_document(
+        self,
+        source: str,
+        content_hash: str,
+        chunks: List[Dict[str, Any]],
+        current: Optional[Dict[str, Any]],
+        user_id: Optional[str]
+    ):
+        service = self.pinecone_service
+        document_id = self.document_id(source, user_id)
+        ingested_at = datetime.now(timezone.utc).isoformat()
+
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+            batch = chunks[start:start + EMBED_BATCH_SIZE]
+            async with governor.call("openai", service.openai_api_key):
+                embeddings = await service.embeddings.aembed_documents([c["text"] for c in batch])
+
+            records = []
+            for offset, (chunk, embedding) in enumerate(zip(batch, embeddings)):
+                chunk_index = start + offset
+                metadata = {
+                    "message_type": "document",
+                    "document_id": document_id,
+                    "source": source,
+                    "timestamp": ingested_at,
+                    "chunk_index": chunk_index,
+                    "text": chunk["text"]
+                }
+                if chunk["page"] is not None:
+                    metadata["page"] = chunk["page"]
+                if user_id:
+                    metadata["user_id"] = user_id
+                records.append((f"doc_{document_id}#{chunk_index}", embedding, metadata))
+
+            for i in range(0, len(records), UPSERT_BATCH_SIZE):
+                async with governor.call("pinecone", service.pinecone_api_key):
+                    await asyncio.to_thread(
+                        service.index.upsert,
+                        vectors=records[i:i + UPSERT_BATCH_SIZE],
+                        namespace=DOCUMENTS_NAMESPACE
+                    )
+
+        # Remove chunks left over from a longer previous version, or all of a
+        # previous version stored under an older ID
+        previous_id = (current or {}).get("document_id") or document_id
+        previous_count = (current or {}).get("chunk_count") or 0
+        first_stale = len(chunks) if previous_id == document_id else 0
+        stale_ids = [f"doc_{previous_id}#{i}" for i in range(first_stale, previous_count)]
+        for i in range(0, len(stale_ids), 1000):
+            async with governor.call("pinecone", service.pinecone_api_key):
+                await asyncio.to_thread(
+                    service.index.delete,
+                    ids=stale_ids[i:i + 1000],
+                    namespace=DOCUMENTS_NAMESPACE
+                )
+
+        record = {
+            "source": source,
+            "document_id": document_id,
+            "content_hash": content_hash,
+            "chunk_count": len(chunks),
+            "user_id": user_id,
+            "ingested_at": ingested_at
+        }
+        await asyncio.to_thread(
+            lambda: self.supabase.table(DOCUMENTS_TABLE).upsert(record).execute()
+        )
+        if previous_id != document_id:
+            await asyncio.to_thread(
+                lambda: self.supabase.table(DOCUMENTS_TABLE).delete().eq("document_id", previous_id).execute()
+            )
+        logger.info(f"Indexed {source}: {len(chunks)} chunks")
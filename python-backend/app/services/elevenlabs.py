@@ -1,9 +1,14 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, AsyncIterable, AsyncIterator, BinaryIO, Union
 import os
 import logging
 import httpx
 import asyncio
-from datetime import datetime
+import hashlib
+from .audio_cache import AudioCache, tts_cache
+from .audio_formats import DEFAULT_OUTPUT_FORMAT, get_output_format, transcode
+from .uploads import file_size
+from .upstream_governor import governor
+from .shared_cache import shared_cache
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -27,34 +32,38 @@ class ElevenLabsService:
             timeout=30.0
         )
         
-        # Cache for voices list
-        self._voices_cache = None
-        self._voices_cache_timestamp = None
+        # Cache for voices list, shared across requests and worker processes
+        self._voices_cache_key = hashlib.sha256(self.api_key.encode("utf-8")).hexdigest()[:16]
         self._cache_duration = 300  # 5 minutes
         
     async def close(self):
         """Close the HTTP client"""
         await self.client.aclose()
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request through the shared upstream governor"""
+        async with governor.call("elevenlabs", self.api_key) as call:
+            response = await self.client.request(method, url, **kwargs)
+            call.observe(response.status_code, response.headers)
+            return response
         
     async def get_voices(self, force_refresh: bool = False) -> List[Dict[str, Any]]:
         """
         Get list of available voices, with caching
         """
-        now = datetime.now()
-        
         # Return cached voices if available and not expired
-        if not force_refresh and self._voices_cache and self._voices_cache_timestamp:
-            if (now - self._voices_cache_timestamp).seconds < self._cache_duration:
-                return self._voices_cache
+        if not force_refresh:
+            voices = await shared_cache.aget_json("voices", self._voices_cache_key)
+            if voices is not None:
+                return voices
                 
         try:
-            response = await self.client.get("/voices")
+            response = await self._request("GET", "/voices")
             response.raise_for_status()
             voices = response.json()["voices"]
             
             # Update cache
-            self._voices_cache = voices
-            self._voices_cache_timestamp = now
+            await shared_cache.aset_json("voices", self._voices_cache_key, voices, ttl=self._cache_duration)
             
             return voices
             
@@ -67,20 +76,33 @@ class ElevenLabsService:
         text: str,
         voice_id: str,
         model_id: str = "eleven_monolingual_v1",
-        optimize_streaming_latency: int = 0
+        optimize_streaming_latency: int = 0,
+        output_format: str = DEFAULT_OUTPUT_FORMAT
     ) -> bytes:
         """
-        Generate speech from text using specified voice
+        Generate speech from text using specified voice.
+
+        Formats ElevenLabs supports are requested directly; others are
+        synthesized in their source format and transcoded locally.
         """
         try:
-            response = await self.client.post(
+            fmt = get_output_format(output_format)
+            if not fmt["upstream"]:
+                source = await self.generate_speech(
+                    text, voice_id, model_id, optimize_streaming_latency, output_format=fmt["source"]
+                )
+                return await transcode(source, output_format)
+
+            response = await self._request(
+                "POST",
                 f"/text-to-speech/{voice_id}",
+                params={"output_format": output_format},
                 json={
                     "text": text,
                     "model_id": model_id,
                     "optimize_streaming_latency": optimize_streaming_latency
                 },
-                headers={**self.headers, "Accept": "audio/mpeg"}
+                headers={**self.headers, "Accept": "audio/mpeg" if fmt["media_type"] == "audio/mpeg" else "*/*"}
             )
             response.raise_for_status()
             return response.content
@@ -89,13 +111,137 @@ class ElevenLabsService:
             logger.error(f"Error generating speech: {str(e)}")
             raise
             
-    async def add_voice(self, name: str, files: List[bytes], labels: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    async def generate_speech_cached(
+        self,
+        text: str,
+        voice_id: str,
+        model_id: str = "eleven_monolingual_v1",
+        optimize_streaming_latency: int = 0,
+        cache: Optional[AudioCache] = None,
+        output_format: str = DEFAULT_OUTPUT_FORMAT
+    ) -> bytes:
+        """
+        Generate speech for a single chunk, reusing cached audio when available.
+
+        Each format is cached separately; locally transcoded formats also
+        cache their source audio, so other formats can reuse it.
+        """
+        cache = cache or tts_cache
+        key = cache.make_key(text, voice_id, model_id, optimize_streaming_latency, output_format)
+        audio = await cache.aget(key)
+        if audio is not None:
+            logger.info(f"TTS cache hit for chunk ({len(text)} chars, {output_format})")
+            return audio
+
+        fmt = get_output_format(output_format)
+        if fmt["upstream"]:
+            audio = await self.generate_speech(
+                text=text,
+                voice_id=voice_id,
+                model_id=model_id,
+                optimize_streaming_latency=optimize_streaming_latency,
+                output_format=output_format
+            )
+        else:
+            source = await self.generate_speech_cached(
+                text, voice_id, model_id, optimize_streaming_latency, cache=cache, output_format=fmt["source"]
+            )
+            audio = await transcode(source, output_format)
+        await cache.aset(key, audio)
+        return audio
+
+    async def generate_speech_chunks(
+        self,
+        chunks: Union[Iterable[str], AsyncIterable[str]],
+        voice_id: str,
+        model_id: str = "eleven_monolingual_v1",
+        optimize_streaming_latency: int = 0,
+        max_parallel: int = 3,
+        cache: Optional[AudioCache] = None,
+        output_format: str = DEFAULT_OUTPUT_FORMAT
+    ) -> AsyncIterator[bytes]:
+        """
+        Synthesize text chunks with bounded parallelism, yielding audio in order.
+
+        ``chunks`` may be a list or an async iterable whose items arrive over
+        time (e.g. sentences completed by a streaming LLM); each chunk is
+        scheduled as soon as it arrives and a window slot is free. At most
+        ``max_parallel`` chunks are in flight, and a slow consumer stops the
+        source from being read. Identical chunks within one call share a
+        single upstream request.
+        """
+        in_flight: Dict[str, asyncio.Task] = {}
+        cache = cache or tts_cache
+        # Scheduled tasks in order; a slot is freed when the head-of-line chunk finishes
+        pending: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(max(1, max_parallel))
+        done = object()
+
+        def schedule(chunk: str) -> asyncio.Task:
+            key = cache.make_key(chunk, voice_id, model_id, optimize_streaming_latency, output_format)
+            task = in_flight.get(key)
+            if task is None:
+                task = asyncio.create_task(self.generate_speech_cached(
+                    text=chunk,
+                    voice_id=voice_id,
+                    model_id=model_id,
+                    optimize_streaming_latency=optimize_streaming_latency,
+                    cache=cache,
+                    output_format=output_format
+                ))
+                in_flight[key] = task
+            return task
+
+        async def feed():
+            try:
+                if hasattr(chunks, "__aiter__"):
+                    async for chunk in chunks:
+                        await slots.acquire()
+                        pending.put_nowait(schedule(chunk))
+                else:
+                    for chunk in chunks:
+                        await slots.acquire()
+                        pending.put_nowait(schedule(chunk))
+                pending.put_nowait(done)
+            except Exception as e:
+                pending.put_nowait(e)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            while True:
+                item = await pending.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                audio = await item
+                slots.release()
+                yield audio
+
+        except Exception as e:
+            logger.error(f"Error generating chunked speech: {str(e)}")
+            raise
+        finally:
+            feeder.cancel()
+            for task in in_flight.values():
+                task.cancel()
+
+    async def add_voice(
+        self,
+        name: str,
+        files: List[Union[bytes, BinaryIO]],
+        labels: Optional[Dict[str, str]] = None,
+        content_type: str = "audio/mpeg"
+    ) -> Dict[str, Any]:
         """
-        Add a new voice for training
+        Add a new voice for training.
+
+        Files may be raw bytes or seekable file objects; file objects are
+        streamed into the multipart body in chunks rather than loaded whole.
         """
         try:
             files_data = [
-                ("files", (f"sample_{i}.mp3", file, "audio/mpeg"))
+                ("files", (f"sample_{i}.mp3", file, content_type))
                 for i, file in enumerate(files)
             ]
             
@@ -111,10 +257,12 @@ class ElevenLabsService:
                 
             # Log request details
             logger.info(f"Sending voice creation request to ElevenLabs: name={name}, num_files={len(files)}")
-            for i, (_, (filename, file_data, content_type)) in enumerate(files_data):
-                logger.info(f"File {i}: size={len(file_data)} bytes, type={content_type}")
+            for i, (_, (filename, file_data, _)) in enumerate(files_data):
+                size = len(file_data) if isinstance(file_data, bytes) else file_size(file_data)
+                logger.info(f"File {i}: size={size} bytes, type={content_type}")
                 
-            response = await self.client.post(
+            response = await self._request(
+                "POST",
                 "/voices/add",
                 files=files_data,
                 data=form
@@ -144,7 +292,7 @@ class ElevenLabsService:
         Delete a voice
         """
         try:
-            response = await self.client.delete(f"/voices/{voice_id}")
+            response = await self._request("DELETE", f"/voices/{voice_id}")
             response.raise_for_status()
             return True
             
@@ -152,12 +300,25 @@ class ElevenLabsService:
             logger.error(f"Error deleting voice: {str(e)}")
             raise
             
+    async def get_voice(self, voice_id: str) -> Dict[str, Any]:
+        """
+        Get a single voice, including its samples
+        """
+        try:
+            response = await self._request("GET", f"/voices/{voice_id}")
+            response.raise_for_status()
+            return response.json()
+            
+        except Exception as e:
+            logger.error(f"Error getting voice: {str(e)}")
+            raise
+            
     async def get_voice_settings(self, voice_id: str) -> Dict[str, Any]:
         """
         Get settings for a specific voice
         """
         try:
-            response = await self.client.get(f"/voices/{voice_id}/settings")
+            response = await self._request("GET", f"/voices/{voice_id}/settings")
             response.raise_for_status()
             return response.json()
             
@@ -177,7 +338,8 @@ class ElevenLabsService:
         Edit settings for a specific voice
         """
         try:
-            response = await self.client.post(
+            response = await self._request(
+                "POST",
                 f"/voices/{voice_id}/settings/edit",
                 json={
                     "stability": stability,
@@ -193,7 +355,12 @@ class ElevenLabsService:
             logger.error(f"Error editing voice settings: {str(e)}")
             raise
 
-    async def generate_preview_sample(self, voice_id: str, text: str) -> bytes:
+    async def generate_preview_sample(
+        self,
+        voice_id: str,
+        text: str,
+        model_id: str = "eleven_monolingual_v1"
+    ) -> bytes:
         """
         Generate a preview sample for a voice using the provided text
         """
@@ -202,7 +369,7 @@ class ElevenLabsService:
             preview_audio = await self.generate_speech(
                 text=text,
                 voice_id=voice_id,
-                model_id="eleven_monolingual_v1",
+                model_id=model_id,
                 optimize_streaming_latency=0
             )
             return preview_audio
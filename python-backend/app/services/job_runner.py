@@ -0,0 +1,280 @@
+from typing import Dict, Any, Optional, Callable, Awaitable
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import os
+import socket
+import traceback
+import uuid
+from .uploads import process_alive
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+# Unfinished jobs of other hosts are presumed dead after this long without an update
+JOB_ORPHAN_SECONDS = float(os.getenv("JOB_ORPHAN_SECONDS", str(6 * 3600)))
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class JobQueueFullError(RuntimeError):
+    """Raised when a job is submitted while the runner's queue is full"""
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    user_id: Optional[str] = None
+    status: str = JOB_QUEUED
+    step: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    worker: Optional[str] = field(default_factory=_worker_id)
+    created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    updated_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def visible_to(self, user_id: Optional[str]) -> bool:
+        """Jobs submitted for a user are only shown to that user"""
+        return self.user_id is None or str(self.user_id) == str(user_id)
+
+JobFunc = Callable[[Job], Awaitable[Optional[Dict[str, Any]]]]
+
+class JobRunner:
+    """
+    Bounded async worker pool for long-running request work.
+
+    Jobs are queued in memory and executed by ``max_workers`` tasks on the
+    event loop. Every state transition is written to a Supabase table when one
+    is configured, so status survives restarts and is visible to other workers.
+
+    The queue does not survive the process: stop() fails the jobs that never
+    started, and start() fails unfinished rows left by workers that exited
+    without stopping (same host, dead pid, or no update for
+    JOB_ORPHAN_SECONDS). A job's cleanup callback runs exactly once, however
+    the job ends.
+    """
+    def __init__(
+        self,
+        name: str,
+        max_workers: int = 2,
+        max_queue: int = 100,
+        get_supabase: Optional[Callable[[], Any]] = None,
+        table: Optional[str] = None,
+        max_history: int = 1000
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.get_supabase = get_supabase
+        self.table = table
+        self.max_history = max_history
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._workers = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    async def start(self):
+        """Start the worker tasks"""
+        if self._workers:
+            return
+        await self._fail_orphans()
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"{self.name}-worker-{i}")
+            for i in range(self.max_workers)
+        ]
+        logger.info(f"Started job runner '{self.name}' with {self.max_workers} workers")
+
+    async def stop(self):
+        """Cancel the worker tasks and fail the jobs that never started"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        dropped = 0
+        while not self._queue.empty():
+            job, func, cleanup = self._queue.get_nowait()
+            job.error = "Worker stopped before the job started"
+            await self._transition(job, JOB_FAILED)
+            self._cleanup(job, cleanup)
+            dropped += 1
+        logger.info(f"Stopped job runner '{self.name}'" + (f", failed {dropped} queued jobs" if dropped else ""))
+
+    async def submit(
+        self,
+        func: JobFunc,
+        kind: str,
+        user_id: Optional[str] = None,
+        cleanup: Optional[Callable[[], None]] = None
+    ) -> Job:
+        """
+        Queue a job and return it immediately.
+
+        cleanup (e.g. removing a spooled upload) runs once the job has
+        finished or been dropped; it does not run if submit raises.
+        """
+        if not self._workers:
+            await self.start()
+
+        if self._queue.full():
+            raise JobQueueFullError(f"Job queue '{self.name}' is full")
+
+        # Written before a worker can see the job, so the queued record
+        # cannot land after the worker's running/succeeded one
+        job = Job(id=str(uuid.uuid4()), kind=kind, user_id=user_id)
+        self._remember(job)
+        await self._persist(job)
+        try:
+            self._queue.put_nowait((job, func, cleanup))
+        except asyncio.QueueFull:
+            # Filled up while the record was being written
+            job.error = "Job queue full"
+            await self._transition(job, JOB_FAILED)
+            raise JobQueueFullError(f"Job queue '{self.name}' is full")
+        logger.info(f"Queued {kind} job {job.id}")
+        return job
+
+    async def get(self, job_id: str, user_id: Optional[str] = None) -> Optional[Job]:
+        """
+        Look up a job in memory, falling back to the persisted record.
+        Jobs owned by a different user are reported as missing.
+        """
+        job = await self._lookup(job_id)
+        if job is None or not job.visible_to(user_id):
+            return None
+        return job
+
+    async def _lookup(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None or not self.table:
+            return job
+
+        try:
+            response = await asyncio.to_thread(
+                lambda: self.get_supabase().table(self.table).select("*").eq("id", job_id).execute()
+            )
+        except Exception as e:
+            logger.error(f"Error loading job {job_id}: {str(e)}")
+            return None
+        if not response.data:
+            return None
+        row = response.data[0]
+        return Job(**{key: row.get(key) for key in Job.__dataclass_fields__})
+
+    async def set_step(self, job: Job, step: str):
+        """Record progress within a running job"""
+        job.step = step
+        await self._transition(job, job.status)
+
+    async def _worker(self, index: int):
+        while True:
+            job, func, cleanup = await self._queue.get()
+            try:
+                await self._transition(job, JOB_RUNNING)
+                result = await func(job)
+                job.result = result
+                await self._transition(job, JOB_SUCCEEDED)
+                logger.info(f"Job {job.id} succeeded")
+            except asyncio.CancelledError:
+                job.error = "Job cancelled"
+                await self._transition(job, JOB_FAILED)
+                raise
+            except Exception as e:
+                job.error = str(e)
+                logger.error(f"Job {job.id} failed: {str(e)}")
+                logger.error(f"Full traceback: {traceback.format_exc()}")
+                await self._transition(job, JOB_FAILED)
+            finally:
+                self._cleanup(job, cleanup)
+                self._queue.task_done()
+
+    @staticmethod
+    def _cleanup(job: Job, cleanup: Optional[Callable[[], None]]):
+        if cleanup is None:
+            return
+        try:
+            cleanup()
+        except Exception as e:
+            logger.warning(f"Cleanup of job {job.id} failed: {str(e)}")
+
+    async def _fail_orphans(self):
+        """Fail unfinished persisted jobs whose worker is gone"""
+        if not self.table:
+            return
+        try:
+            response = await asyncio.to_thread(
+                lambda: self.get_supabase().table(self.table).select("id, worker, updated_at")
+                .in_("status", [JOB_QUEUED, JOB_RUNNING]).execute()
+            )
+        except Exception as e:
+            logger.error(f"Error loading unfinished jobs for '{self.name}': {str(e)}")
+            return
+
+        host = socket.gethostname()
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=JOB_ORPHAN_SECONDS)
+        orphans = []
+        for row in response.data:
+            worker_host, _, pid = (row.get("worker") or "").rpartition(":")
+            if worker_host == host and pid.isdigit():
+                dead = int(pid) != os.getpid() and not process_alive(int(pid))
+            else:
+                updated_at = row.get("updated_at")
+                dead = not updated_at or datetime.fromisoformat(updated_at.replace("Z", "+00:00")) < stale_before
+            if dead:
+                orphans.append(row["id"])
+        if not orphans:
+            return
+
+        try:
+            await asyncio.to_thread(
+                lambda: self.get_supabase().table(self.table).update({
+                    "status": JOB_FAILED,
+                    "error": "Worker exited before the job finished",
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                }).in_("id", orphans).execute()
+            )
+            logger.warning(f"Marked {len(orphans)} orphaned '{self.name}' jobs failed")
+        except Exception as e:
+            logger.error(f"Error failing orphaned jobs for '{self.name}': {str(e)}")
+
+    async def _transition(self, job: Job, status: str):
+        job.status = status
+        job.updated_at = datetime.now(timezone.utc).isoformat()
+        await self._persist(job)
+
+    async def _persist(self, job: Job):
+        if not self.table:
+            return
+        record = job.to_dict()
+        try:
+            await asyncio.to_thread(
+                lambda: self.get_supabase().table(self.table).upsert(record).execute()
+            )
+        except Exception as e:
+            # Persistence is best effort; in-memory state stays authoritative
+            logger.error(f"Error persisting job {job.id}: {str(e)}")
+
+    def _remember(self, job: Job):
+        self._jobs[job.id] = job
+        # Drop the oldest finished jobs once history is full
+        if len(self._jobs) > self.max_history:
+            for job_id in [jid for jid, j in self._jobs.items() if j.finished]:
+                if len(self._jobs) <= self.max_history:
+                    break
+                del self._jobs[job_id]
@@ -0,0 +1,89 @@
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import logging
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+class LazyResource:
+    """
+    A client or service constructed on first use instead of at import time.
+
+    Construction is guarded by a lock so concurrent first callers share one
+    instance. A failed construction is remembered for readiness reporting and
+    retried on the next call.
+    """
+    def __init__(self, name: str, factory: Callable[[], Any], required: bool = True):
+        self.name = name
+        self.factory = factory
+        self.required = required
+        self._instance = None
+        self._error: Optional[str] = None
+        self._init_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> Any:
+        """Return the instance, constructing it in the calling thread if needed"""
+        if self._instance is not None:
+            return self._instance
+        with self._lock:
+            if self._instance is None:
+                start = time.perf_counter()
+                try:
+                    self._instance = self.factory()
+                    self._error = None
+                except Exception as e:
+                    self._error = f"{type(e).__name__}: {str(e)}"
+                    logger.error(f"Error initializing {self.name}: {self._error}")
+                    raise
+                finally:
+                    self._init_seconds = time.perf_counter() - start
+                logger.info(f"Initialized {self.name} in {self._init_seconds:.2f}s")
+        return self._instance
+
+    async def aget(self) -> Any:
+        """Return the instance, constructing it off the event loop if needed"""
+        if self._instance is not None:
+            return self._instance
+        return await asyncio.to_thread(self.get)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "required": self.required,
+            "error": self._error,
+            "init_seconds": round(self._init_seconds, 3) if self._init_seconds is not None else None
+        }
+
+_registry: Dict[str, LazyResource] = {}
+
+def lazy_resource(name: str, factory: Callable[[], Any], required: bool = True) -> LazyResource:
+    """Create a lazily constructed resource and register it for warm-up and readiness"""
+    resource = LazyResource(name, factory, required)
+    _registry[name] = resource
+    return resource
+
+async def warm_up(names: Optional[List[str]] = None):
+    """Construct registered resources in worker threads; failures are logged, not raised"""
+    resources = [r for n, r in _registry.items() if names is None or n in names]
+
+    async def warm(resource: LazyResource):
+        try:
+            await resource.aget()
+        except Exception:
+            logger.error(f"Warm-up of {resource.name} failed: {traceback.format_exc()}")
+
+    await asyncio.gather(*(warm(r) for r in resources))
+
+def readiness() -> Dict[str, Any]:
+    """Ready once every required resource has been constructed"""
+    resources = {name: r.status() for name, r in _registry.items()}
+    ready = all(r.ready for r in _registry.values() if r.required)
+    return {"ready": ready, "resources": resources}
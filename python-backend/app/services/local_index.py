@@ -0,0 +1,172 @@
+from typing import Dict, Any, List, Optional, Sequence
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+QUANTIZATION_NONE = "none"
+QUANTIZATION_INT8 = "int8"
+QUANTIZATION_BINARY = "binary"
+QUANTIZATIONS = (QUANTIZATION_NONE, QUANTIZATION_INT8, QUANTIZATION_BINARY)
+
+# numpy is imported inside functions, like the other heavy dependencies, so
+# importing this module stays cheap.
+
+def truncate_embedding(vector: Sequence[float], dimensions: int) -> List[float]:
+    """
+    Shorten an embedding to its first ``dimensions`` values and re-normalize.
+
+    text-embedding-3 models are trained so that a prefix of the vector is
+    itself a usable embedding; this matches what the API's ``dimensions``
+    parameter returns, so stored full-size vectors can be compared against
+    reduced-dimension ones.
+    """
+    import numpy as np # type: ignore
+
+    prefix = np.asarray(vector[:dimensions], dtype=np.float32)
+    norm = float(np.linalg.norm(prefix))
+    return (prefix / norm if norm else prefix).tolist()
+
+class LocalVectorIndex:
+    """
+    In-process vector index with optional int8 or binary quantization.
+
+    Candidates are found with the quantized vectors, which is what needs to
+    stay hot in memory, then re-scored against the float vectors so the
+    returned scores are exact cosine similarities. ``rescore_factor`` sets
+    how many candidates per requested result are re-scored.
+    """
+    def __init__(
+        self,
+        dimensions: int,
+        quantization: str = QUANTIZATION_NONE,
+        rescore_factor: int = 4
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+        self.dimensions = dimensions
+        self.quantization = quantization
+        self.rescore_factor = max(1, rescore_factor)
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._vectors: List[Any] = []
+        self._metadata: List[Optional[Dict[str, Any]]] = []
+        # Stacked arrays, rebuilt lazily after writes
+        self._floats = None
+        self._codes = None
+        self._scales = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def upsert(self, vectors: List[tuple]):
+        """Insert or replace (id, values, metadata) tuples, like Index.upsert"""
+        import numpy as np # type: ignore
+
+        for vector_id, values, *rest in vectors:
+            row = np.asarray(values, dtype=np.float32)
+            if row.shape != (self.dimensions,):
+                raise ValueError(f"Vector {vector_id} has {row.size} dimensions, index expects {self.dimensions}")
+            norm = float(np.linalg.norm(row))
+            row = row / norm if norm else row
+            metadata = rest[0] if rest else None
+            position = self._positions.get(vector_id)
+            if position is None:
+                self._positions[vector_id] = len(self._ids)
+                self._ids.append(vector_id)
+                self._vectors.append(row)
+                self._metadata.append(metadata)
+            else:
+                self._vectors[position] = row
+                self._metadata[position] = metadata
+        self._floats = None
+
+    def delete(self, ids: List[str]):
+        removed = {vector_id for vector_id in ids if vector_id in self._positions}
+        if not removed:
+            return
+        keep = [i for i, vector_id in enumerate(self._ids) if vector_id not in removed]
+        self._ids = [self._ids[i] for i in keep]
+        self._vectors = [self._vectors[i] for i in keep]
+        self._metadata = [self._metadata[i] for i in keep]
+        self._positions = {vector_id: i for i, vector_id in enumerate(self._ids)}
+        self._floats = None
+
+    def _build(self):
+        import numpy as np # type: ignore
+
+        self._floats = np.vstack(self._vectors) if self._vectors else np.zeros((0, self.dimensions), np.float32)
+        if self.quantization == QUANTIZATION_INT8:
+            self._codes, self._scales = self._quantize_int8(self._floats)
+        elif self.quantization == QUANTIZATION_BINARY:
+            self._codes = np.packbits(self._floats > 0, axis=1)
+        else:
+            self._codes = None
+
+    @staticmethod
+    def _quantize_int8(matrix):
+        """Symmetric per-vector scaling into [-127, 127]"""
+        import numpy as np # type: ignore
+
+        scales = np.abs(matrix).max(axis=1, keepdims=True) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(matrix / scales).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _candidate_scores(self, query):
+        """Approximate scores for every stored vector"""
+        import numpy as np # type: ignore
+
+        if self.quantization == QUANTIZATION_INT8:
+            query_codes, query_scale = self._quantize_int8(query[None, :])
+            dots = self._codes.astype(np.int32) @ query_codes[0].astype(np.int32)
+            return dots * self._scales[:, 0] * query_scale[0, 0]
+        if self.quantization == QUANTIZATION_BINARY:
+            query_bits = np.packbits(query > 0)
+            differing = np.unpackbits(np.bitwise_xor(self._codes, query_bits), axis=1).sum(axis=1)
+            # Fewer differing sign bits means more similar
+            return -differing.astype(np.float32)
+        return self._floats @ query
+
+    def query(self, vector: Sequence[float], top_k: int = 10) -> List[Dict[str, Any]]:
+        """Return the top_k matches as {"id", "score", "metadata"}"""
+        import numpy as np # type: ignore
+
+        if not self._ids:
+            return []
+        if self._floats is None:
+            self._build()
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        query = query / norm if norm else query
+
+        top_k = min(top_k, len(self._ids))
+        scores = self._candidate_scores(query)
+        if self.quantization == QUANTIZATION_NONE:
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            pool = min(len(self._ids), top_k * self.rescore_factor)
+            candidates = np.argpartition(-scores, pool - 1)[:pool]
+            # Exact float scores for the candidate pool
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            scores[candidates] = self._floats[candidates] @ query
+
+        best = sorted(candidates.tolist(), key=lambda i: scores[i], reverse=True)[:top_k]
+        return [
+            {"id": self._ids[i], "score": float(scores[i]), "metadata": self._metadata[i]}
+            for i in best
+        ]
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """
+        Bytes used by the search structure and by the float vectors kept for
+        re-scoring (which could live on disk, as they are only read for the
+        candidate pool)
+        """
+        if self._floats is None:
+            self._build()
+        if self.quantization == QUANTIZATION_NONE:
+            return {"search": int(self._floats.nbytes), "rescore": 0}
+        search = int(self._codes.nbytes) + (int(self._scales.nbytes) if self._scales is not None else 0)
+        return {"search": search, "rescore": int(self._floats.nbytes)}
@@ -1,35 +1,215 @@
-from langchain.vectorstores import Pinecone # type: ignore
-from langchain_openai import OpenAIEmbeddings # type: ignore
-import pinecone # type: ignore
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+import asyncio
+import logging
 import os
+import traceback
+from .supabase_client import get_supabase
+from .upstream_governor import governor, background_priority
+from .shared_cache import shared_cache
+from .lazy import lazy_resource
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+TURNS_TABLE = "conversation_turns"
+SUMMARIES_TABLE = "conversation_summaries"
+
+# Token budget for memory injected into each prompt (summary + recent turns)
+MEMORY_WINDOW_TOKENS = int(os.getenv("MEMORY_WINDOW_TOKENS", "1500"))
+# Upper bound for the running summary
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "400"))
+# Unsummarized turns kept verbatim after compaction
+MEMORY_KEEP_RECENT_TOKENS = int(os.getenv("MEMORY_KEEP_RECENT_TOKENS", "600"))
+MEMORY_SUMMARY_MODEL = os.getenv("MEMORY_SUMMARY_MODEL", "gpt-4o-mini")
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and {avatar_name}.
+Update the summary with the new turns below. Keep facts, names, decisions, open questions and
+user preferences; drop pleasantries. Write in third person, at most {max_words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+def count_tokens(text: str) -> int:
+    """Token count for the chat model's encoding, or an estimate if tiktoken is missing"""
+    try:
+        import tiktoken # type: ignore
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    except Exception:
+        return max(1, len(text) // 4)
 
 class MemoryService:
+    """
+    Conversation memory per (user, avatar).
+
+    Every turn is stored; once unsummarized turns outgrow the window, the
+    oldest are folded into a running summary in the background. Prompts get
+    the summary plus as many recent turns as fit MEMORY_WINDOW_TOKENS, so
+    their size stays bounded however long the conversation runs.
+    """
     def __init__(self):
-        # Initialize Pinecone
-        pinecone.init(
-            api_key=os.getenv("PINECONE_API_KEY"),
-            environment=os.getenv("PINECONE_ENVIRONMENT")
+        from langchain_openai import ChatOpenAI # type: ignore
+
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables")
+        self.api_key = api_key
+        self.summarizer = ChatOpenAI(
+            model=MEMORY_SUMMARY_MODEL,
+            openai_api_key=api_key,
+            temperature=0
+        )
+        self.supabase = get_supabase()
+        # Running compaction per conversation; entries go once the task finishes
+        self._compactions: Dict[tuple, asyncio.Task] = {}
+
+    async def _unsummarized_turns(self, user_id: str, avatar_name: str) -> List[Dict[str, Any]]:
+        response = await asyncio.to_thread(
+            lambda: self.supabase.table(TURNS_TABLE)
+            .select("id, role, content, token_count, created_at")
+            .eq("user_id", user_id).eq("avatar_name", avatar_name).eq("summarized", False)
+            .order("id").execute()
         )
-        
-        self.embeddings = OpenAIEmbeddings()
-        self.index_name = os.getenv("PINECONE_INDEX_NAME")
-        self.vectorstore = Pinecone.from_existing_index(
-            index_name=self.index_name,
-            embedding=self.embeddings
+        return response.data
+
+    async def _summary(self, user_id: str, avatar_name: str) -> str:
+        response = await asyncio.to_thread(
+            lambda: self.supabase.table(SUMMARIES_TABLE)
+            .select("summary")
+            .eq("user_id", user_id).eq("avatar_name", avatar_name).execute()
         )
+        return response.data[0]["summary"] if response.data else ""
 
-    async def store_message(self, user_id: str, message: str):
-        # Store message in Pinecone with metadata
-        self.vectorstore.add_texts(
-            texts=[message],
-            metadatas=[{"user_id": user_id}]
+    async def get_window(self, user_id: str, avatar_name: str) -> Dict[str, Any]:
+        """
+        Memory for the next prompt: {"summary": str, "turns": [{"role", "content"}]},
+        oldest turn first, fitting MEMORY_WINDOW_TOKENS
+        """
+        summary, turns = await asyncio.gather(
+            self._summary(user_id, avatar_name),
+            self._unsummarized_turns(user_id, avatar_name)
         )
+        budget = MEMORY_WINDOW_TOKENS - (count_tokens(summary) if summary else 0)
+        window = []
+        for turn in reversed(turns):
+            budget -= turn["token_count"]
+            if budget < 0:
+                break
+            window.append({"role": turn["role"], "content": turn["content"]})
+        window.reverse()
+        return {"summary": summary, "turns": window}
+
+    async def record_turn(self, user_id: str, avatar_name: str, user_message: str, assistant_message: str):
+        """Store a user/assistant exchange and schedule compaction if needed"""
+        # Identity IDs keep the pair in order
+        rows = [
+            {
+                "user_id": user_id,
+                "avatar_name": avatar_name,
+                "role": role,
+                "content": content,
+                "token_count": count_tokens(content)
+            }
+            for role, content in (("user", user_message), ("assistant", assistant_message))
+        ]
+        await asyncio.to_thread(lambda: self.supabase.table(TURNS_TABLE).insert(rows).execute())
+        self._schedule_compaction(user_id, avatar_name)
+
+    def _schedule_compaction(self, user_id: str, avatar_name: str):
+        key = (user_id, avatar_name)
+        running = self._compactions.get(key)
+        if running is not None and not running.done():
+            return
+        task = asyncio.create_task(self.compact(user_id, avatar_name))
+        self._compactions[key] = task
+        task.add_done_callback(lambda _: self._forget_compaction(key, task))
+
+    def _forget_compaction(self, key: tuple, task: asyncio.Task):
+        # A newer compaction may already have taken the slot
+        if self._compactions.get(key) is task:
+            del self._compactions[key]
+
+    async def compact(self, user_id: str, avatar_name: str) -> bool:
+        """
+        Fold the oldest unsummarized turns into the running summary once they
+        exceed the window. Returns True if a compaction happened.
+        """
+        lease = f"memory-compact:{user_id}:{avatar_name}"
+        leased = False
+        try:
+            turns = await self._unsummarized_turns(user_id, avatar_name)
+            total = sum(turn["token_count"] for turn in turns)
+            if total <= MEMORY_WINDOW_TOKENS - MEMORY_SUMMARY_TOKENS:
+                return False
+            # One worker per conversation; others skip while the lease is held
+            leased = await shared_cache.aacquire_lease(lease, ttl=120)
+            if not leased:
+                return False
+
+            # Keep the newest turns verbatim, summarize everything older
+            keep_tokens = 0
+            split = len(turns)
+            while split > 0 and keep_tokens + turns[split - 1]["token_count"] <= MEMORY_KEEP_RECENT_TOKENS:
+                split -= 1
+                keep_tokens += turns[split]["token_count"]
+            old_turns = turns[:split]
+            if not old_turns:
+                return False
 
-    async def get_relevant_history(self, user_id: str, current_message: str, k: int = 5):
-        # Retrieve k most relevant previous messages
-        relevant_docs = self.vectorstore.similarity_search(
-            query=current_message,
-            filter={"user_id": user_id},
-            k=k
+            from langchain.schema import HumanMessage # type: ignore
+
+            prompt = SUMMARY_PROMPT.format(
+                avatar_name=avatar_name,
+                max_words=int(MEMORY_SUMMARY_TOKENS * 0.75),
+                summary=await self._summary(user_id, avatar_name) or "(none yet)",
+                turns="\n".join(f"{t['role']}: {t['content']}" for t in old_turns)
+            )
+            with background_priority():
+                async with governor.call("openai", self.api_key):
+                    response = await self.summarizer.agenerate([[HumanMessage(content=prompt)]])
+            summary = response.generations[0][0].text.strip()
+
+            await asyncio.to_thread(
+                lambda: self.supabase.table(SUMMARIES_TABLE).upsert({
+                    "user_id": user_id,
+                    "avatar_name": avatar_name,
+                    "summary": summary,
+                    "summarized_through": old_turns[-1]["created_at"],
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                }).execute()
+            )
+            turn_ids = [t["id"] for t in old_turns]
+            await asyncio.to_thread(
+                lambda: self.supabase.table(TURNS_TABLE).update({"summarized": True}).in_("id", turn_ids).execute()
+            )
+            logger.info(f"Compacted {len(old_turns)} turns for {user_id}/{avatar_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Error compacting memory for {user_id}/{avatar_name}: {str(e)}")
+            logger.error(f"Full traceback: {traceback.format_exc()}")
+            return False
+        finally:
+            if leased:
+                await shared_cache.arelease_lease(lease)
+
+    async def clear(self, user_id: str, avatar_name: str):
+        """Forget a conversation"""
+        await asyncio.to_thread(
+            lambda: self.supabase.table(TURNS_TABLE).delete()
+            .eq("user_id", user_id).eq("avatar_name", avatar_name).execute()
         )
-        return [doc.page_content for doc in relevant_docs] 
\ No newline at end of file
+        await asyncio.to_thread(
+            lambda: self.supabase.table(SUMMARIES_TABLE).delete()
+            .eq("user_id", user_id).eq("avatar_name", avatar_name).execute()
+        )
+
+# Shared instance; chat keeps working statelessly if it cannot be constructed
+memory_service = lazy_resource("memory", MemoryService, required=False)
+
+def get_memory_service() -> MemoryService:
+    return memory_service.get()
@@ -0,0 +1,306 @@
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+import traceback
+from .upstream_governor import background_priority, is_transient
+from .metrics import metrics
+from .pinecone_service import pinecone_service
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Direct (session) Postgres connection; LISTEN does not work through a
+# transaction-mode pooler
+DATABASE_URL = os.getenv("DATABASE_URL")
+CDC_ENABLED = os.getenv("CDC_ENABLED", "false").lower() == "true"
+CDC_CHANNEL = "message_changes"
+# Changes per embedding batch, and how long to let a burst accumulate
+CDC_BATCH_SIZE = int(os.getenv("CDC_BATCH_SIZE", "200"))
+CDC_BATCH_WAIT = float(os.getenv("CDC_BATCH_WAIT_SECONDS", "1.0"))
+# Catch-up poll in case a notification was missed (e.g. while reconnecting)
+CDC_POLL_SECONDS = float(os.getenv("CDC_POLL_SECONDS", "30"))
+# Consumed changes are pruned from message_changes after this long
+CDC_RETENTION_HOURS = float(os.getenv("CDC_RETENTION_HOURS", "24"))
+CDC_MAX_BACKOFF = 60.0
+# A batch failing this many times in a row with a non-transient error is
+# retried one message at a time, and messages that still fail are
+# quarantined (failed_at set) so later changes can proceed
+CDC_MAX_BATCH_ATTEMPTS = int(os.getenv("CDC_MAX_BATCH_ATTEMPTS", "5"))
+
+# Only one consumer per database applies changes; others stand by
+CDC_LOCK_KEY = "message_cdc"
+
+MESSAGE_COLUMNS = """
+    m.id::text AS id, m.content, m.user_id::text AS user_id, m.channel_id::text AS channel_id,
+    m.receiver_id::text AS receiver_id, m.is_direct_message, m.created_at::text AS created_at,
+    m.updated_at::text AS updated_at, u.username AS user_name, c.name AS channel_name
+"""
+
+def collapse_changes(changes: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Reduce a run of changes to the last operation per message: an insert
+    followed by an update is one upsert, anything followed by a delete is
+    a delete.
+    """
+    latest: Dict[str, str] = {}
+    for change in changes:
+        latest[str(change["message_id"])] = change["op"]
+    return latest
+
+class MessageCDC:
+    """
+    Indexes messages from Postgres change data capture.
+
+    A trigger on messages appends each insert, update of indexed columns
+    and delete to message_changes and sends a NOTIFY. The consumer wakes on
+    the notification (or a periodic poll), reads unconsumed changes in id
+    order, re-reads the current rows, hands them to the indexer
+    (upsert_messages / delete_messages) and then stamps the changes
+    consumed_at, so a restart resumes where it left off. Stamping rows
+    rather than keeping a high-water id means a change whose transaction
+    commits after a later one is still picked up. Delivery is
+    at-least-once; indexing is idempotent. Retries back off up to
+    CDC_MAX_BACKOFF and reset once a batch goes through; a message the
+    indexer keeps rejecting is parked in message_changes with failed_at and
+    error set (see requeue_failed) instead of blocking everything after it.
+
+    The indexer is anything with async upsert_messages, delete_messages
+    and a build_metadata(row, user_map, channel_map) helper, normally
+    PineconeService.
+    """
+    def __init__(self, dsn: Optional[str] = DATABASE_URL, get_indexer=None, batch_size: int = CDC_BATCH_SIZE):
+        self.dsn = dsn
+        self.get_indexer = get_indexer
+        self.batch_size = batch_size
+        self.stats = {
+            "leader": False,
+            "batches": 0,
+            "changes": 0,
+            "upserted": 0,
+            "deleted": 0,
+            "failed_batches": 0,
+            "quarantined": 0,
+            "last_change_id": None,
+            "pending": None
+        }
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._backoff = 1.0
+        # First change ID of the batch that keeps failing, and how often it has
+        self._failing_head: Optional[int] = None
+        self._head_failures = 0
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="message-cdc")
+            logger.info("Started message CDC consumer")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Stopped message CDC consumer")
+
+    def status(self) -> Dict[str, Any]:
+        return {"running": self._task is not None, **self.stats}
+
+    async def _run(self):
+        while True:
+            try:
+                await self._consume()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["leader"] = False
+                logger.error(f"CDC consumer error, retrying in {self._backoff:.0f}s: {type(e).__name__}: {str(e)}")
+                await asyncio.sleep(self._backoff)
+                self._backoff = min(self._backoff * 2, CDC_MAX_BACKOFF)
+
+    async def _consume(self):
+        import asyncpg # type: ignore
+
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            # Session-level lock: released when this connection drops
+            while not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", CDC_LOCK_KEY):
+                await asyncio.sleep(CDC_POLL_SECONDS)
+            self.stats["leader"] = True
+            self._backoff = 1.0
+            logger.info("Message CDC consumer holds the lock")
+
+            await conn.add_listener(CDC_CHANNEL, lambda *args: self._wake.set())
+            while True:
+                # Clear first so a NOTIFY during the batch triggers another pass
+                self._wake.clear()
+                if await self._apply_next_batch(conn) == self.batch_size:
+                    # Backlog: keep going without waiting
+                    continue
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=CDC_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                # Let a burst of writes accumulate into one embedding batch
+                await asyncio.sleep(CDC_BATCH_WAIT)
+        finally:
+            await conn.close()
+
+    async def _apply_next_batch(self, conn) -> int:
+        """Index the oldest unconsumed changes; returns how many were read"""
+        changes = [dict(row) for row in await conn.fetch(
+            """
+            SELECT id, message_id::text AS message_id, op
+            FROM public.message_changes WHERE consumed_at IS NULL ORDER BY id LIMIT $1
+            """,
+            self.batch_size
+        )]
+        if not changes:
+            self.stats["pending"] = 0
+            return 0
+
+        start = time.perf_counter()
+        try:
+            upserted, deleted = await self._index_changes(conn, changes)
+        except Exception as e:
+            # The changes stay unconsumed, so the batch is retried after the backoff
+            self.stats["failed_batches"] += 1
+            logger.error(f"Error indexing CDC batch of {len(changes)} changes: {str(e)}")
+            logger.error(f"Full traceback: {traceback.format_exc()}")
+            if not self._give_up_on(changes[0]["id"], e):
+                raise
+            upserted, deleted = await self._index_individually(conn, changes)
+
+        await conn.execute(
+            "UPDATE public.message_changes SET consumed_at = now() WHERE id = ANY($1::bigint[]) AND consumed_at IS NULL",
+            [change["id"] for change in changes]
+        )
+        # Quarantined changes are kept until requeued
+        await conn.execute(
+            "DELETE FROM public.message_changes "
+            "WHERE consumed_at < now() - make_interval(hours => $1) AND failed_at IS NULL",
+            CDC_RETENTION_HOURS
+        )
+        self._backoff = 1.0
+        self._failing_head = None
+        self._head_failures = 0
+        self.stats["batches"] += 1
+        self.stats["changes"] += len(changes)
+        self.stats["upserted"] += upserted
+        self.stats["deleted"] += deleted
+        self.stats["last_change_id"] = changes[-1]["id"]
+        self.stats["pending"] = await conn.fetchval(
+            "SELECT count(*) FROM public.message_changes WHERE consumed_at IS NULL"
+        )
+        metrics.observe("cdc_batch_ms", (time.perf_counter() - start) * 1000)
+        metrics.increment("cdc_changes", len(changes))
+        logger.info(
+            f"CDC applied {len(changes)} changes through {changes[-1]['id']}: "
+            f"{upserted} indexed, {deleted} deleted"
+        )
+        return len(changes)
+
+    async def _index_changes(self, conn, changes: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Apply a run of changes to the index; returns (upserted, deleted)"""
+        latest = collapse_changes(changes)
+        rows = await self._load_messages(conn, [m for m, op in latest.items() if op != "DELETE"])
+        channel_rows = [row for row in rows.values() if not row["is_direct_message"]]
+        # Deleted rows leave the index, as do rows gone since the change
+        # and messages updated into DMs; DMs inserted as such were never in it
+        deletes = [
+            message_id for message_id, op in latest.items()
+            if op == "DELETE" or message_id not in rows or (op == "UPDATE" and rows[message_id]["is_direct_message"])
+        ]
+
+        with background_priority():
+            indexer = await self.get_indexer()
+            if channel_rows:
+                await indexer.upsert_messages([self._to_message(indexer, row) for row in channel_rows])
+            if deletes:
+                await indexer.delete_messages(deletes)
+        return len(channel_rows), len(deletes)
+
+    def _give_up_on(self, head_id: int, error: Exception) -> bool:
+        """Count a failure of the batch starting at head_id; True once it should be split up"""
+        if head_id != self._failing_head:
+            self._failing_head = head_id
+            self._head_failures = 0
+        self._head_failures += 1
+        # Outages and throttling are waited out, however long they last
+        return not is_transient(error) and self._head_failures >= CDC_MAX_BATCH_ATTEMPTS
+
+    async def _index_individually(self, conn, changes: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Apply a repeatedly failing batch one message at a time, quarantining
+        messages that fail with a non-transient error. A transient error
+        aborts the pass, leaving the batch to be retried.
+        """
+        logger.warning(f"CDC batch at change {changes[0]['id']} keeps failing; applying it message by message")
+        by_message: Dict[str, List[Dict[str, Any]]] = {}
+        for change in changes:
+            by_message.setdefault(str(change["message_id"]), []).append(change)
+
+        upserted = deleted = 0
+        for message_id, message_changes in by_message.items():
+            try:
+                added, removed = await self._index_changes(conn, message_changes)
+                upserted += added
+                deleted += removed
+            except Exception as e:
+                if is_transient(e):
+                    raise
+                await conn.execute(
+                    "UPDATE public.message_changes SET consumed_at = now(), failed_at = now(), error = $2 "
+                    "WHERE id = ANY($1::bigint[])",
+                    [change["id"] for change in message_changes],
+                    f"{type(e).__name__}: {str(e)}"[:1000]
+                )
+                self.stats["quarantined"] += len(message_changes)
+                metrics.increment("cdc_quarantined", len(message_changes))
+                logger.error(f"Quarantined {len(message_changes)} changes of message {message_id}: {str(e)}")
+        return upserted, deleted
+
+    async def requeue_failed(self) -> int:
+        """Put quarantined changes back in the queue, e.g. after fixing the cause"""
+        import asyncpg # type: ignore
+
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            result = await conn.execute(
+                "UPDATE public.message_changes SET consumed_at = NULL, failed_at = NULL, error = NULL "
+                "WHERE failed_at IS NOT NULL"
+            )
+        finally:
+            await conn.close()
+        count = int(result.split()[-1])
+        logger.info(f"Requeued {count} quarantined CDC changes")
+        return count
+
+    async def _load_messages(self, conn, message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not message_ids:
+            return {}
+        rows = await conn.fetch(
+            f"""
+            SELECT {MESSAGE_COLUMNS}
+            FROM public.messages m
+            LEFT JOIN public.users u ON u.id = m.user_id
+            LEFT JOIN public.channels c ON c.id = m.channel_id
+            WHERE m.id = ANY($1::uuid[])
+            """,
+            message_ids
+        )
+        return {row["id"]: dict(row) for row in rows}
+
+    @staticmethod
+    def _to_message(indexer, row: Dict[str, Any]) -> Dict[str, Any]:
+        user_map = {row["user_id"]: row["user_name"]} if row["user_name"] else {}
+        channel_map = {row["channel_id"]: row["channel_name"]} if row["channel_name"] else {}
+        return {
+            "content": row["content"],
+            "metadata": indexer.build_metadata(row, user_map, channel_map),
+            "updated_at": row["updated_at"]
+        }
+
+# Shared consumer, started at app startup when CDC_ENABLED is set
+message_cdc = MessageCDC(get_indexer=pinecone_service.aget)
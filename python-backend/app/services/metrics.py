@@ -0,0 +1,59 @@
+from collections import deque
+from typing import Dict, Any, Deque
+import os
+import threading
+
+# Observations kept per metric for percentiles
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))
+
+class Metrics:
+    """
+    In-process latency/value recorder with percentiles over a sliding window.
+
+    Each gunicorn worker keeps its own; /metrics reports the worker that
+    served the request.
+    """
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.window = window
+        self._values: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            values = self._values.get(name)
+            if values is None:
+                values = self._values[name] = deque(maxlen=self.window)
+            values.append(value)
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    @staticmethod
+    def _percentile(ordered, fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            values = {name: sorted(v) for name, v in self._values.items()}
+            counts = dict(self._counts)
+
+        report = {}
+        for name, count in counts.items():
+            ordered = values.get(name)
+            if not ordered:
+                report[name] = {"count": count}
+                continue
+            report[name] = {
+                "count": count,
+                "mean": round(sum(ordered) / len(ordered), 3),
+                "p50": round(self._percentile(ordered, 0.50), 3),
+                "p95": round(self._percentile(ordered, 0.95), 3),
+                "p99": round(self._percentile(ordered, 0.99), 3),
+                "max": round(ordered[-1], 3)
+            }
+        return report
+
+metrics = Metrics()
@@ -0,0 +1,261 @@
+from collections import deque
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional, AsyncIterator, Deque, Tuple
+import asyncio
+import logging
+import os
+import random
+import time
+from .upstream_governor import governor
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+TIER_FAST = "fast"
+TIER_STANDARD = "standard"
+TIER_FALLBACK = "fallback"
+
+CHAT_TEMPERATURE = float(os.getenv("CHAT_TEMPERATURE", "0.7"))
+CHAT_TIMEOUT_SECONDS = float(os.getenv("CHAT_TIMEOUT_SECONDS", "30"))
+
+# Requests without retrieved context and with a query under this many
+# characters go to the fast tier
+FAST_TIER_MAX_QUERY_CHARS = int(os.getenv("FAST_TIER_MAX_QUERY_CHARS", "200"))
+
+# A duplicate request is sent once the first has been outstanding longer
+# than this percentile of recent latencies for its tier. Completions and
+# streams are measured separately: a completion's latency is the whole
+# answer, a stream's is its time to first token.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "3.0"))
+HEDGE_DEFAULT_TTFT_DELAY = float(os.getenv("HEDGE_DEFAULT_TTFT_DELAY_SECONDS", "1.5"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.5"))
+# Hedges are skipped while they exceed this fraction of recent requests
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))
+LATENCY_WINDOW = 200
+# What a latency sample measures
+LATENCY_COMPLETION = "completion"
+LATENCY_TTFT = "ttft"
+# Below this many samples the default delay applies and hedges are uncapped
+MIN_SAMPLES = 20
+
+# Model per tier; the fallback may live on a different OpenAI-compatible endpoint
+TIER_MODELS = {
+    TIER_FAST: os.getenv("CHAT_MODEL_FAST", "gpt-4o-mini"),
+    TIER_STANDARD: os.getenv("CHAT_MODEL_STANDARD", "gpt-4o-mini"),
+    TIER_FALLBACK: os.getenv("CHAT_MODEL_FALLBACK", "gpt-3.5-turbo"),
+}
+FALLBACK_BASE_URL = os.getenv("CHAT_FALLBACK_BASE_URL")
+FALLBACK_API_KEY = os.getenv("CHAT_FALLBACK_API_KEY")
+
+# "base_ms=300,slow_ms=4000,slow_rate=0.1,error_rate=0.02" swaps every tier
+# for StubChatModel, to exercise hedging and fallback without OpenAI
+CHAT_MODEL_STUB = os.getenv("CHAT_MODEL_STUB", "")
+
+def classify(message: str, has_context: bool) -> str:
+    """Pick a tier: short questions with nothing retrieved don't need the standard model"""
+    if not has_context and len(message) <= FAST_TIER_MAX_QUERY_CHARS:
+        return TIER_FAST
+    return TIER_STANDARD
+
+class StubChatModel:
+    """
+    Stand-in for ChatOpenAI with injectable latency and errors.
+
+    Each call takes base_ms (plus jitter); with probability slow_rate it
+    takes slow_ms instead, and with error_rate it fails.
+    """
+    def __init__(self, name: str = "stub", base_ms: float = 300, slow_ms: float = 4000,
+                 slow_rate: float = 0.1, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.name = name
+        self.base_ms = base_ms
+        self.slow_ms = slow_ms
+        self.slow_rate = slow_rate
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_spec(cls, spec: str, name: str = "stub") -> "StubChatModel":
+        options = dict(part.split("=", 1) for part in spec.split(",") if "=" in part)
+        return cls(name=name, **{key: float(value) for key, value in options.items()})
+
+    def _latency(self) -> float:
+        if self._random.random() < self.slow_rate:
+            return self.slow_ms / 1000
+        return self.base_ms * self._random.uniform(0.8, 1.2) / 1000
+
+    def _maybe_fail(self):
+        if self._random.random() < self.error_rate:
+            raise RuntimeError(f"{self.name}: injected failure")
+
+    async def agenerate(self, batches):
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        text = f"[{self.name}] stub answer"
+        return SimpleNamespace(generations=[[SimpleNamespace(text=text)] for _ in batches])
+
+    async def astream(self, messages):
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        for word in f"[{self.name}] stub answer".split(" "):
+            await asyncio.sleep(0.01)
+            yield SimpleNamespace(content=word + " ")
+
+class ModelRouter:
+    """
+    Routes chat completions to a model tier with hedging and fallback.
+
+    A request that is still outstanding after its tier's latency percentile
+    gets a duplicate; the first success wins and the other is cancelled.
+    If every attempt on the tier fails, the fallback model answers. For
+    streams, the hedge is on time to first token.
+    """
+    def __init__(self, api_key: str, models: Optional[Dict[str, Any]] = None):
+        self.api_key = api_key
+        self.models = models or self._build_models(api_key)
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = {
+            (tier, kind): deque(maxlen=LATENCY_WINDOW)
+            for tier in self.models for kind in (LATENCY_COMPLETION, LATENCY_TTFT)
+        }
+        self._recent_hedges: Deque[bool] = deque(maxlen=LATENCY_WINDOW)
+
+    @staticmethod
+    def _build_models(api_key: str) -> Dict[str, Any]:
+        if CHAT_MODEL_STUB:
+            logger.warning("CHAT_MODEL_STUB set: using stub chat models")
+            return {tier: StubChatModel.from_spec(CHAT_MODEL_STUB, name=tier) for tier in TIER_MODELS}
+
+        from langchain_openai import ChatOpenAI # type: ignore
+
+        models = {}
+        for tier, model in TIER_MODELS.items():
+            options = {}
+            if tier == TIER_FALLBACK and FALLBACK_BASE_URL:
+                options["openai_api_base"] = FALLBACK_BASE_URL
+            models[tier] = ChatOpenAI(
+                model=model,
+                openai_api_key=(FALLBACK_API_KEY if tier == TIER_FALLBACK and FALLBACK_API_KEY else api_key),
+                temperature=CHAT_TEMPERATURE,
+                request_timeout=CHAT_TIMEOUT_SECONDS,
+                # Retries are replaced by hedging and fallback
+                max_retries=0,
+                **options
+            )
+        return models
+
+    def _provider(self, tier: str) -> str:
+        return "openai-fallback" if tier == TIER_FALLBACK and FALLBACK_BASE_URL else "openai"
+
+    def _api_key(self, tier: str) -> str:
+        return FALLBACK_API_KEY if tier == TIER_FALLBACK and FALLBACK_API_KEY else self.api_key
+
+    def hedge_delay(self, tier: str, kind: str = LATENCY_COMPLETION) -> float:
+        samples = sorted(self._latencies[(tier, kind)])
+        if len(samples) < MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY if kind == LATENCY_COMPLETION else HEDGE_DEFAULT_TTFT_DELAY
+        return max(HEDGE_MIN_DELAY, samples[min(len(samples) - 1, int(HEDGE_PERCENTILE * len(samples)))])
+
+    def _may_hedge(self) -> bool:
+        if not HEDGE_ENABLED:
+            return False
+        recent = self._recent_hedges
+        return len(recent) < MIN_SAMPLES or sum(recent) / len(recent) < HEDGE_MAX_RATE
+
+    def _record(self, tier: str, kind: str, seconds: float, hedged: bool):
+        self._latencies[(tier, kind)].append(seconds)
+        self._recent_hedges.append(hedged)
+        metrics.observe(f"llm_{tier}_ms" if kind == LATENCY_COMPLETION else f"llm_{tier}_ttft_ms", seconds * 1000)
+
+    async def _attempt(self, tier: str, messages: List[Any]) -> str:
+        async with governor.call(self._provider(tier), self._api_key(tier)):
+            response = await self.models[tier].agenerate([messages])
+        return response.generations[0][0].text
+
+    async def _first_success(self, tier: str, kind: str, make_attempt, hedge: bool):
+        """
+        Run make_attempt(), adding a duplicate after the hedge delay for this
+        kind of latency; return (result, hedged) from the first attempt to
+        succeed and cancel the rest
+        """
+        start = time.perf_counter()
+        attempts = [asyncio.create_task(make_attempt())]
+        hedged = False
+        error: Optional[BaseException] = None
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=self.hedge_delay(tier, kind))
+            if not done and hedge and self._may_hedge():
+                hedged = True
+                metrics.increment("llm_hedged")
+                logger.info(f"Hedging {tier} request after {time.perf_counter() - start:.2f}s")
+                attempts.append(asyncio.create_task(make_attempt()))
+
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if hedged and task is attempts[-1]:
+                            metrics.increment("llm_hedge_won")
+                        self._record(tier, kind, time.perf_counter() - start, hedged)
+                        return task.result(), hedged
+                    error = task.exception()
+                    logger.warning(f"{tier} attempt failed: {type(error).__name__}: {str(error)}")
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+            # Let the losers unwind (and release their governor slots) first
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+    async def generate(self, messages: List[Any], tier: str = TIER_STANDARD) -> Dict[str, Any]:
+        """Return {"text", "tier", "hedged", "fallback"}"""
+        try:
+            text, hedged = await self._first_success(
+                tier, LATENCY_COMPLETION, lambda: self._attempt(tier, messages), hedge=True
+            )
+            return {"text": text, "tier": tier, "hedged": hedged, "fallback": False}
+        except Exception as e:
+            if tier == TIER_FALLBACK:
+                raise
+            metrics.increment("llm_fallback")
+            logger.error(f"{tier} model failed ({type(e).__name__}), falling back to {TIER_MODELS[TIER_FALLBACK]}")
+            text = await self._attempt(TIER_FALLBACK, messages)
+            return {"text": text, "tier": TIER_FALLBACK, "hedged": False, "fallback": True}
+
+    async def _stream_attempt(self, tier: str, messages: List[Any]):
+        async with governor.call(self._provider(tier), self._api_key(tier)):
+            async for chunk in self.models[tier].astream(messages):
+                if chunk.content:
+                    yield chunk.content
+
+    async def astream(self, messages: List[Any], tier: str = TIER_STANDARD) -> AsyncIterator[str]:
+        """Yield text deltas, hedging and falling back on the first token"""
+        streams = []
+
+        async def first_token():
+            stream = self._stream_attempt(tier, messages)
+            streams.append(stream)
+            return await stream.__anext__(), stream
+
+        try:
+            (first, stream), _ = await self._first_success(tier, LATENCY_TTFT, first_token, hedge=True)
+        except Exception as e:
+            if tier == TIER_FALLBACK:
+                raise
+            metrics.increment("llm_fallback")
+            logger.error(f"{tier} stream failed ({type(e).__name__}), falling back to {TIER_MODELS[TIER_FALLBACK]}")
+            stream = self._stream_attempt(TIER_FALLBACK, messages)
+            streams.append(stream)
+            first = await stream.__anext__()
+        try:
+            # Losing attempts were cancelled; close their generators too
+            for other in streams:
+                if other is not stream:
+                    await other.aclose()
+            yield first
+            async for delta in stream:
+                yield delta
+        finally:
+            await stream.aclose()
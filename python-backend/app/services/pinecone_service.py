@@ -1,26 +1,61 @@
-from langchain_openai import OpenAIEmbeddings # type: ignore
-from langchain.text_splitter import RecursiveCharacterTextSplitter # type: ignore
-from langchain_pinecone import PineconeVectorStore # type: ignore
-from langchain.schema.document import Document # type: ignore
-from langchain_community.document_loaders.pdf import PyPDFLoader # type: ignore
-from langchain_community.document_loaders import DirectoryLoader # type: ignore
 import os # type: ignore
 from dotenv import load_dotenv # type: ignore
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import uuid
-from supabase import create_client, Client # type: ignore
 import asyncio
-from datetime import datetime
+from datetime import datetime, timezone
 import logging
-from pinecone import Pinecone # type: ignore
 import traceback
+from .upstream_governor import governor, background_priority
+from .supabase_client import get_supabase
+from .lazy import lazy_resource
+from .shared_cache import shared_cache
+from .directory_cache import directory_cache
+from .sharding import shard_router, is_message_shard, MESSAGES_NAMESPACE, SHARD_KEY
+from .channel_centroids import channel_centroids, CENTROID_TOP_CHANNELS
+import hashlib
 
 logger = logging.getLogger(__name__)
 
+# Query embeddings are cached in the cross-process shared cache
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", str(24 * 3600)))
 
+# Chunking of long messages at ingest time (characters)
+MESSAGE_CHUNK_SIZE = int(os.getenv("MESSAGE_CHUNK_SIZE", "1000"))
+MESSAGE_CHUNK_OVERLAP = int(os.getenv("MESSAGE_CHUNK_OVERLAP", "200"))
 
+# Chat messages and ingested documents live in separate namespaces; chat
+# messages may be further sharded by workspace or channel (see sharding.py)
+DOCUMENTS_NAMESPACE = "documents"
 
+# Embedding model and size. text-embedding-3 models accept a reduced
+# dimension count (0 keeps the model default, 3072 for -large); the Pinecone
+# index must be created with the same dimension.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
 
+# When disabled, message vectors carry no text and hits are hydrated from
+# Supabase; document chunks always keep their text, as it has no other home
+VECTOR_METADATA_TEXT = os.getenv("VECTOR_METADATA_TEXT", "true").lower() == "true"
+
+# Vectors per Pinecone upsert request
+UPSERT_BATCH_SIZE = 100
+# Vector IDs per Pinecone delete request
+DELETE_BATCH_SIZE = 1000
+# Vector IDs per Pinecone fetch request
+FETCH_BATCH_SIZE = 200
+# IDs per Supabase in_() filter, which travels in the URL
+SUPABASE_IN_BATCH_SIZE = 200
+SUPABASE_WRITE_BATCH_SIZE = 500
+
+# Supabase table recording what is in the messages namespace
+VECTOR_MANIFEST_TABLE = "message_vectors"
+# Query matches fetched per requested message, to leave room for collapsing chunks
+QUERY_OVERFETCH = int(os.getenv("QUERY_OVERFETCH", "3"))
+
+# langchain and the pinecone client are imported inside
+# PineconeService.__init__ so importing this module stays cheap; document
+# loaders and text splitters are imported where they are used.
 
 class PineconeService:
     def __init__(self):
@@ -33,28 +68,65 @@ class PineconeService:
         self.pinecone_index = os.getenv("PINECONE_INDEX_NAME")
         self.supabase_url = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
         self.supabase_key = os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+        self.openai_api_key = os.getenv("OPENAI_API_KEY")
         
         if not all([self.pinecone_api_key, self.pinecone_environment, self.pinecone_index]):
             raise ValueError("Missing required Pinecone environment variables")
 
-        # Initialize Supabase client
-        self.supabase: Client = create_client(self.supabase_url, self.supabase_key)
+        from langchain_openai import OpenAIEmbeddings # type: ignore
+        from pinecone import Pinecone # type: ignore
+
+        # Shared Supabase client
+        self.supabase = get_supabase()
 
         # Initialize Pinecone with proper configuration
         self.pc = Pinecone(api_key=self.pinecone_api_key)
         self.index = self.pc.Index(self.pinecone_index)
 
         # Initialize embedding model
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-
-        # Initialize vector store
-        self.vector_store = PineconeVectorStore.from_existing_index(
-            index_name=self.pinecone_index,
-            embedding=self.embeddings,
-            namespace="messages"  # Added namespace for better organization
+        self.embedding_model = EMBEDDING_MODEL
+        self.embedding_dimensions = EMBEDDING_DIMENSIONS or None
+        self.embeddings = OpenAIEmbeddings(
+            model=self.embedding_model,
+            dimensions=self.embedding_dimensions
         )
-        logger.info("Vector store initialized successfully")
+
+        # Long messages are split into overlapping chunks, one vector each
+        self.chunk_size = MESSAGE_CHUNK_SIZE
+        self.chunk_overlap = MESSAGE_CHUNK_OVERLAP
+        self._splitter = None
+        logger.info("Pinecone index initialized successfully")
         
+    async def embed_query(self, text: str) -> List[float]:
+        """Embed a query, reusing embeddings cached by any worker process"""
+        key = hashlib.sha256(f"{self.embedding_model}|{self.embedding_dimensions or ''}|{text}".encode("utf-8")).hexdigest()
+        cached = await shared_cache.aget_json("embeddings", key)
+        if cached is not None:
+            return cached
+
+        async with governor.call("openai", self.openai_api_key):
+            vector = await self.embeddings.aembed_query(text)
+        await shared_cache.aset_json("embeddings", key, vector, ttl=EMBEDDING_CACHE_TTL)
+        return vector
+
+    def split_message(self, message: str) -> List[str]:
+        """Split a message into overlapping chunks; short messages stay whole"""
+        if len(message) <= self.chunk_size:
+            return [message]
+        if self._splitter is None:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter # type: ignore
+            self._splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap
+            )
+        return self._splitter.split_text(message)
+
+    @staticmethod
+    def chunk_vector_id(message_id: str, chunk_index: int) -> str:
+        """The first chunk keeps the original msg_<id> ID; later chunks get a #n suffix"""
+        base = f"msg_{message_id}"
+        return base if chunk_index == 0 else f"{base}#{chunk_index}"
+
     async def upsert_message(self, message: str, metadata: Dict[str, Any]):
         try:
             # Skip DM messages
@@ -63,26 +135,8 @@ class PineconeService:
                 return False
                 
             logger.info(f"Starting upsert for channel message: {message[:50]}...")
-            
-            # Generate embedding
-            logger.info("Generating embedding...")
-            vector = await self.embeddings.aembed_query(message)
-            logger.info("Embedding generated successfully")
-            
-            # Create unique ID
-            vector_id = f"msg_{metadata['message_id']}"
-            logger.info(f"Vector ID created: {vector_id}")
-            
-            # Create document with metadata
-            document = Document(
-                page_content=message,
-                metadata=metadata
-            )
-            
-            # Upsert to Pinecone using the correct method
-            logger.info("Upserting to Pinecone...")
-            await self.vector_store.aadd_documents([document], ids=[vector_id])
-            logger.info(f"Successfully upserted channel message {vector_id} to Pinecone")
+            await self.upsert_messages([{"content": message, "metadata": metadata}])
+            logger.info(f"Successfully upserted channel message msg_{metadata['message_id']} to Pinecone")
             
             return True
             
@@ -91,41 +145,262 @@ class PineconeService:
             logger.error(f"Full traceback: {traceback.format_exc()}")
             raise
 
-    async def query_similar(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    async def upsert_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        Chunk, embed and upsert a batch of messages.
+
+        Each message becomes one vector per chunk, all sharing its message_id;
+        every chunk in the batch is embedded in a single batched call. DMs are
+        skipped. Vectors go to the shard of their channel. Returns the number
+        of vectors written.
+        """
+        messages = await self._with_current_names(messages)
+        shards = await shard_router.namespaces_for(msg["metadata"].get("channel_id") for msg in messages)
+        vectors = []
+        texts = []
+        manifest_rows = []
+        for msg in messages:
+            metadata = msg["metadata"]
+            if metadata.get('message_type') == 'dm':
+                continue
+            chunks = self.split_message(msg["content"])
+            namespace = shards.get(str(metadata.get("channel_id")), MESSAGES_NAMESPACE)
+            manifest_rows.append({
+                "message_id": str(metadata["message_id"]),
+                "content_hash": self.content_hash(msg["content"]),
+                "chunk_count": len(chunks),
+                "namespace": namespace,
+                "source_updated_at": msg.get("updated_at"),
+                "indexed_at": datetime.now(timezone.utc).isoformat()
+            })
+            for chunk_index, chunk in enumerate(chunks):
+                vector_id = self.chunk_vector_id(metadata["message_id"], chunk_index)
+                chunk_metadata = {
+                    **metadata,
+                    "chunk_index": chunk_index,
+                    "chunk_count": len(chunks)
+                }
+                if VECTOR_METADATA_TEXT:
+                    # Text goes under "text", where PineconeVectorStore reads it back
+                    chunk_metadata["text"] = chunk
+                vectors.append((vector_id, chunk_metadata, namespace))
+                texts.append(chunk)
+
+        if not texts:
+            return 0
+
+        logger.info(f"Generating embeddings for {len(texts)} chunks...")
+        async with governor.call("openai", self.openai_api_key):
+            embeddings = await self.embeddings.aembed_documents(texts)
+
+        records_by_namespace: Dict[str, List[tuple]] = {}
+        for (vector_id, chunk_metadata, namespace), embedding in zip(vectors, embeddings):
+            records_by_namespace.setdefault(namespace, []).append((vector_id, embedding, chunk_metadata))
+        for namespace, records in records_by_namespace.items():
+            for i in range(0, len(records), UPSERT_BATCH_SIZE):
+                async with governor.call("pinecone", self.pinecone_api_key):
+                    await asyncio.to_thread(
+                        self.index.upsert,
+                        vectors=records[i:i + UPSERT_BATCH_SIZE],
+                        namespace=namespace
+                    )
+
+        # Drop chunks left over from a longer previous version, or all of the
+        # old chunks if the message now lives in another shard; then record
+        # what is indexed
+        previous = await self._load_vector_manifest([row["message_id"] for row in manifest_rows])
+        stale: Dict[str, List[str]] = {}
+        for row in manifest_rows:
+            old = previous.get(row["message_id"]) or {}
+            old_namespace = old.get("namespace") or MESSAGES_NAMESPACE
+            first_stale = row["chunk_count"] if old_namespace == row["namespace"] else 0
+            stale.setdefault(old_namespace, []).extend(
+                self.chunk_vector_id(row["message_id"], chunk_index)
+                for chunk_index in range(first_stale, old.get("chunk_count") or 0)
+            )
+        for namespace, stale_ids in stale.items():
+            await self._delete_vectors(stale_ids, namespace)
+        await self._save_vector_manifest(manifest_rows)
+        await self._add_to_centroids(vectors, embeddings)
+        return len(vectors)
+
+    async def _add_to_centroids(self, vectors: List[tuple], embeddings: List[List[float]]):
+        """Fold newly written chunk vectors into their channels' centroids"""
+        deltas: Dict[str, Any] = {}
+        for (_, chunk_metadata, namespace), embedding in zip(vectors, embeddings):
+            channel_id = chunk_metadata.get("channel_id")
+            if not channel_id:
+                continue
+            _, vector_sum, count = deltas.get(str(channel_id)) or (namespace, [0.0] * len(embedding), 0)
+            deltas[str(channel_id)] = (namespace, [a + b for a, b in zip(vector_sum, embedding)], count + 1)
+        try:
+            await channel_centroids.add(deltas)
+        except Exception as e:
+            # Centroids only steer retrieval; rebuild_centroids repairs them
+            logger.error(f"Error updating channel centroids: {str(e)}")
+
+    async def _with_current_names(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Replace client-supplied user and channel names with the directory's current ones"""
+        metadatas = [msg["metadata"] for msg in messages]
+        user_map, channel_map = await directory_cache.name_maps(
+            [m.get("user_id") for m in metadatas] + [m.get("receiver_id") for m in metadatas],
+            [m.get("channel_id") for m in metadatas]
+        )
+        resolved = []
+        for msg in messages:
+            metadata = dict(msg["metadata"])
+            for id_key, name_key, names in (
+                ("user_id", "user_name", user_map),
+                ("receiver_id", "receiver_name", user_map),
+                ("channel_id", "channel_name", channel_map)
+            ):
+                name = names.get(str(metadata.get(id_key)))
+                if name:
+                    metadata[name_key] = name
+            resolved.append({**msg, "metadata": metadata})
+        return resolved
+
+    @staticmethod
+    def content_hash(content: str) -> str:
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    async def _load_vector_manifest(self, message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch manifest rows for the given messages, keyed by message_id"""
+        rows = {}
+        for i in range(0, len(message_ids), SUPABASE_IN_BATCH_SIZE):
+            batch = message_ids[i:i + SUPABASE_IN_BATCH_SIZE]
+            response = await asyncio.to_thread(
+                lambda: self.supabase.table(VECTOR_MANIFEST_TABLE).select("*").in_("message_id", batch).execute()
+            )
+            rows.update({row["message_id"]: row for row in response.data})
+        return rows
+
+    async def _save_vector_manifest(self, rows: List[Dict[str, Any]]):
+        for i in range(0, len(rows), SUPABASE_WRITE_BATCH_SIZE):
+            batch = rows[i:i + SUPABASE_WRITE_BATCH_SIZE]
+            await asyncio.to_thread(
+                lambda: self.supabase.table(VECTOR_MANIFEST_TABLE).upsert(batch).execute()
+            )
+
+    async def _delete_vectors(self, vector_ids: List[str], namespace: str = MESSAGES_NAMESPACE):
+        for i in range(0, len(vector_ids), DELETE_BATCH_SIZE):
+            async with governor.call("pinecone", self.pinecone_api_key):
+                await asyncio.to_thread(
+                    self.index.delete,
+                    ids=vector_ids[i:i + DELETE_BATCH_SIZE],
+                    namespace=namespace
+                )
+
+    async def delete_messages(self, message_ids: List[str]) -> int:
+        """
+        Remove every chunk vector of the given messages and their manifest rows.
+
+        Returns the number of vector IDs deleted.
+        """
+        message_ids = [str(message_id) for message_id in message_ids]
+        manifest = await self._load_vector_manifest(message_ids)
+        by_namespace: Dict[str, List[str]] = {}
+        for message_id in message_ids:
+            row = manifest.get(message_id) or {}
+            # Messages indexed before the manifest existed have a single
+            # vector in the unsharded namespace
+            by_namespace.setdefault(row.get("namespace") or MESSAGES_NAMESPACE, []).extend(
+                self.chunk_vector_id(message_id, chunk_index)
+                for chunk_index in range(row.get("chunk_count") or 1)
+            )
+        vector_ids = [vector_id for ids in by_namespace.values() for vector_id in ids]
+        for namespace, ids in by_namespace.items():
+            await self._delete_vectors(ids, namespace)
+
+        for i in range(0, len(message_ids), SUPABASE_IN_BATCH_SIZE):
+            batch = message_ids[i:i + SUPABASE_IN_BATCH_SIZE]
+            await asyncio.to_thread(
+                lambda: self.supabase.table(VECTOR_MANIFEST_TABLE).delete().in_("message_id", batch).execute()
+            )
+        logger.info(f"Deleted {len(vector_ids)} vectors for {len(message_ids)} messages")
+        return len(vector_ids)
+
+    async def query_similar(
+        self,
+        query: str,
+        top_k: int = 5,
+        namespaces: Optional[List[str]] = None,
+        hydrate: bool = not VECTOR_METADATA_TEXT,
+        user_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
         """
         Search for messages similar to the query using semantic search.
+
+        Chunk hits are collapsed so each message (or document) appears once,
+        represented by its best-scoring chunk. When several namespaces are
+        given they are searched concurrently and merged by score. The
+        messages namespace stands for every message shard the user can see.
         
         Args:
             query: The search query
             top_k: Number of similar messages to return
+            namespaces: Namespaces to search, defaults to messages only
+            hydrate: Refresh message hits from Supabase (see hydrate_messages);
+                required when message text is kept out of the index
+            user_id: Caller whose visible channels and uploaded documents are
+                searched; public channels and shared documents only if omitted
+                (with SHARD_KEY=none every message is searched)
             
         Returns:
             List of similar messages with their metadata and similarity scores
         """
         try:
             logger.info(f"Searching for messages similar to: {query[:50]}...")
+            namespaces = namespaces or [MESSAGES_NAMESPACE]
             
             # Generate embedding for the query
             logger.info("Generating query embedding...")
-            query_embedding = await self.embeddings.aembed_query(query)
+            query_embedding = await self.embed_query(query)
             logger.info("Query embedding generated successfully")
+
+            message_filter = None
+            if MESSAGES_NAMESPACE in namespaces:
+                shards, message_filter = await self._message_scope(query_embedding, user_id)
+                namespaces = [n for n in namespaces if n != MESSAGES_NAMESPACE] + shards
             
-            # Search in Pinecone
-            logger.info(f"Searching Pinecone for top {top_k} similar messages...")
-            results = await self.vector_store.asimilarity_search_with_score(
-                query=query,
-                k=top_k
+            # Over-fetch so enough distinct messages survive collapsing chunks
+            fetch_k = min(top_k * QUERY_OVERFETCH, 1000)
+            logger.info(f"Searching {', '.join(namespaces)} for top {top_k} similar messages...")
+            document_filter = self._document_scope(user_id)
+            responses = await asyncio.gather(*(
+                self._query_namespace(
+                    query_embedding, namespace, fetch_k,
+                    message_filter if is_message_shard(namespace)
+                    else document_filter if namespace == DOCUMENTS_NAMESPACE else None
+                )
+                for namespace in namespaces
+            ))
+            matches = sorted(
+                (match for response in responses for match in response.matches),
+                key=lambda match: match.score,
+                reverse=True
             )
             
-            # Format results
+            # Format results, keeping the best chunk per message or document
             formatted_results = []
-            for doc, score in results:
+            seen = set()
+            for match in matches:
+                metadata = dict(match.metadata or {})
+                content = metadata.pop("text", "")
+                source_id = metadata.get("message_id") or metadata.get("document_id") or match.id
+                if source_id in seen:
+                    continue
+                seen.add(source_id)
                 formatted_results.append({
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "similarity_score": score
+                    "content": content,
+                    "metadata": metadata,
+                    "similarity_score": match.score
                 })
+                if len(formatted_results) == top_k:
+                    break
             
+            if hydrate:
+                formatted_results = await self.hydrate_messages(formatted_results)
             logger.info(f"Found {len(formatted_results)} similar messages")
             return formatted_results
             
@@ -133,6 +408,109 @@ class PineconeService:
             logger.error(f"Error searching similar messages: {str(e)}")
             logger.error(f"Full traceback: {traceback.format_exc()}")
             raise
+
+    async def hydrate_messages(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Replace vector metadata of message hits with the current Supabase row
+        and current user/channel names, using one messages query for all hits.
+
+        Hits whose message was deleted are dropped. Missing text is filled in
+        by re-splitting the message, which is deterministic for unchanged
+        content. Document hits pass through untouched.
+        """
+        message_ids = list({
+            str(r["metadata"]["message_id"]) for r in results
+            if r["metadata"].get("message_type") != "document" and r["metadata"].get("message_id")
+        })
+        if not message_ids:
+            return results
+
+        response = await asyncio.to_thread(
+            lambda: self.supabase.table("messages")
+            .select("id, content, user_id, channel_id, receiver_id, is_direct_message, created_at, edited_at")
+            .in_("id", message_ids).execute()
+        )
+        rows = {str(row["id"]): row for row in response.data}
+        user_map, channel_map = await directory_cache.name_maps(
+            [row["user_id"] for row in rows.values()] + [row["receiver_id"] for row in rows.values()],
+            [row["channel_id"] for row in rows.values()]
+        )
+
+        hydrated = []
+        for result in results:
+            metadata = result["metadata"]
+            message_id = str(metadata.get("message_id") or "")
+            if metadata.get("message_type") == "document" or not message_id:
+                hydrated.append(result)
+                continue
+            row = rows.get(message_id)
+            if row is None:
+                logger.info(f"Dropping hit for deleted message {message_id}")
+                continue
+
+            chunk_index = int(metadata.get("chunk_index") or 0)
+            content = result["content"]
+            if not content:
+                chunks = self.split_message(row["content"])
+                content = chunks[chunk_index] if chunk_index < len(chunks) else row["content"]
+            current = self.build_metadata(row, user_map, channel_map)
+            current.update({
+                "chunk_index": chunk_index,
+                "chunk_count": metadata.get("chunk_count", 1),
+                "edited_at": row.get("edited_at")
+            })
+            hydrated.append({**result, "content": content, "metadata": current})
+        return hydrated
+
+    async def _message_scope(self, query_embedding: List[float], user_id: Optional[str]):
+        """
+        Message shards to search and the metadata filter to apply there.
+
+        With CENTROID_TOP_CHANNELS set, the channels whose centroids best
+        match the query are picked first and only their messages are
+        searched; otherwise every channel the caller can see is searched.
+        """
+        if CENTROID_TOP_CHANNELS <= 0:
+            return await self._visible_scope(user_id)
+
+        visible = await shard_router.visible_channels(user_id) if SHARD_KEY != "none" else None
+        chosen = await channel_centroids.select(query_embedding, CENTROID_TOP_CHANNELS, visible)
+        if not chosen:
+            # No centroids yet: fall back to the flat search
+            return await self._visible_scope(user_id)
+        channel_ids = [channel_id for channel_id, _ in chosen]
+        logger.info(f"Searching within channels picked by centroid: {chosen}")
+        shards = sorted(set((await shard_router.namespaces_for(channel_ids)).values()))
+        return shards, {"channel_id": {"$in": channel_ids}}
+
+    async def _visible_scope(self, user_id: Optional[str]):
+        """Shards holding the caller's visible channels, and a filter to just those channels"""
+        if SHARD_KEY == "none":
+            # The unsharded layout predates per-user visibility and searches everything
+            return [MESSAGES_NAMESPACE], None
+        channel_ids = await shard_router.visible_channels(user_id)
+        shards = sorted(set((await shard_router.namespaces_for(channel_ids)).values()))
+        # A workspace or group shard also holds channels the caller can't read
+        return shards, {"channel_id": {"$in": sorted(channel_ids)}}
+
+    @staticmethod
+    def _document_scope(user_id: Optional[str]) -> Dict[str, Any]:
+        """Shared documents plus the caller's own uploads (tagged with user_id at ingest)"""
+        shared = {"user_id": {"$exists": False}}
+        if not user_id:
+            return shared
+        return {"$or": [shared, {"user_id": str(user_id)}]}
+
+    async def _query_namespace(self, vector: List[float], namespace: str, top_k: int, metadata_filter: Optional[Dict[str, Any]] = None):
+        async with governor.call("pinecone", self.pinecone_api_key):
+            return await asyncio.to_thread(
+                self.index.query,
+                vector=vector,
+                top_k=top_k,
+                namespace=namespace,
+                filter=metadata_filter,
+                include_metadata=True
+            )
         
     async def batch_process_messages(self, batch_size: int = 100) -> Dict[str, Any]:
         """
@@ -153,75 +531,8 @@ class PineconeService:
         }
 
         try:
-            # Get all messages
-            messages_response = self.supabase.table('messages').select('*').execute()
-            
-            # Fetch all channels and cache them
-            channels_response = self.supabase.table('channels').select('id, name').execute()
-            channel_map = {str(channel['id']): channel['name'] for channel in channels_response.data}
-            
-            # Fetch all users and cache them
-            users_response = self.supabase.table('users').select('id, username').execute()
-            user_map = {str(user['id']): user['username'] for user in users_response.data}
-            
-            all_messages = []
-            for msg in messages_response.data:
-                metadata = {
-                    "message_id": msg["id"],
-                    "user_id": msg["user_id"],
-                    "user_name": user_map.get(str(msg["user_id"]), "Unknown User"),
-                    "timestamp": msg["created_at"],
-                    "message_type": "dm" if msg["is_direct_message"] else "channel"
-                }
-                
-                # Add channel or receiver info with both ID and name
-                if msg["is_direct_message"]:
-                    receiver_id = str(msg["receiver_id"])
-                    metadata.update({
-                        "receiver_id": receiver_id,
-                        "receiver_name": user_map.get(receiver_id, "Unknown User")
-                    })
-                else:
-                    channel_id = str(msg["channel_id"])
-                    metadata.update({
-                        "channel_id": channel_id,
-                        "channel_name": channel_map.get(channel_id, "Unknown Channel")
-                    })
-
-                all_messages.append({
-                    "content": msg["content"],
-                    "metadata": metadata
-                })
-
-            # Process messages in batches
-            total_batches = (len(all_messages) + batch_size - 1) // batch_size
-            logger.info(f"Processing {len(all_messages)} messages in {total_batches} batches")
-            
-            for i in range(0, len(all_messages), batch_size):
-                current_batch = i // batch_size + 1
-                logger.info(f"Processing batch {current_batch}/{total_batches}")
-                
-                batch = all_messages[i:i + batch_size]
-                batch_start_time = datetime.now()
-                
-                for msg_index, msg in enumerate(batch, 1):
-                    try:
-                        logger.info(f"Processing message {i + msg_index}/{len(all_messages)}")
-                        await self.upsert_message(msg["content"], msg["metadata"])
-                        stats["successful"] += 1
-                    except Exception as e:
-                        logger.error(f"Error processing message: {e}")
-                        logger.error(f"Full traceback: {traceback.format_exc()}")
-                        stats["failed"] += 1
-                    
-                    stats["total_processed"] += 1
-                
-                batch_duration = datetime.now() - batch_start_time
-                logger.info(f"Batch {current_batch} completed in {batch_duration.total_seconds():.2f} seconds")
-                
-                # Small delay to prevent overwhelming the API
-                await asyncio.sleep(0.1)
-
+            with background_priority():
+                await self._batch_upsert_all(batch_size, stats)
         except Exception as e:
             logger.error(f"Batch processing error: {e}")
             logger.error(f"Full traceback: {traceback.format_exc()}")
@@ -233,4 +544,268 @@ class PineconeService:
         logger.info(f"Successful: {stats['successful']}")
         logger.info(f"Failed: {stats['failed']}")
         return stats
-        
\ No newline at end of file
+
+    @staticmethod
+    def build_metadata(msg: Dict[str, Any], user_map: Dict[str, str], channel_map: Dict[str, str]) -> Dict[str, Any]:
+        """Build vector metadata for a messages row"""
+        metadata = {
+            "message_id": msg["id"],
+            "user_id": msg["user_id"],
+            "user_name": user_map.get(str(msg["user_id"]), "Unknown User"),
+            "timestamp": msg["created_at"],
+            "message_type": "dm" if msg["is_direct_message"] else "channel"
+        }
+        
+        # Add channel or receiver info with both ID and name
+        if msg["is_direct_message"]:
+            receiver_id = str(msg["receiver_id"])
+            metadata.update({
+                "receiver_id": receiver_id,
+                "receiver_name": user_map.get(receiver_id, "Unknown User")
+            })
+        else:
+            channel_id = str(msg["channel_id"])
+            metadata.update({
+                "channel_id": channel_id,
+                "channel_name": channel_map.get(channel_id, "Unknown Channel")
+            })
+        return metadata
+
+    async def _batch_upsert_all(self, batch_size: int, stats: Dict[str, Any]):
+        """Load every message from Supabase and upsert it, updating stats in place"""
+        # Get all messages
+        messages_response = self.supabase.table('messages').select('*').execute()
+        
+        # Resolve names through the shared directory cache instead of loading both tables
+        user_map, channel_map = await directory_cache.name_maps(
+            [msg["user_id"] for msg in messages_response.data] + [msg["receiver_id"] for msg in messages_response.data],
+            [msg["channel_id"] for msg in messages_response.data]
+        )
+        
+        all_messages = [
+            {
+                "content": msg["content"],
+                "metadata": self.build_metadata(msg, user_map, channel_map),
+                "updated_at": msg.get("updated_at")
+            }
+            for msg in messages_response.data
+        ]
+
+        # Process messages in batches
+        total_batches = (len(all_messages) + batch_size - 1) // batch_size
+        logger.info(f"Processing {len(all_messages)} messages in {total_batches} batches")
+        
+        for i in range(0, len(all_messages), batch_size):
+            current_batch = i // batch_size + 1
+            logger.info(f"Processing batch {current_batch}/{total_batches}")
+            
+            batch = all_messages[i:i + batch_size]
+            batch_start_time = datetime.now()
+            
+            try:
+                await self.upsert_messages(batch)
+                stats["successful"] += len(batch)
+            except Exception as e:
+                logger.error(f"Error processing batch {current_batch}: {e}")
+                logger.error(f"Full traceback: {traceback.format_exc()}")
+                stats["failed"] += len(batch)
+            
+            stats["total_processed"] += len(batch)
+            
+            batch_duration = datetime.now() - batch_start_time
+            logger.info(f"Batch {current_batch} completed in {batch_duration.total_seconds():.2f} seconds")
+
+    async def shard_stats(self) -> Dict[str, Any]:
+        """Vector counts of every message shard in the index"""
+        async with governor.call("pinecone", self.pinecone_api_key):
+            stats = await asyncio.to_thread(self.index.describe_index_stats)
+        return {
+            namespace: summary.vector_count
+            for namespace, summary in (stats.namespaces or {}).items()
+            if is_message_shard(namespace)
+        }
+
+    async def rebuild_shard(self, namespace: str, batch_size: int = 100) -> Dict[str, Any]:
+        """
+        Empty one message shard and re-embed the messages of its channels.
+
+        Other shards are untouched. Rebuilding the unsharded "messages"
+        namespace after switching SHARD_KEY clears out the old layout.
+        """
+        if not is_message_shard(namespace):
+            raise ValueError(f"{namespace!r} is not a message shard")
+        stats = {"namespace": namespace, "channels": 0, "messages": 0, "vectors": 0, "failed": 0}
+
+        with background_priority():
+            channel_ids = await shard_router.channels_in(namespace)
+            stats["channels"] = len(channel_ids)
+            logger.info(f"Rebuilding shard {namespace} from {len(channel_ids)} channels")
+
+            async with governor.call("pinecone", self.pinecone_api_key):
+                await asyncio.to_thread(self.index.delete, delete_all=True, namespace=namespace)
+            await asyncio.to_thread(
+                lambda: self.supabase.table(VECTOR_MANIFEST_TABLE).delete().eq("namespace", namespace).execute()
+            )
+            # Re-embedding adds every chunk to the centroids again
+            await channel_centroids.replace(namespace, {})
+
+            for i in range(0, len(channel_ids), SUPABASE_IN_BATCH_SIZE):
+                batch_channels = channel_ids[i:i + SUPABASE_IN_BATCH_SIZE]
+                rows = await self._select_all(
+                    "messages", "*", "id", lambda q: q.in_("channel_id", batch_channels), 1000
+                )
+                user_map, channel_map = await directory_cache.name_maps(
+                    [row["user_id"] for row in rows], [row["channel_id"] for row in rows]
+                )
+                for j in range(0, len(rows), batch_size):
+                    batch = rows[j:j + batch_size]
+                    try:
+                        stats["vectors"] += await self.upsert_messages([
+                            {
+                                "content": row["content"],
+                                "metadata": self.build_metadata(row, user_map, channel_map),
+                                "updated_at": row.get("updated_at")
+                            }
+                            for row in batch
+                        ])
+                        stats["messages"] += len(batch)
+                    except Exception as e:
+                        logger.error(f"Error rebuilding batch of {namespace}: {str(e)}")
+                        logger.error(f"Full traceback: {traceback.format_exc()}")
+                        stats["failed"] += len(batch)
+
+        logger.info(f"Shard rebuild finished: {stats}")
+        return stats
+
+    async def rebuild_centroids(self) -> Dict[str, Any]:
+        """
+        Recompute every channel centroid from the vectors in the index.
+
+        Upserts only ever add to centroids, so edited and deleted messages
+        leave them slightly off; this replaces them with exact sums. Uses
+        Index.list, which needs a serverless index.
+        """
+        stats = {"namespaces": 0, "channels": 0, "vectors": 0}
+        with background_priority():
+            for namespace in await self.shard_stats():
+                sums: Dict[str, Any] = {}
+                async for vectors in self._fetch_namespace(namespace):
+                    for vector in vectors:
+                        channel_id = (vector.metadata or {}).get("channel_id")
+                        if not channel_id:
+                            continue
+                        vector_sum, count = sums.get(str(channel_id)) or ([0.0] * len(vector.values), 0)
+                        sums[str(channel_id)] = ([a + b for a, b in zip(vector_sum, vector.values)], count + 1)
+                        stats["vectors"] += 1
+                await channel_centroids.replace(namespace, sums)
+                stats["namespaces"] += 1
+                stats["channels"] += len(sums)
+        logger.info(f"Centroid rebuild finished: {stats}")
+        return stats
+
+    async def _fetch_namespace(self, namespace: str):
+        """Yield pages of stored vectors (values and metadata) in a namespace"""
+        pages = await asyncio.to_thread(lambda: list(self.index.list(namespace=namespace)))
+        for ids in pages:
+            for i in range(0, len(ids), FETCH_BATCH_SIZE):
+                async with governor.call("pinecone", self.pinecone_api_key):
+                    response = await asyncio.to_thread(
+                        self.index.fetch, ids=ids[i:i + FETCH_BATCH_SIZE], namespace=namespace
+                    )
+                yield list(response.vectors.values())
+
+    async def reconcile(self, page_size: int = 1000) -> Dict[str, Any]:
+        """
+        Bring the index in line with Supabase messages.
+
+        Compares message IDs and updated_at against the vector manifest, so
+        only new or touched rows are fetched in full; of those, only rows
+        whose content hash changed are re-embedded. Manifest entries with no
+        source row are deleted from the index in bulk.
+        """
+        stats = {"scanned": 0, "candidates": 0, "embedded": 0, "unchanged": 0, "deleted": 0, "failed": 0}
+
+        with background_priority():
+            source = await self._select_all(
+                "messages", "id, updated_at", "id", lambda q: q.eq("is_direct_message", False), page_size
+            )
+            indexed = await self._select_all(
+                VECTOR_MANIFEST_TABLE, "*", "message_id", None, page_size
+            )
+            source_ts = {str(row["id"]): row["updated_at"] for row in source}
+            index_state = {row["message_id"]: row for row in indexed}
+            stats["scanned"] = len(source_ts)
+
+            orphans = [message_id for message_id in index_state if message_id not in source_ts]
+            candidates = [
+                message_id for message_id, updated_at in source_ts.items()
+                if message_id not in index_state or index_state[message_id].get("source_updated_at") != updated_at
+            ]
+            stats["candidates"] = len(candidates)
+            logger.info(f"Reconcile: {len(candidates)} candidates, {len(orphans)} orphans of {len(source_ts)} messages")
+
+            for i in range(0, len(candidates), SUPABASE_IN_BATCH_SIZE):
+                batch_ids = candidates[i:i + SUPABASE_IN_BATCH_SIZE]
+                try:
+                    rows = (await asyncio.to_thread(
+                        lambda: self.supabase.table("messages").select("*").in_("id", batch_ids).execute()
+                    )).data
+                    changed, touched = [], []
+                    for row in rows:
+                        current = index_state.get(str(row["id"]))
+                        if current and current.get("content_hash") == self.content_hash(row["content"]):
+                            touched.append({**current, "source_updated_at": row.get("updated_at")})
+                        else:
+                            changed.append(row)
+
+                    if changed:
+                        user_map, channel_map = await directory_cache.name_maps(
+                            [row["user_id"] for row in changed] + [row["receiver_id"] for row in changed],
+                            [row["channel_id"] for row in changed]
+                        )
+                        await self.upsert_messages([
+                            {
+                                "content": row["content"],
+                                "metadata": self.build_metadata(row, user_map, channel_map),
+                                "updated_at": row.get("updated_at")
+                            }
+                            for row in changed
+                        ])
+                    # Only metadata columns changed; record the new timestamps without
+                    # re-embedding, as whole manifest rows so they upsert in batches
+                    await self._save_vector_manifest(touched)
+                    stats["embedded"] += len(changed)
+                    stats["unchanged"] += len(touched)
+                except Exception as e:
+                    logger.error(f"Error reconciling batch: {str(e)}")
+                    logger.error(f"Full traceback: {traceback.format_exc()}")
+                    stats["failed"] += len(batch_ids)
+
+            if orphans:
+                await self.delete_messages(orphans)
+                stats["deleted"] = len(orphans)
+
+        logger.info(f"Reconcile finished: {stats}")
+        return stats
+
+    async def _select_all(self, table: str, columns: str, order: str, where, page_size: int) -> List[Dict[str, Any]]:
+        """Page through a table, returning all rows"""
+        rows = []
+        offset = 0
+        while True:
+            def query():
+                q = self.supabase.table(table).select(columns)
+                if where is not None:
+                    q = where(q)
+                return q.order(order).range(offset, offset + page_size - 1).execute()
+            page = (await asyncio.to_thread(query)).data
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+            offset += page_size
+
+# Shared instance, constructed on first use or during background warm-up
+pinecone_service = lazy_resource("pinecone", PineconeService)
+
+def get_pinecone_service() -> PineconeService:
+    return pinecone_service.get()
@@ -0,0 +1,151 @@
+from typing import List, Dict, Any, Optional
+from .elevenlabs import ElevenLabsService
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PREVIEW_BUCKET = "voice-samples"
+PREVIEW_TABLE = "voice_previews"
+DEFAULT_PREVIEW_TEXT = os.getenv(
+    "VOICE_PREVIEW_TEXT",
+    "Hi there! This is a quick preview of how I sound."
+)
+PREVIEW_MODEL_ID = os.getenv("VOICE_PREVIEW_MODEL_ID", "eleven_flash_v2_5")
+# Object paths are content-hashed, so previews can be cached for a year
+PREVIEW_CACHE_CONTROL = os.getenv("VOICE_PREVIEW_CACHE_CONTROL", "31536000")
+
+class PreviewService:
+    """
+    Precomputes voice preview clips and stores them at content-hashed paths.
+
+    A preview is regenerated only when its fingerprint changes: the voice's
+    samples, the preview text or the preview model. The
+    ``voice_previews`` table maps each voice to its current object.
+    """
+    def __init__(self, supabase, service: ElevenLabsService, model_id: str = PREVIEW_MODEL_ID):
+        self.supabase = supabase
+        self.service = service
+        self.model_id = model_id
+
+    @staticmethod
+    def fingerprint(voice: Dict[str, Any], preview_text: str, model_id: str) -> str:
+        """Hash everything that affects how the preview sounds"""
+        samples = sorted(s.get("sample_id", "") for s in (voice.get("samples") or []))
+        payload = json.dumps({
+            "voice_id": voice["voice_id"],
+            "samples": samples,
+            "preview_text": preview_text,
+            "model_id": model_id
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def object_path(owner: str, voice_id: str, content_hash: str) -> str:
+        return f"{owner}/{voice_id}/preview-{content_hash}.mp3"
+
+    async def load_manifest(self, voice_ids: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Fetch stored preview records keyed by voice_id"""
+        def query():
+            q = self.supabase.table(PREVIEW_TABLE).select("*")
+            if voice_ids is not None:
+                q = q.in_("voice_id", voice_ids)
+            return q.execute()
+
+        response = await asyncio.to_thread(query)
+        return {row["voice_id"]: row for row in response.data}
+
+    async def ensure_preview(
+        self,
+        voice: Dict[str, Any],
+        preview_text: Optional[str] = None,
+        owner: str = "stock",
+        current: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Return the preview record for a voice, synthesizing it only if stale
+        """
+        preview_text = preview_text or DEFAULT_PREVIEW_TEXT
+        voice_id = voice["voice_id"]
+        content_hash = self.fingerprint(voice, preview_text, self.model_id)
+
+        if current and current.get("content_hash") == content_hash:
+            return current
+
+        try:
+            logger.info(f"Generating preview for voice {voice_id} ({content_hash})")
+            audio = await self.service.generate_preview_sample(voice_id, preview_text, model_id=self.model_id)
+
+            path = self.object_path(owner, voice_id, content_hash)
+            bucket = self.supabase.storage.from_(PREVIEW_BUCKET)
+            await asyncio.to_thread(
+                lambda: bucket.upload(
+                    path,
+                    audio,
+                    {
+                        "content-type": "audio/mpeg",
+                        "cache-control": PREVIEW_CACHE_CONTROL,
+                        "x-upsert": "true"
+                    }
+                )
+            )
+
+            record = {
+                "voice_id": voice_id,
+                "owner": owner,
+                "content_hash": content_hash,
+                "object_path": path,
+                "preview_url": bucket.get_public_url(path),
+                "preview_text": preview_text,
+                "model_id": self.model_id
+            }
+            await asyncio.to_thread(
+                lambda: self.supabase.table(PREVIEW_TABLE).upsert(record).execute()
+            )
+
+            # The old object is unreachable now; remove it (best effort)
+            if current and current.get("object_path") and current["object_path"] != path:
+                try:
+                    await asyncio.to_thread(lambda: bucket.remove([current["object_path"]]))
+                except Exception as e:
+                    logger.warning(f"Could not remove stale preview {current['object_path']}: {str(e)}")
+
+            return record
+
+        except Exception as e:
+            logger.error(f"Error generating preview for voice {voice_id}: {str(e)}")
+            raise
+
+    async def precompute_all(
+        self,
+        voices: List[Dict[str, Any]],
+        preview_text: Optional[str] = None,
+        max_parallel: int = 4
+    ) -> Dict[str, int]:
+        """
+        Make sure every listed voice has an up-to-date preview
+        """
+        stats = {"total": len(voices), "generated": 0, "unchanged": 0, "failed": 0}
+        manifest = await self.load_manifest([v["voice_id"] for v in voices])
+        semaphore = asyncio.Semaphore(max_parallel)
+
+        async def process(voice: Dict[str, Any]):
+            current = manifest.get(voice["voice_id"])
+            # Custom voices keep the owner and text they were trained with; stock
+            # voices follow the configured text so a change regenerates them
+            owner = current.get("owner", "stock") if current else "stock"
+            text = current.get("preview_text") if owner != "stock" else preview_text
+            async with semaphore:
+                try:
+                    record = await self.ensure_preview(voice, text, owner=owner, current=current)
+                    stats["unchanged" if record is current else "generated"] += 1
+                except Exception:
+                    stats["failed"] += 1
+
+        await asyncio.gather(*(process(v) for v in voices))
+        logger.info(f"Preview precompute finished: {stats}")
+        return stats
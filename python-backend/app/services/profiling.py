@@ -0,0 +1,322 @@
+from collections import deque
+from typing import Dict, Any, List, Optional, Iterable
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Longest profile the admin endpoints will run
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+# Loop stalls longer than this are recorded with the stack that caused them
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_LAG_MONITOR = os.getenv("LOOP_LAG_MONITOR", "true").lower() == "true"
+LOOP_CHECK_INTERVAL_MS = 20
+MAX_RECORDED_STALLS = 100
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when a profile is requested while another one is running"""
+
+_STDLIB = os.path.dirname(os.__file__) + os.sep
+
+def _short_path(filename: str) -> str:
+    for marker in ("site-packages" + os.sep, "python-backend" + os.sep):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    return filename[len(_STDLIB):] if filename.startswith(_STDLIB) else filename
+
+def _frame_label(code) -> str:
+    # Collapsed-stack lines separate frames with ";" and end with " <count>"
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+def _stack_of(frame) -> List[str]:
+    """Frame labels from the outermost call to the given frame"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+def collapse(stacks: Dict[tuple, float]) -> str:
+    """
+    Render stack -> weight as collapsed stacks, one "a;b;c weight" line per
+    stack, the input format of flamegraph.pl, speedscope and inferno.
+    """
+    lines = [f"{';'.join(stack)} {int(round(weight))}" for stack, weight in stacks.items() if weight >= 0.5]
+    return "\n".join(sorted(lines)) + "\n"
+
+class StackSampler:
+    """
+    Statistical CPU profiler: samples every thread's stack at a fixed
+    interval from a background thread, so it costs nothing when idle and
+    little while running. Blocking calls show up in the event loop thread
+    just like CPU work does.
+    """
+    def __init__(self, interval_ms: float = 5.0, threads: Optional[Iterable[int]] = None):
+        self.interval = interval_ms / 1000
+        self.threads = set(threads) if threads is not None else None
+        self.samples: Dict[tuple, float] = {}
+        self.sample_count = 0
+
+    def run(self, seconds: float):
+        """Sample for the given number of seconds (blocking; run it in a thread)"""
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (self.threads is not None and ident not in self.threads):
+                    continue
+                stack = (f"thread:{names.get(ident, ident)}", *_stack_of(frame))
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+            self.sample_count += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        return collapse(self.samples)
+
+class LoopLagMonitor:
+    """
+    Watches the event loop for blocking calls.
+
+    A heartbeat task on the loop stamps the time every few milliseconds and
+    records how late it woke up (event_loop_lag_ms). A watchdog thread
+    notices when the stamp goes stale for longer than threshold_ms and
+    samples the loop thread's stack until it moves again, so each recorded
+    stall carries the code that was holding the loop, e.g. a synchronous
+    Supabase call.
+    """
+    def __init__(self, threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS, interval_ms: float = LOOP_CHECK_INTERVAL_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.stalls: deque = deque(maxlen=MAX_RECORDED_STALLS)
+        self.stall_count = 0
+        self.max_lag_ms = 0.0
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Start monitoring the running loop; call from a coroutine"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-lag-heartbeat")
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop lag monitor started (threshold {self.threshold * 1000:.0f}ms)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("Event loop lag monitor stopped")
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            lag_ms = max(0.0, (self._beat - before - self.interval) * 1000)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            metrics.observe("event_loop_lag_ms", lag_ms)
+
+    def _watch(self):
+        stall = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat
+            if blocked < self.threshold + self.interval:
+                if stall is not None and stall["beat"] != beat:
+                    self._finish(stall)
+                    stall = None
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            if stall is None or stall["beat"] != beat:
+                if stall is not None:
+                    self._finish(stall)
+                stall = {
+                    "beat": beat,
+                    "started_at": time.time() - blocked,
+                    "stack": "".join(traceback.format_stack(frame)),
+                    "samples": {}
+                }
+            stack = tuple(_stack_of(frame))
+            stall["samples"][stack] = stall["samples"].get(stack, 0) + self.interval * 1000
+            stall["blocked_ms"] = blocked * 1000
+
+    def _finish(self, stall: Dict[str, Any]):
+        beat = stall.pop("beat")
+        stall["blocked_ms"] = round((self._beat - beat - self.interval) * 1000, 1)
+        self.stall_count += 1
+        self.stalls.append(stall)
+        metrics.observe("event_loop_block_ms", stall["blocked_ms"])
+        logger.warning(f"Event loop blocked for {stall['blocked_ms']:.0f}ms:\n{stall['stack']}")
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        recent = list(self.stalls)[-limit:] if limit > 0 else []
+        return {
+            "running": self.running,
+            "threshold_ms": self.threshold * 1000,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "stalls": self.stall_count,
+            "recent": [
+                {
+                    "started_at": stall["started_at"],
+                    "blocked_ms": stall["blocked_ms"],
+                    "stack": stall["stack"]
+                }
+                for stall in reversed(recent)
+            ]
+        }
+
+    def collapsed(self) -> str:
+        """Recorded stalls as collapsed stacks weighted by milliseconds blocked"""
+        totals: Dict[tuple, float] = {}
+        for stall in self.stalls:
+            for stack, ms in stall["samples"].items():
+                totals[stack] = totals.get(stack, 0) + ms
+        return collapse(totals)
+
+class Profiler:
+    """On-demand CPU, event-loop and memory profiling for a worker process"""
+    def __init__(self):
+        self.loop_monitor = LoopLagMonitor()
+        self._busy = False
+        self._memory_baseline: Optional[tracemalloc.Snapshot] = None
+
+    def _claim(self, seconds: float) -> float:
+        if self._busy:
+            raise ProfilerBusyError("A profile is already running in this worker")
+        self._busy = True
+        return max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+
+    async def sample_cpu(self, seconds: float, interval_ms: float = 5.0, loop_only: bool = False) -> StackSampler:
+        """Sample stacks for N seconds; loop_only limits sampling to the event loop thread"""
+        seconds = self._claim(seconds)
+        try:
+            sampler = StackSampler(interval_ms, threads=[threading.get_ident()] if loop_only else None)
+            await asyncio.to_thread(sampler.run, seconds)
+            logger.info(f"CPU profile: {sampler.sample_count} samples over {seconds:.0f}s")
+            return sampler
+        finally:
+            self._busy = False
+
+    async def cprofile(self, seconds: float) -> cProfile.Profile:
+        """
+        Deterministic profile of everything the event loop thread runs for
+        N seconds, i.e. every request handled meanwhile. Work sent to
+        worker threads appears only as the awaiting call.
+        """
+        seconds = self._claim(seconds)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            return profile
+        finally:
+            self._busy = False
+
+    @staticmethod
+    def pstats_text(profile: cProfile.Profile, sort: str = "cumulative", limit: int = 50) -> str:
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    @staticmethod
+    def pstats_bytes(profile: cProfile.Profile) -> bytes:
+        """Marshalled pstats, for snakeviz, flameprof or gprof2dot"""
+        with tempfile.NamedTemporaryFile(suffix=".prof") as f:
+            profile.dump_stats(f.name)
+            return f.read()
+
+    def start_memory(self, frames: int = 25) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._memory_baseline = tracemalloc.take_snapshot()
+            logger.info(f"tracemalloc started with {frames} frames")
+        return self.memory_status()
+
+    def stop_memory(self) -> Dict[str, Any]:
+        tracemalloc.stop()
+        self._memory_baseline = None
+        return self.memory_status()
+
+    def memory_status(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {"tracing": tracing, "traced_bytes": current, "peak_bytes": peak}
+
+    def memory_snapshot(self, top: int = 25, key_type: str = "lineno", reset_baseline: bool = False) -> Dict[str, Any]:
+        """
+        Largest allocation sites now, and the biggest growth since tracing
+        started (or since the last reset_baseline).
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; start it first")
+        snapshot = self._filtered(tracemalloc.take_snapshot())
+        baseline = self._filtered(self._memory_baseline) if self._memory_baseline else None
+        report = {
+            **self.memory_status(),
+            "top": [
+                {"site": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics(key_type)[:top]
+            ],
+            "growth": [
+                {"site": str(stat.traceback), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in (snapshot.compare_to(baseline, key_type)[:top] if baseline else [])
+            ]
+        }
+        if reset_baseline:
+            self._memory_baseline = snapshot
+        return report
+
+    def memory_collapsed(self) -> str:
+        """Live allocations as collapsed stacks weighted by bytes"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; start it first")
+        stacks: Dict[tuple, float] = {}
+        for stat in self._filtered(tracemalloc.take_snapshot()).statistics("traceback"):
+            # Frames run from the oldest call to the allocation site
+            stack = tuple(f"{_short_path(frame.filename)}:{frame.lineno}".replace(";", ":") for frame in stat.traceback)
+            stacks[stack] = stacks.get(stack, 0) + stat.size
+        return collapse(stacks)
+
+    @staticmethod
+    def _filtered(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+        return snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+
+# One per worker process; results describe only the worker that served the request
+profiler = Profiler()
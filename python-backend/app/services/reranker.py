@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+import asyncio
+import logging
+import math
+import os
+import re
+import threading
+import time
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Candidates fetched from the index, and how many survive re-ranking
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "5"))
+# Time allowed for model scoring before falling back to the lightweight scorer
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+# Optional CPU cross-encoder (sentence-transformers), e.g.
+# cross-encoder/ms-marco-MiniLM-L-6-v2; empty uses the lightweight scorer only
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+
+# Lightweight scorer weights
+RECENCY_HALF_LIFE_DAYS = float(os.getenv("RERANK_RECENCY_HALF_LIFE_DAYS", "90"))
+RECENCY_WEIGHT = float(os.getenv("RERANK_RECENCY_WEIGHT", "0.03"))
+LEXICAL_WEIGHT = float(os.getenv("RERANK_LEXICAL_WEIGHT", "0.2"))
+AUTHOR_WEIGHT = float(os.getenv("RERANK_AUTHOR_WEIGHT", "0.03"))
+
+_TOKEN = re.compile(r"\w+")
+
+def _terms(text: str) -> set:
+    return {t for t in _TOKEN.findall(text.lower()) if len(t) > 2}
+
+def _age_days(timestamp: Optional[str], now: datetime) -> Optional[float]:
+    if not timestamp:
+        return None
+    try:
+        when = datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (now - when).total_seconds() / 86400)
+
+def lightweight_scores(query: str, candidates: List[Dict[str, Any]], author_name: Optional[str] = None) -> List[float]:
+    """
+    Vector similarity adjusted by query term overlap, recency and authorship.
+
+    Overlap rewards hits that share the query's words (names, identifiers)
+    which embeddings tend to blur; recency decays with a half-life; hits
+    written by the avatar's own user get a small boost.
+    """
+    now = datetime.now(timezone.utc)
+    query_terms = _terms(query)
+    scores = []
+    for candidate in candidates:
+        metadata = candidate["metadata"]
+        score = candidate["similarity_score"]
+        if query_terms:
+            overlap = len(query_terms & _terms(candidate["content"])) / len(query_terms)
+            score += LEXICAL_WEIGHT * overlap
+        age = _age_days(metadata.get("timestamp"), now)
+        if age is not None and metadata.get("message_type") != "document":
+            score += RECENCY_WEIGHT * math.pow(0.5, age / RECENCY_HALF_LIFE_DAYS)
+        if author_name and metadata.get("user_name", "").lower() == author_name.lower():
+            score += AUTHOR_WEIGHT
+        scores.append(score)
+    return scores
+
+class Reranker:
+    """
+    Re-scores retrieved candidates and keeps the best few.
+
+    With RERANK_MODEL set, a CPU cross-encoder scores (query, passage) pairs
+    in a thread pool; if it is unavailable, busy or misses the latency
+    budget, the lightweight scorer's order is used instead. The lightweight
+    scorer has its own thread, so model calls that overran their budget (or
+    a slow first model load) never delay it, and is time-boxed as well,
+    falling back to vector similarity order.
+    """
+    def __init__(self, model_name: str = RERANK_MODEL, workers: int = RERANK_WORKERS):
+        self.model_name = model_name
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerank")
+        self._light_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank-light")
+        self._model = None
+        self._model_failed = False
+        # Model calls submitted and not yet finished, including abandoned ones
+        self._model_in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _load_model(self):
+        with self._load_lock:
+            return self._load_model_locked()
+
+    def _load_model_locked(self):
+        if self._model is None and not self._model_failed:
+            try:
+                from sentence_transformers import CrossEncoder # type: ignore
+                self._model = CrossEncoder(self.model_name, device="cpu")
+                logger.info(f"Loaded re-rank model {self.model_name}")
+            except Exception as e:
+                # Optional dependency; keep serving with the lightweight scorer
+                logger.warning(f"Re-rank model unavailable, using lightweight scorer: {str(e)}")
+                self._model_failed = True
+        return self._model
+
+    def _reserve_model_slot(self) -> bool:
+        with self._in_flight_lock:
+            if self._model_in_flight >= self.workers:
+                metrics.increment("rerank_model_busy")
+                return False
+            self._model_in_flight += 1
+            return True
+
+    def _model_scores(self, query: str, passages: List[str]) -> Optional[List[float]]:
+        try:
+            model = self._load_model()
+            if model is None:
+                return None
+            return [float(s) for s in model.predict([(query, p) for p in passages])]
+        finally:
+            with self._in_flight_lock:
+                self._model_in_flight -= 1
+
+    async def rerank(
+        self,
+        query: str,
+        candidates: List[Dict[str, Any]],
+        top_n: int = RERANK_TOP_N,
+        author_name: Optional[str] = None,
+        budget_ms: float = RERANK_BUDGET_MS
+    ) -> List[Dict[str, Any]]:
+        """Return the top_n candidates, best first, each with a rerank_score"""
+        if not candidates:
+            return []
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            scores = await asyncio.wait_for(
+                loop.run_in_executor(self._light_executor, lightweight_scores, query, candidates, author_name),
+                timeout=budget_ms / 1000
+            )
+            scorer = "lightweight"
+        except asyncio.TimeoutError:
+            metrics.increment("rerank_budget_exceeded")
+            logger.warning(f"Lightweight re-rank exceeded {budget_ms:.0f}ms budget, keeping vector order")
+            scores = [c["similarity_score"] for c in candidates]
+            scorer = "vector"
+
+        # Skip the model rather than queue behind calls still holding every thread
+        remaining = budget_ms / 1000 - (time.perf_counter() - start)
+        if self.model_name and not self._model_failed and remaining > 0 and self._reserve_model_slot():
+            try:
+                model_scores = await asyncio.wait_for(
+                    loop.run_in_executor(
+                        self._executor, self._model_scores, query, [c["content"] for c in candidates]
+                    ),
+                    timeout=remaining
+                )
+                if model_scores is not None:
+                    scores = model_scores
+                    scorer = "model"
+            except asyncio.TimeoutError:
+                # The worker thread finishes in the background; its result is discarded
+                metrics.increment("rerank_budget_exceeded")
+                logger.warning(f"Re-rank model exceeded {budget_ms:.0f}ms budget")
+
+        ranked = sorted(zip(scores, candidates), key=lambda pair: pair[0], reverse=True)[:top_n]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metrics.observe("rerank_ms", elapsed_ms)
+        metrics.observe(f"rerank_{scorer}_ms", elapsed_ms)
+        logger.debug(f"Re-ranked {len(candidates)} candidates with {scorer} scorer in {elapsed_ms:.1f}ms")
+        return [{**candidate, "rerank_score": score} for score, candidate in ranked]
+
+reranker = Reranker()
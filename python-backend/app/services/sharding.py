@@ -0,0 +1,129 @@
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from .supabase_client import get_supabase
+from .directory_cache import directory_cache
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Namespace holding every message vector when sharding is off, and the
+# vectors of channels without a workspace when sharding by workspace
+MESSAGES_NAMESPACE = "messages"
+
+# How message vectors are split across namespaces:
+#   none          - one "messages" namespace (the original layout)
+#   workspace     - one namespace per workspace
+#   channel_group - channels hashed into SHARD_CHANNEL_GROUPS namespaces
+#   channel       - one namespace per channel
+# Changing the key requires rebuilding every shard, "messages" included.
+SHARD_KEY = os.getenv("SHARD_KEY", "none")
+SHARD_CHANNEL_GROUPS = int(os.getenv("SHARD_CHANNEL_GROUPS", "16"))
+SHARD_KEYS = ("none", "workspace", "channel_group", "channel")
+
+# Seconds a user's visible channels are reused before re-reading memberships
+SHARD_VISIBILITY_TTL = float(os.getenv("SHARD_VISIBILITY_TTL_SECONDS", "60"))
+
+if SHARD_KEY not in SHARD_KEYS:
+    raise ValueError(f"SHARD_KEY must be one of {SHARD_KEYS}, got {SHARD_KEY!r}")
+
+def shard_namespace(channel: Optional[Dict[str, Any]], channel_id: Optional[str] = None) -> str:
+    """Namespace for a channel, given its directory row (or just its ID)"""
+    channel_id = str((channel or {}).get("id") or channel_id or "")
+    if SHARD_KEY == "none" or not channel_id:
+        return MESSAGES_NAMESPACE
+    if SHARD_KEY == "channel":
+        return f"{MESSAGES_NAMESPACE}-ch-{channel_id}"
+    if SHARD_KEY == "channel_group":
+        group = int(hashlib.sha1(channel_id.encode("utf-8")).hexdigest(), 16) % SHARD_CHANNEL_GROUPS
+        return f"{MESSAGES_NAMESPACE}-group-{group}"
+    workspace_id = (channel or {}).get("workspace_id")
+    return f"{MESSAGES_NAMESPACE}-ws-{workspace_id}" if workspace_id else MESSAGES_NAMESPACE
+
+def is_message_shard(namespace: str) -> bool:
+    return namespace == MESSAGES_NAMESPACE or namespace.startswith(f"{MESSAGES_NAMESPACE}-")
+
+class ShardRouter:
+    """
+    Maps channels to message namespaces and callers to the shards they can see.
+
+    A caller sees public channels of the workspaces they belong to and the
+    private channels they are a member of; their shards are the namespaces
+    of those channels. Callers without a user ID see public channels only.
+    """
+    def __init__(self, visibility_ttl: float = SHARD_VISIBILITY_TTL):
+        self.visibility_ttl = visibility_ttl
+        self._visible: Dict[str, Tuple[float, Set[str]]] = {}
+
+    async def namespaces_for(self, channel_ids: Iterable[Any]) -> Dict[str, str]:
+        """channel_id -> namespace for the given channels"""
+        channel_ids = {str(c) for c in channel_ids if c}
+        if SHARD_KEY in ("none", "channel", "channel_group"):
+            # No directory lookup needed
+            return {c: shard_namespace(None, c) for c in channel_ids}
+        channels = await directory_cache.get_channels(channel_ids)
+        return {c: shard_namespace(channels.get(c), c) for c in channel_ids}
+
+    async def channels_in(self, namespace: str) -> List[str]:
+        """IDs of every channel whose messages belong in a namespace"""
+        channels = await directory_cache.all_channels()
+        return [c for c, row in channels.items() if shard_namespace(row) == namespace]
+
+    async def all_shards(self) -> List[str]:
+        if SHARD_KEY == "none":
+            return [MESSAGES_NAMESPACE]
+        channels = await directory_cache.all_channels()
+        return sorted({shard_namespace(row) for row in channels.values()})
+
+    async def visible_shards(self, user_id: Optional[str]) -> List[str]:
+        """Message namespaces the caller can search"""
+        if SHARD_KEY == "none":
+            return [MESSAGES_NAMESPACE]
+        channel_ids = await self.visible_channels(user_id)
+        return sorted(set((await self.namespaces_for(channel_ids)).values()))
+
+    async def visible_channels(self, user_id: Optional[str]) -> Set[str]:
+        """IDs of the channels a user can read; public channels without a user"""
+        cache_key = user_id or ""
+        cached = self._visible.get(cache_key)
+        if cached and time.monotonic() - cached[0] < self.visibility_ttl:
+            return cached[1]
+
+        channel_ids = await self._load_visible_channels(user_id)
+        self._visible[cache_key] = (time.monotonic(), channel_ids)
+        logger.info(f"{'User ' + user_id if user_id else 'Anonymous caller'} can see {len(channel_ids)} channels")
+        return channel_ids
+
+    async def _load_visible_channels(self, user_id: Optional[str]) -> Set[str]:
+        if not user_id:
+            channels = await directory_cache.all_channels()
+            return {c for c, row in channels.items() if not row.get("is_private")}
+
+        supabase = get_supabase()
+        workspaces, memberships = await asyncio.gather(
+            asyncio.to_thread(
+                lambda: supabase.table("workspace_members").select("workspace_id").eq("user_id", user_id).execute()
+            ),
+            asyncio.to_thread(
+                lambda: supabase.table("channel_members").select("channel_id").eq("user_id", user_id).execute()
+            )
+        )
+        workspace_ids = {str(row["workspace_id"]) for row in workspaces.data}
+        channels = await directory_cache.all_channels()
+        visible = {
+            c for c, row in channels.items()
+            if str(row.get("workspace_id")) in workspace_ids and not row.get("is_private")
+        }
+        return visible | {str(row["channel_id"]) for row in memberships.data}
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Forget cached visibility, e.g. after a membership change"""
+        if user_id:
+            self._visible.pop(user_id, None)
+        else:
+            self._visible.clear()
+
+shard_router = ShardRouter()
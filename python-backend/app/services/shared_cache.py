@@ -0,0 +1,226 @@
+from typing import Any, Optional
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "/tmp/chatgenius-shared-cache.sqlite3")
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+class SharedCache:
+    """
+    Cross-process cache backed by a local SQLite file in WAL mode.
+
+    Every worker process on the host opens the same file, so voices, embeddings,
+    TTS audio and answers computed by one worker are reused by the others.
+    Entries are namespaced, expire by TTL and are evicted oldest-first once
+    they add up to more than ``max_bytes``. Each process tracks the total
+    from its own writes and re-reads it from the file after writing
+    ``max_bytes / SYNC_FRACTION``, so other workers' writes can overshoot
+    the bound by at most that much each.
+
+    SQLite calls block while another process holds the write lock, so async
+    code uses the ``a``-prefixed methods, which run them in a worker thread.
+    """
+    SYNC_FRACTION = 16
+    # Pruning evicts down to this share of max_bytes, so a full cache is not
+    # pruned again on the very next write
+    LOW_WATER = 0.9
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, max_bytes: int = SHARED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        # set() runs in worker threads; guards the size estimate
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._estimated_bytes = 0
+        self._unsynced_bytes = 0
+        self._init_schema()
+        self.prune()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # Connections must not be shared across fork()
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_created_at ON entries(created_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner INTEGER NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache read failed: {str(e)}")
+            return None
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return value
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, expires_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, len(value), now + ttl if ttl else None, now)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache write failed: {str(e)}")
+            return
+
+        with self._lock:
+            # Replaced entries are counted twice until the next prune; erring high is safe
+            self._estimated_bytes += len(value)
+            self._unsynced_bytes += len(value)
+            due = (
+                self._estimated_bytes > self.max_bytes
+                or self._unsynced_bytes >= self.max_bytes / self.SYNC_FRACTION
+            )
+        if due:
+            self.prune()
+
+    def get_json(self, namespace: str, key: str) -> Optional[Any]:
+        value = self.get(namespace, key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        self.set(namespace, key, json.dumps(value).encode("utf-8"), ttl)
+
+    def delete(self, namespace: str, key: str):
+        try:
+            self._conn().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache delete failed: {str(e)}")
+
+    def prune(self):
+        """Drop expired entries, then the oldest ones if over max_bytes"""
+        # Another thread pruning covers this write too
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._prune()
+        finally:
+            self._prune_lock.release()
+
+    def _prune(self):
+        try:
+            conn = self._conn()
+            conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - int(self.max_bytes * self.LOW_WATER)
+                freed = 0
+                cutoff = None
+                for created_at, size in conn.execute("SELECT created_at, size FROM entries ORDER BY created_at"):
+                    freed += size
+                    cutoff = created_at
+                    if freed >= excess:
+                        break
+                if cutoff is not None:
+                    conn.execute("DELETE FROM entries WHERE created_at <= ?", (cutoff,))
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            with self._lock:
+                self._estimated_bytes = total
+                self._unsynced_bytes = 0
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache prune failed: {str(e)}")
+
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        """
+        Take a named lease for ttl seconds if no other process holds one.
+
+        Used to run once-per-host work (e.g. preview precompute) from a
+        single worker.
+        """
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+                if row is not None and row[0] != os.getpid() and row[1] > now:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                    (name, os.getpid(), now + ttl)
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache lease failed: {str(e)}")
+            return False
+
+    def release_lease(self, name: str):
+        """Give up a lease this process holds, so others need not wait for it to expire"""
+        try:
+            self._conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, os.getpid()))
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache lease release failed: {str(e)}")
+
+    async def aget(self, namespace: str, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self.get, namespace, key)
+
+    async def aset(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None):
+        await asyncio.to_thread(self.set, namespace, key, value, ttl)
+
+    async def aget_json(self, namespace: str, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self.get_json, namespace, key)
+
+    async def aset_json(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        await asyncio.to_thread(self.set_json, namespace, key, value, ttl)
+
+    async def adelete(self, namespace: str, key: str):
+        await asyncio.to_thread(self.delete, namespace, key)
+
+    async def aacquire_lease(self, name: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self.acquire_lease, name, ttl)
+
+    async def arelease_lease(self, name: str):
+        await asyncio.to_thread(self.release_lease, name)
+
+# One instance per process; all processes on the host share the file
+shared_cache = SharedCache()
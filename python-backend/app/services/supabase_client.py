@@ -0,0 +1,15 @@
+from .lazy import lazy_resource
+import os
+
+def _create_supabase():
+    from supabase import create_client # type: ignore
+    return create_client(
+        os.getenv("NEXT_PUBLIC_SUPABASE_URL"),
+        os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+    )
+
+# Shared Supabase client, created on first use
+supabase_client = lazy_resource("supabase", _create_supabase)
+
+def get_supabase():
+    return supabase_client.get()
@@ -0,0 +1,137 @@
+from typing import BinaryIO, Optional
+import logging
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Bytes read from the upload per iteration; bounds memory per upload
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Uploads larger than this are spooled to a temp file instead of memory
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
+# Named upload files live under <root>/<pid>/ so files left behind by a dead
+# worker can be found and removed
+UPLOAD_SPOOL_ROOT = os.getenv("UPLOAD_SPOOL_ROOT", os.path.join(tempfile.gettempdir(), "chat-genius-uploads"))
+
+def process_alive(pid: int) -> bool:
+    """Whether a process with this ID exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def spool_dir() -> str:
+    """This process's directory for named upload files"""
+    path = os.path.join(UPLOAD_SPOOL_ROOT, str(os.getpid()))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def remove_orphaned_spools() -> int:
+    """Delete the upload directories of processes that no longer exist"""
+    try:
+        entries = os.listdir(UPLOAD_SPOOL_ROOT)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for entry in entries:
+        if not entry.isdigit() or int(entry) == os.getpid() or process_alive(int(entry)):
+            continue
+        shutil.rmtree(os.path.join(UPLOAD_SPOOL_ROOT, entry), ignore_errors=True)
+        removed += 1
+    if removed:
+        logger.info(f"Removed upload files of {removed} exited workers")
+    return removed
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size limit"""
+    def __init__(self, size: int, max_size: int):
+        self.size = size
+        self.max_size = max_size
+        super().__init__(f"Upload exceeds {max_size} bytes (read at least {size} bytes)")
+
+async def spool_upload(
+    upload,
+    max_size: int,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    spool_threshold: int = UPLOAD_SPOOL_THRESHOLD
+) -> BinaryIO:
+    """
+    Copy an UploadFile into a spooled temp file, enforcing max_size while reading.
+
+    Reading stops as soon as the limit is crossed, so an oversized upload never
+    costs more than max_size + chunk_size bytes. The returned file is rewound
+    and must be closed by the caller.
+    """
+    # Reject early when the parser already knows the part size
+    known_size = getattr(upload, "size", None)
+    if known_size is not None and known_size > max_size:
+        raise UploadTooLargeError(known_size, max_size)
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+    total = 0
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_size:
+                raise UploadTooLargeError(total, max_size)
+            spooled.write(chunk)
+    except Exception:
+        spooled.close()
+        raise
+
+    spooled.seek(0)
+    logger.info(f"Spooled upload {getattr(upload, 'filename', '')}: {total} bytes")
+    return spooled
+
+async def save_upload(
+    upload,
+    max_size: int,
+    suffix: str = "",
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    dir: Optional[str] = None
+) -> str:
+    """
+    Stream an UploadFile to a named temp file, enforcing max_size while reading.
+
+    Used when the consumer needs a real path (e.g. a parser in another
+    process). The caller must delete the returned file; it is written to
+    spool_dir() unless dir is given.
+    """
+    known_size = getattr(upload, "size", None)
+    if known_size is not None and known_size > max_size:
+        raise UploadTooLargeError(known_size, max_size)
+
+    target = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=dir or spool_dir())
+    total = 0
+    try:
+        with target:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_size:
+                    raise UploadTooLargeError(total, max_size)
+                target.write(chunk)
+    except Exception:
+        os.unlink(target.name)
+        raise
+
+    logger.info(f"Saved upload {getattr(upload, 'filename', '')}: {total} bytes")
+    return target.name
+
+def file_size(file: BinaryIO) -> int:
+    """Return the size of a seekable file without reading it"""
+    position = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
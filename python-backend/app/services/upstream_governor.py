@@ -0,0 +1,357 @@
+from typing import Dict, Any, Optional, Tuple
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Lower value wins: interactive chat is served before background migration traffic
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+_current_priority: ContextVar[int] = ContextVar("upstream_priority", default=PRIORITY_INTERACTIVE)
+
+# Requests per second and burst size per (provider, API key); override with
+# UPSTREAM_<PROVIDER>_RPS / UPSTREAM_<PROVIDER>_BURST
+DEFAULT_LIMITS: Dict[str, Tuple[float, int]] = {
+    "openai": (50.0, 100),
+    "pinecone": (20.0, 40),
+    "elevenlabs": (5.0, 10),
+}
+
+class UpstreamUnavailableError(RuntimeError):
+    """Raised without calling upstream while a provider's circuit is open"""
+    def __init__(self, provider: str, retry_after: float):
+        self.provider = provider
+        self.retry_after = retry_after
+        super().__init__(f"{provider} is unavailable, retry in {retry_after:.0f}s")
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Whether an error is worth retrying as is: open circuits, throttling,
+    server errors, timeouts and connection failures. Client errors (4xx) and
+    plain exceptions are not; retrying the same input fails the same way.
+    """
+    if isinstance(error, (UpstreamUnavailableError, asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status_code, _ = UpstreamGovernor._extract_status(error)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    # httpx, openai and pinecone name their network errors this way
+    return any(
+        marker in cls.__name__
+        for cls in type(error).__mro__
+        for marker in ("Timeout", "Connect", "Transport", "Network")
+    )
+
+@contextmanager
+def background_priority():
+    """Mark upstream calls made inside this block (and tasks it spawns) as background"""
+    token = _current_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse OpenAI-style reset durations such as '1s', '6m0s' or '250ms'"""
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r'([\d.]+)(ms|s|m|h)', value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    if matched:
+        return total
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """
+    Token bucket with an adaptive refill rate.
+
+    429s halve the rate and pause the bucket for Retry-After; successes
+    recover it gradually. Background callers leave a reserve of tokens and
+    yield to waiting interactive callers.
+    """
+    def __init__(self, rate: float, capacity: int, background_reserve: float = 0.25):
+        self.base_rate = rate
+        self.rate = rate
+        self.min_rate = rate * 0.05
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.reserve = capacity * background_reserve
+        self.paused_until = 0.0
+        self.interactive_waiters = 0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        interactive = priority == PRIORITY_INTERACTIVE
+        if interactive:
+            self.interactive_waiters += 1
+        try:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                needed = 1.0 if interactive else 1.0 + self.reserve
+                if self.tokens >= needed and (interactive or self.interactive_waiters == 0):
+                    self.tokens -= 1.0
+                    return
+
+                await asyncio.sleep(max(0.01, (needed - self.tokens) / self.rate))
+        finally:
+            if interactive:
+                self.interactive_waiters -= 1
+
+    def penalize(self, retry_after: Optional[float] = None):
+        self.rate = max(self.min_rate, self.rate * 0.5)
+        self.tokens = 0.0
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def reward(self):
+        self.rate = min(self.base_rate, self.rate + self.base_rate * 0.05)
+
+    def apply_rate_limit_headers(self, remaining: Optional[int], reset_seconds: Optional[float]):
+        """Align local state with what the provider says is left in the window"""
+        if remaining is None:
+            return
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, float(remaining))
+        if remaining == 0 and reset_seconds:
+            self.paused_until = max(self.paused_until, time.monotonic() + reset_seconds)
+
+class CircuitBreaker:
+    """
+    Opens after consecutive upstream failures and fails fast until a cool-down
+    has passed, then lets a single trial call through.
+    """
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def before_call(self, provider: str) -> bool:
+        """Admit a call or raise; returns True when the call is the half-open trial"""
+        if self.state == "closed":
+            return False
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == "open" and elapsed >= self.recovery_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        raise UpstreamUnavailableError(provider, max(1.0, self.recovery_timeout - elapsed))
+
+    def release_trial(self):
+        """Give up the half-open trial without an outcome, e.g. when it was cancelled"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Opening circuit after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+class UpstreamCall:
+    """Handle yielded by UpstreamGovernor.call for reporting the response"""
+    def __init__(self, governor: "UpstreamGovernor", provider: str, bucket: TokenBucket, breaker: CircuitBreaker):
+        self.governor = governor
+        self.provider = provider
+        self.bucket = bucket
+        self.breaker = breaker
+        self.observed = False
+        self.trial = False
+
+    def observe(self, status_code: int, headers: Optional[Any] = None):
+        """Feed an HTTP status and headers back into the limiter and breaker"""
+        self.observed = True
+        self.governor._record(self.provider, self.bucket, self.breaker, status_code, headers)
+
+class UpstreamGovernor:
+    """
+    Client-side rate control shared by every upstream client in the process.
+
+    One token bucket per (provider, API key) and one circuit breaker per
+    provider. Wrap each upstream request in ``async with governor.call(...)``.
+    """
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _limits(self, provider: str) -> Tuple[float, int]:
+        rate, burst = DEFAULT_LIMITS.get(provider, (10.0, 20))
+        prefix = f"UPSTREAM_{provider.upper()}"
+        return (
+            float(os.getenv(f"{prefix}_RPS", rate)),
+            int(os.getenv(f"{prefix}_BURST", burst))
+        )
+
+    def bucket(self, provider: str, api_key: Optional[str] = None) -> TokenBucket:
+        key_id = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+        bucket = self._buckets.get((provider, key_id))
+        if bucket is None:
+            rate, burst = self._limits(provider)
+            bucket = self._buckets[(provider, key_id)] = TokenBucket(rate, burst)
+        return bucket
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            breaker = self._breakers[provider] = CircuitBreaker(
+                failure_threshold=int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5")),
+                recovery_timeout=float(os.getenv("UPSTREAM_BREAKER_RECOVERY_SECONDS", "30"))
+            )
+        return breaker
+
+    @asynccontextmanager
+    async def call(self, provider: str, api_key: Optional[str] = None, priority: Optional[int] = None):
+        """
+        Admit one upstream request: check the breaker, wait for a token, then
+        record the outcome. Exceptions raised inside the block are classified
+        by their HTTP status when they carry one.
+        """
+        breaker = self.breaker(provider)
+        bucket = self.bucket(provider, api_key)
+        stats = self._stats.setdefault(provider, {"calls": 0, "rate_limited": 0, "failures": 0, "rejected": 0})
+
+        try:
+            trial = breaker.before_call(provider)
+        except UpstreamUnavailableError:
+            stats["rejected"] += 1
+            raise
+
+        handle = UpstreamCall(self, provider, bucket, breaker)
+        handle.trial = trial
+        try:
+            await bucket.acquire(_current_priority.get() if priority is None else priority)
+        except BaseException:
+            self._abandon(handle)
+            raise
+        stats["calls"] += 1
+        try:
+            yield handle
+        except Exception as e:
+            if not handle.observed:
+                status_code, headers = self._extract_status(e)
+                self._record(provider, bucket, breaker, status_code, headers)
+            raise
+        except BaseException:
+            # Cancelled (hedge loser, client disconnect, voice-chat cancel):
+            # says nothing about the provider, but must not keep the trial slot
+            self._abandon(handle)
+            raise
+        else:
+            if not handle.observed:
+                breaker.record_success()
+                bucket.reward()
+
+    @staticmethod
+    def _abandon(handle: UpstreamCall):
+        if handle.trial and not handle.observed:
+            handle.breaker.release_trial()
+
+    def _record(self, provider: str, bucket: TokenBucket, breaker: CircuitBreaker, status_code: Optional[int], headers: Optional[Any]):
+        stats = self._stats[provider]
+        headers = headers or {}
+
+        if status_code == 429:
+            stats["rate_limited"] += 1
+            retry_after = _parse_retry_after(headers.get("retry-after"))
+            logger.warning(f"{provider} rate limited; backing off for {retry_after or 0:.1f}s")
+            bucket.penalize(retry_after)
+            # Throttling is not an outage; leave the breaker alone
+            return
+
+        if status_code is None or status_code >= 500:
+            stats["failures"] += 1
+            breaker.record_failure()
+            return
+
+        breaker.record_success()
+        bucket.reward()
+
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        reset = headers.get("x-ratelimit-reset-requests")
+        if remaining is not None:
+            try:
+                bucket.apply_rate_limit_headers(int(remaining), _parse_duration(reset) if reset else None)
+            except ValueError:
+                pass
+
+    @staticmethod
+    def _extract_status(error: Exception) -> Tuple[Optional[int], Optional[Any]]:
+        """Pull an HTTP status and headers out of httpx, openai or pinecone errors"""
+        response = getattr(error, "response", None)
+        status_code = (
+            getattr(error, "status_code", None)
+            or getattr(error, "status", None)
+            or getattr(response, "status_code", None)
+        )
+        headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+        try:
+            status_code = int(status_code) if status_code is not None else None
+        except (TypeError, ValueError):
+            status_code = None
+        return status_code, headers
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of limiter and breaker state per provider"""
+        snapshot = {}
+        for provider, counters in self._stats.items():
+            breaker = self.breaker(provider)
+            snapshot[provider] = {
+                **counters,
+                "circuit": breaker.state,
+                "rates": [
+                    round(bucket.rate, 2)
+                    for (name, _), bucket in self._buckets.items() if name == provider
+                ]
+            }
+        return snapshot
+
+# Shared by every upstream client in the process
+governor = UpstreamGovernor()
@@ -0,0 +1,32 @@
+# Production multi-process serving: gunicorn manages uvicorn workers.
+# Run with: gunicorn -c gunicorn.conf.py app.main:app
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# One worker per core by default; override with WEB_CONCURRENCY
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Each worker imports the app itself so clients and connections are never
+# shared across fork(); the FastAPI startup hook warms every worker.
+preload_app = False
+
+# TTS and chat requests can legitimately take tens of seconds
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# Recycling is off by default: a recycled worker fails the background jobs
+# (voice training, document ingest) it has queued or running. Set
+# MAX_REQUESTS to cap memory growth if that trade-off is acceptable.
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "200"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} initialized")
@@ -0,0 +1,415 @@
+#to run locally in docker compose container use
+# docker compose exec ai-service python scripts/benchmark.py import-time
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_ROOT)
+
+def profile_import_time(module: str = "app.main", top: int = 15) -> dict:
+    """
+    Import a module in a fresh interpreter with -X importtime and report the
+    wall-clock time plus the slowest imports by cumulative time.
+    """
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - start)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_ROOT,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append({
+            "module": name.strip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000
+        })
+
+    slowest = sorted(imports, key=lambda i: i["cumulative_ms"], reverse=True)[:top]
+    return {
+        "module": module,
+        "wall_seconds": round(float(result.stdout.strip().splitlines()[-1]), 3),
+        "modules_imported": len(imports),
+        "slowest": slowest
+    }
+
+def print_import_time(report: dict):
+    print(f"\n=== Import time: {report['module']} ===")
+    print(f"Wall clock: {report['wall_seconds']:.3f}s ({report['modules_imported']} modules)")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for entry in report["slowest"]:
+        print(f"{entry['cumulative_ms']:>14.1f} {entry['self_ms']:>9.1f}  {entry['module']}")
+
+def synthetic_embeddings(count: int, dimensions: int, clusters: int = 50, seed: int = 7):
+    """
+    Unit vectors clustered around random topics, with variance decaying
+    across dimensions so that leading dimensions carry most of the signal,
+    as in text-embedding-3 vectors.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    decay = (1.0 / np.sqrt(1.0 + np.arange(dimensions) / 64.0)).astype(np.float32)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32) * decay
+    labels = rng.integers(0, clusters, count)
+    noise = rng.standard_normal((count, dimensions)).astype(np.float32) * decay * 0.8
+    vectors = centers[labels] + noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def supabase_embeddings(count: int):
+    """Embed up to count channel messages at full size with the configured model"""
+    import asyncio
+    import numpy as np
+    from app.services.pinecone_service import PineconeService
+
+    service = PineconeService()
+    service.embeddings.dimensions = None
+    rows = (
+        service.supabase.table("messages").select("content")
+        .eq("is_direct_message", False).limit(count).execute().data
+    )
+    texts = [row["content"] for row in rows if row["content"]]
+    vectors = asyncio.run(service.embeddings.aembed_documents(texts))
+    avg_text_bytes = sum(len(t.encode("utf-8")) for t in texts) / max(1, len(texts))
+    return np.asarray(vectors, dtype=np.float32), avg_text_bytes
+
+def benchmark_vector_recall(
+    source: str = "synthetic",
+    count: int = 20000,
+    queries: int = 200,
+    top_k: int = 10,
+    dimensions: list = None,
+    quantizations: list = None,
+    rescore_factor: int = 4
+) -> dict:
+    """
+    Recall@k and size of reduced-dimension and quantized indexes, measured
+    against exact search over full-size float vectors.
+    """
+    import numpy as np
+    from app.services.local_index import LocalVectorIndex, truncate_embedding
+
+    avg_text_bytes = None
+    if source == "supabase":
+        corpus, avg_text_bytes = supabase_embeddings(count + queries)
+    else:
+        corpus = synthetic_embeddings(count + queries, 3072)
+    # Held-out vectors act as queries
+    query_vectors, corpus = corpus[:queries], corpus[queries:]
+    full_dimensions = corpus.shape[1]
+    dimensions = [d for d in (dimensions or [3072, 1536, 1024, 512, 256]) if d <= full_dimensions]
+    quantizations = quantizations or ["none", "int8", "binary"]
+
+    exact = np.argsort(-(query_vectors @ corpus.T), axis=1)[:, :top_k]
+    truth = [set(map(str, row)) for row in exact]
+
+    results = []
+    for dims in dimensions:
+        truncated = [truncate_embedding(v, dims) for v in corpus]
+        truncated_queries = [truncate_embedding(q, dims) for q in query_vectors]
+        for quantization in quantizations:
+            index = LocalVectorIndex(dims, quantization=quantization, rescore_factor=rescore_factor)
+            index.upsert([(str(i), v) for i, v in enumerate(truncated)])
+            index.query(truncated_queries[0], top_k)  # build outside the timed loop
+
+            hits = 0
+            start = time.perf_counter()
+            for q, expected in zip(truncated_queries, truth):
+                hits += len(expected & {m["id"] for m in index.query(q, top_k)})
+            elapsed = time.perf_counter() - start
+
+            size = index.memory_bytes()
+            results.append({
+                "dimensions": dims,
+                "quantization": quantization,
+                "recall": round(hits / (len(truth) * top_k), 4),
+                "search_bytes_per_vector": round(size["search"] / len(corpus), 1),
+                "rescore_bytes_per_vector": round(size["rescore"] / len(corpus), 1),
+                "query_ms": round(elapsed / len(truth) * 1000, 3)
+            })
+
+    return {
+        "source": source,
+        "vectors": len(corpus),
+        "queries": len(truth),
+        "top_k": top_k,
+        "rescore_factor": rescore_factor,
+        "avg_text_metadata_bytes": avg_text_bytes,
+        "results": results
+    }
+
+def print_vector_recall(report: dict):
+    print(f"\n=== Vector recall vs size: {report['vectors']} {report['source']} vectors, "
+          f"{report['queries']} queries, recall@{report['top_k']} ===")
+    if report["avg_text_metadata_bytes"] is not None:
+        print(f"Text in metadata adds ~{report['avg_text_metadata_bytes']:.0f} bytes per vector")
+    print(f"{'dims':>6} {'quant':>7} {'recall':>7} {'search B/vec':>13} {'rescore B/vec':>14} {'query ms':>9}")
+    for r in report["results"]:
+        print(f"{r['dimensions']:>6} {r['quantization']:>7} {r['recall']:>7.3f} "
+              f"{r['search_bytes_per_vector']:>13.0f} {r['rescore_bytes_per_vector']:>14.0f} {r['query_ms']:>9.2f}")
+
+def benchmark_hedging(
+    requests: int = 300,
+    concurrency: int = 10,
+    base_ms: float = 200,
+    slow_ms: float = 2000,
+    slow_rate: float = 0.05,
+    error_rate: float = 0.01
+) -> dict:
+    """
+    Latency of the model router against StubChatModel with injected slow
+    calls and errors, with hedging off and on.
+    """
+    import asyncio
+    from app.services import model_router
+    from app.services.model_router import ModelRouter, StubChatModel, TIER_MODELS, TIER_STANDARD
+
+    def percentile(samples: list, p: float) -> float:
+        samples = sorted(samples)
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    async def run(hedge: bool) -> dict:
+        model_router.HEDGE_ENABLED = hedge
+        models = {
+            tier: StubChatModel(tier, base_ms, slow_ms, slow_rate, error_rate, seed=i)
+            for i, tier in enumerate(TIER_MODELS)
+        }
+        router = ModelRouter("benchmark", models=models)
+        slots = asyncio.Semaphore(concurrency)
+        latencies, outcomes = [], {"hedged": 0, "fallback": 0, "failed": 0}
+
+        async def one():
+            async with slots:
+                start = time.perf_counter()
+                try:
+                    result = await router.generate([], TIER_STANDARD)
+                except Exception:
+                    outcomes["failed"] += 1
+                    return
+                latencies.append((time.perf_counter() - start) * 1000)
+                outcomes["hedged"] += result["hedged"]
+                outcomes["fallback"] += result["fallback"]
+
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return {
+            "hedging": hedge,
+            "p50_ms": round(percentile(latencies, 0.5), 1),
+            "p95_ms": round(percentile(latencies, 0.95), 1),
+            "p99_ms": round(percentile(latencies, 0.99), 1),
+            "hedge_delay_ms": round(router.hedge_delay(TIER_STANDARD) * 1000, 1),
+            **outcomes
+        }
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "stub": {"base_ms": base_ms, "slow_ms": slow_ms, "slow_rate": slow_rate, "error_rate": error_rate},
+        "results": [asyncio.run(run(False)), asyncio.run(run(True))]
+    }
+
+def print_hedging(report: dict):
+    stub = report["stub"]
+    print(f"\n=== Hedged requests: {report['requests']} requests x{report['concurrency']}, stub "
+          f"{stub['base_ms']:.0f}ms, {stub['slow_rate']:.0%} at {stub['slow_ms']:.0f}ms, "
+          f"{stub['error_rate']:.0%} errors ===")
+    print(f"{'hedging':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'delay ms':>9} {'hedged':>7} {'fallback':>9} {'failed':>7}")
+    for r in report["results"]:
+        print(f"{'on' if r['hedging'] else 'off':>8} {r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f} "
+              f"{r['hedge_delay_ms']:>9.0f} {r['hedged']:>7} {r['fallback']:>9} {r['failed']:>7}")
+
+def synthetic_channel_corpus(count: int, dimensions: int, channels: int, affinity: float = 1.0, topics: int = 200, seed: int = 11):
+    """
+    Unit vectors for messages spread over channels: each message mixes its
+    channel's theme, weighted by affinity, with one of many topics shared
+    across channels. Returns (vectors, channel labels).
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    decay = (1.0 / np.sqrt(1.0 + np.arange(dimensions) / 64.0)).astype(np.float32)
+    themes = rng.standard_normal((channels, dimensions)).astype(np.float32) * decay
+    topic_centers = rng.standard_normal((topics, dimensions)).astype(np.float32) * decay
+    # Channel sizes follow a long tail, as in real workspaces
+    weights = 1.0 / (1.0 + np.arange(channels))
+    labels = rng.choice(channels, size=count, p=weights / weights.sum())
+    topic_labels = rng.integers(0, topics, count)
+    noise = rng.standard_normal((count, dimensions)).astype(np.float32) * decay * 0.8
+    vectors = affinity * themes[labels] + topic_centers[topic_labels] + noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True), labels
+
+def benchmark_channel_routing(
+    count: int = 20000,
+    channels: int = 100,
+    queries: int = 200,
+    top_k: int = 10,
+    dimensions: int = 1024,
+    top_channels: list = None,
+    affinity: float = 1.0
+) -> dict:
+    """
+    Latency and recall@k of two-stage search (pick channels by centroid,
+    then search only their messages) against flat search, on a synthetic
+    multi-channel corpus.
+    """
+    import numpy as np
+    from app.services.local_index import LocalVectorIndex
+    from app.services.channel_centroids import rank_channels, centroid_matrix
+
+    corpus, labels = synthetic_channel_corpus(count + queries, dimensions, channels, affinity)
+    query_vectors, corpus, labels = corpus[:queries], corpus[queries:], labels[queries:]
+    exact = np.argsort(-(query_vectors @ corpus.T), axis=1)[:, :top_k]
+    truth = [set(map(str, row)) for row in exact]
+
+    flat = LocalVectorIndex(dimensions)
+    flat.upsert([(str(i), v) for i, v in enumerate(corpus)])
+    per_channel = {}
+    for channel in np.unique(labels):
+        members = np.flatnonzero(labels == channel)
+        per_channel[str(channel)] = LocalVectorIndex(dimensions)
+        per_channel[str(channel)].upsert([(str(i), corpus[i]) for i in members])
+    channel_ids = list(per_channel)
+    # Built once, as ChannelCentroids does when it loads the rows
+    centroids = centroid_matrix(np.stack([corpus[labels == int(c)].sum(axis=0) for c in channel_ids]))
+    sizes = {c: len(index) for c, index in per_channel.items()}
+
+    # Build lazily-stacked arrays outside the timed loops
+    flat.query(query_vectors[0], top_k)
+    for index in per_channel.values():
+        index.query(query_vectors[0], top_k)
+
+    def measure(search) -> tuple:
+        hits, scanned = 0, 0
+        start = time.perf_counter()
+        for q, expected in zip(query_vectors, truth):
+            found, searched = search(q)
+            hits += len(expected & found)
+            scanned += searched
+        elapsed = time.perf_counter() - start
+        return hits / (len(truth) * top_k), elapsed / len(truth) * 1000, scanned / len(truth)
+
+    recall, ms, scanned = measure(lambda q: ({m["id"] for m in flat.query(q, top_k)}, len(corpus)))
+    results = [{"top_channels": None, "recall": round(recall, 4), "query_ms": round(ms, 3), "scanned_fraction": 1.0}]
+
+    for top_c in top_channels or [1, 2, 4, 8]:
+        def two_stage(q):
+            chosen = [c for c, _ in rank_channels(q, channel_ids, centroids, top_c)]
+            matches = [m for c in chosen for m in per_channel[c].query(q, top_k)]
+            matches.sort(key=lambda m: m["score"], reverse=True)
+            return {m["id"] for m in matches[:top_k]}, sum(sizes[c] for c in chosen)
+
+        recall, ms, scanned = measure(two_stage)
+        results.append({
+            "top_channels": top_c,
+            "recall": round(recall, 4),
+            "query_ms": round(ms, 3),
+            "scanned_fraction": round(scanned / len(corpus), 4)
+        })
+
+    return {
+        "vectors": len(corpus),
+        "channels": len(channel_ids),
+        "queries": len(truth),
+        "top_k": top_k,
+        "dimensions": dimensions,
+        "affinity": affinity,
+        "results": results
+    }
+
+def print_channel_routing(report: dict):
+    print(f"\n=== Two-stage vs flat search: {report['vectors']} vectors in {report['channels']} channels, "
+          f"{report['queries']} queries, recall@{report['top_k']}, channel affinity {report['affinity']} ===")
+    print(f"{'channels':>9} {'recall':>7} {'query ms':>9} {'scanned':>8}")
+    for r in report["results"]:
+        label = "flat" if r["top_channels"] is None else str(r["top_channels"])
+        print(f"{label:>9} {r['recall']:>7.3f} {r['query_ms']:>9.2f} {r['scanned_fraction']:>8.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend performance benchmarks")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    import_parser = subparsers.add_parser("import-time", help="Profile module import time")
+    import_parser.add_argument("--module", default="app.main")
+    import_parser.add_argument("--top", type=int, default=15)
+
+    recall_parser = subparsers.add_parser("vector-recall", help="Recall vs size of embedding dimensions and quantization")
+    recall_parser.add_argument("--source", choices=["synthetic", "supabase"], default="synthetic")
+    recall_parser.add_argument("--count", type=int, default=20000)
+    recall_parser.add_argument("--queries", type=int, default=200)
+    recall_parser.add_argument("--top-k", type=int, default=10)
+    recall_parser.add_argument("--dimensions", type=int, nargs="+")
+    recall_parser.add_argument("--quantization", nargs="+", choices=["none", "int8", "binary"])
+    recall_parser.add_argument("--rescore-factor", type=int, default=4)
+
+    hedging_parser = subparsers.add_parser("hedging", help="Chat latency with hedged requests against a slow stub model")
+    hedging_parser.add_argument("--requests", type=int, default=300)
+    hedging_parser.add_argument("--concurrency", type=int, default=10)
+    hedging_parser.add_argument("--base-ms", type=float, default=200)
+    hedging_parser.add_argument("--slow-ms", type=float, default=2000)
+    hedging_parser.add_argument("--slow-rate", type=float, default=0.05)
+    hedging_parser.add_argument("--error-rate", type=float, default=0.01)
+
+    routing_parser = subparsers.add_parser("channel-routing", help="Two-stage channel-centroid search vs flat search")
+    routing_parser.add_argument("--count", type=int, default=20000)
+    routing_parser.add_argument("--channels", type=int, default=100)
+    routing_parser.add_argument("--queries", type=int, default=200)
+    routing_parser.add_argument("--top-k", type=int, default=10)
+    routing_parser.add_argument("--dimensions", type=int, default=1024)
+    routing_parser.add_argument("--top-channels", type=int, nargs="+")
+    routing_parser.add_argument("--affinity", type=float, default=1.0, help="Weight of the channel theme vs shared topics")
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    if args.benchmark == "import-time":
+        report = profile_import_time(args.module, args.top)
+        if not args.json:
+            print_import_time(report)
+
+    elif args.benchmark == "vector-recall":
+        report = benchmark_vector_recall(
+            args.source, args.count, args.queries, args.top_k,
+            args.dimensions, args.quantization, args.rescore_factor
+        )
+        if not args.json:
+            print_vector_recall(report)
+
+    elif args.benchmark == "hedging":
+        report = benchmark_hedging(
+            args.requests, args.concurrency, args.base_ms,
+            args.slow_ms, args.slow_rate, args.error_rate
+        )
+        if not args.json:
+            print_hedging(report)
+
+    elif args.benchmark == "channel-routing":
+        report = benchmark_channel_routing(
+            args.count, args.channels, args.queries, args.top_k,
+            args.dimensions, args.top_channels, args.affinity
+        )
+        if not args.json:
+            print_channel_routing(report)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"\nBenchmark finished in {time.perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+    main()
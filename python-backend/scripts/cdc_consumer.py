@@ -0,0 +1,68 @@
+#to run locally against the docker compose database use
+# docker compose exec ai-service python scripts/cdc_consumer.py --dsn postgresql://postgres:postgres@db:5432/postgres --dry-run
+# after applying the messages tables and the message_changes section of supabase.sql
+
+import argparse
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.message_cdc import MessageCDC, DATABASE_URL
+from app.services.pinecone_service import PineconeService
+
+class PrintingIndexer:
+    """Prints what would be indexed, so the change feed can be checked without Pinecone"""
+    build_metadata = staticmethod(PineconeService.build_metadata)
+
+    async def upsert_messages(self, messages):
+        for msg in messages:
+            print(f"upsert {msg['metadata']['message_id']}: {msg['content'][:60]!r}")
+        return len(messages)
+
+    async def delete_messages(self, message_ids):
+        for message_id in message_ids:
+            print(f"delete {message_id}")
+        return len(message_ids)
+
+async def run(dsn: str, dry_run: bool, requeue_failed: bool):
+    """
+    Run the message CDC consumer in the foreground until interrupted.
+
+    Args:
+        dsn: Postgres connection string
+        dry_run: Print changes instead of embedding them
+        requeue_failed: Retry quarantined changes first
+    """
+    if dry_run:
+        indexer = PrintingIndexer()
+        async def get_indexer():
+            return indexer
+    else:
+        service = PineconeService()
+        async def get_indexer():
+            return service
+
+    consumer = MessageCDC(dsn=dsn, get_indexer=get_indexer)
+    if requeue_failed:
+        print(f"requeued {await consumer.requeue_failed()} quarantined changes")
+    await consumer.start()
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"status: {consumer.status()}")
+    finally:
+        await consumer.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index messages from the Postgres change feed")
+    parser.add_argument("--dsn", default=DATABASE_URL, help="Postgres connection string (defaults to DATABASE_URL)")
+    parser.add_argument("--dry-run", action="store_true", help="Print changes instead of embedding them")
+    parser.add_argument("--requeue-failed", action="store_true", help="Retry changes quarantined after repeated failures")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn or DATABASE_URL is required")
+    try:
+        asyncio.run(run(args.dsn, args.dry_run, args.requeue_failed))
+    except KeyboardInterrupt:
+        pass
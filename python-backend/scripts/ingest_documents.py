@@ -0,0 +1,46 @@
+#to run locally in docker compose container use 
+# docker compose exec ai-service python scripts/ingest_documents.py path/to/docs [more paths...]
+
+import argparse
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Run alone, so parsing may use every CPU but one (the server default is sized per worker)
+os.environ.setdefault("DOCUMENT_INGEST_PROCESSES", str(max(1, (os.cpu_count() or 2) - 1)))
+
+from app.services.pinecone_service import PineconeService
+from app.services.document_ingest import DocumentIngestService
+
+async def ingest_documents(paths, user_id=None, force=False):
+    """
+    Ingest PDFs and text files (or directories of them) into the documents namespace.
+    
+    Args:
+        paths: Files or directories to ingest
+        user_id: Optional owner recorded on every chunk
+        force: Re-ingest files even if their content hash is unchanged
+    """
+    try:
+        print("Starting document ingest...")
+        service = DocumentIngestService(PineconeService())
+        stats = await service.ingest_paths(paths, user_id=user_id, force=force)
+        
+        print("\nIngest Complete!")
+        print(f"Files found: {stats['total']}")
+        print(f"Ingested: {stats['ingested']}")
+        print(f"Unchanged: {stats['unchanged']}")
+        print(f"Failed: {stats['failed']}")
+        print(f"Chunks written: {stats['chunks']}")
+        
+    except Exception as e:
+        print(f"Ingest failed: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest documents into the avatar knowledge base")
+    parser.add_argument("paths", nargs="+", help="Files or directories to ingest")
+    parser.add_argument("--user-id", default=None)
+    parser.add_argument("--force", action="store_true", help="Re-ingest unchanged files")
+    args = parser.parse_args()
+    asyncio.run(ingest_documents(args.paths, user_id=args.user_id, force=args.force))
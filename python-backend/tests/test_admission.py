@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from app.services.admission import AdmissionController, AdmissionMiddleware, AdmissionRejected, client_address
+from app.services.upstream_governor import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+
+def controller(**overrides) -> AdmissionController:
+    limits = {"max_concurrent": 2, "max_per_user": 2, "max_queue": 8, "slo_seconds": 8.0}
+    limits.update(overrides)
+    return AdmissionController("test", **limits)
+
+def test_background_service_time_does_not_inflate_interactive_estimate():
+    async def scenario():
+        pool = controller()
+        pool._service_seconds[PRIORITY_BACKGROUND] = 600.0
+        release = asyncio.Event()
+
+        async def hold(user_key: str, priority: int = PRIORITY_INTERACTIVE):
+            async with pool.admit(user_key, priority):
+                await release.wait()
+
+        holders = [asyncio.create_task(hold("rebuild", PRIORITY_BACKGROUND)), asyncio.create_task(hold("alice"))]
+        await asyncio.sleep(0)
+        assert pool.active == 2
+        # Both slots busy: the next chat request queues on the interactive
+        # estimate instead of being shed on the rebuild's 600s
+        waiter = asyncio.create_task(hold("bob"))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        release.set()
+        await asyncio.gather(*holders, waiter)
+        assert pool.shed["slo"] == 0
+        assert pool._service_seconds[PRIORITY_INTERACTIVE] < 1.0
+    asyncio.run(scenario())
+
+def test_background_estimate_sheds_second_rebuild():
+    async def scenario():
+        pool = controller()
+        pool._service_seconds[PRIORITY_BACKGROUND] = 600.0
+        async with pool.admit("rebuild", PRIORITY_BACKGROUND):
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with pool.admit("rebuild-2", PRIORITY_BACKGROUND):
+                    pass
+        assert rejected.value.status == 503
+    asyncio.run(scenario())
+
+def test_per_client_limit_applies_across_user_ids():
+    async def scenario():
+        pool = controller(max_concurrent=10, max_per_client=2)
+        async with pool.admit("user-1", client_key="10.0.0.1"):
+            async with pool.admit("user-2", client_key="10.0.0.1"):
+                with pytest.raises(AdmissionRejected) as rejected:
+                    async with pool.admit("user-3", client_key="10.0.0.1"):
+                        pass
+                async with pool.admit("user-3", client_key="10.0.0.2"):
+                    pass
+        assert rejected.value.status == 429
+        assert not pool._per_client and not pool._per_user
+    asyncio.run(scenario())
+
+def test_proxy_address_does_not_share_a_client_limit():
+    async def scenario():
+        pool = controller(max_concurrent=10, max_per_client=2, max_per_user=1)
+        middleware = AdmissionMiddleware(app=None, rules=[])
+        release = asyncio.Event()
+
+        async def chat(user_id: str):
+            # Every request arrives from the Next.js server's address
+            scope = {"client": ("172.18.0.3", 40000), "headers": [(b"x-user-id", user_id.encode())]}
+            async with pool.admit(middleware._user_key(scope), client_key=middleware._client_key(scope)):
+                await release.wait()
+
+        chats = [asyncio.create_task(chat(f"user-{i}")) for i in range(6)]
+        await asyncio.sleep(0)
+        assert pool.active == 6
+        release.set()
+        await asyncio.gather(*chats)
+        assert pool.shed["per_user"] == 0
+    asyncio.run(scenario())
+
+def test_forwarded_client_behind_proxy_is_limited():
+    proxy = "172.18.0.3"
+    assert client_address(proxy) is None
+    assert client_address(proxy, "203.0.113.7") == "203.0.113.7"
+    # Only the hop the proxy appended is believed, not one the caller sent
+    assert client_address(proxy, "198.51.100.1, 203.0.113.7") == "203.0.113.7"
+    assert client_address("203.0.113.9", "198.51.100.1") == "203.0.113.9"
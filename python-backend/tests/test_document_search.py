@@ -0,0 +1,51 @@
+import asyncio
+from types import SimpleNamespace
+from app.services.pinecone_service import PineconeService, DOCUMENTS_NAMESPACE
+
+def service_with(documents):
+    """A PineconeService whose documents namespace holds the given metadata"""
+    service = PineconeService.__new__(PineconeService)
+
+    async def embed_query(query):
+        return [0.0]
+
+    async def query_namespace(vector, namespace, top_k, metadata_filter=None):
+        def visible(metadata):
+            if metadata_filter is None:
+                return True
+            clauses = metadata_filter.get("$or", [metadata_filter])
+            for clause in clauses:
+                condition = clause["user_id"]
+                if isinstance(condition, dict) and condition == {"$exists": False}:
+                    if "user_id" not in metadata:
+                        return True
+                elif metadata.get("user_id") == condition:
+                    return True
+            return False
+        return SimpleNamespace(matches=[
+            SimpleNamespace(id=metadata["document_id"], score=1.0, metadata=metadata)
+            for metadata in documents if visible(metadata)
+        ])
+
+    service.embed_query = embed_query
+    service._query_namespace = query_namespace
+    return service
+
+DOCUMENTS = [
+    {"document_id": "handbook", "text": "shared"},
+    {"document_id": "alice-notes", "text": "alice's upload", "user_id": "alice"},
+    {"document_id": "bob-notes", "text": "bob's upload", "user_id": "bob"},
+]
+
+def search(user_id):
+    service = service_with(DOCUMENTS)
+    results = asyncio.run(service.query_similar(
+        "notes", top_k=10, namespaces=[DOCUMENTS_NAMESPACE], hydrate=False, user_id=user_id
+    ))
+    return sorted(r["metadata"]["document_id"] for r in results)
+
+def test_user_sees_shared_and_own_documents_only():
+    assert search("alice") == ["alice-notes", "handbook"]
+
+def test_anonymous_search_sees_shared_documents_only():
+    assert search(None) == ["handbook"]
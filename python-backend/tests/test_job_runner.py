@@ -0,0 +1,157 @@
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from app.services.job_runner import JobRunner, JOB_FAILED, JOB_SUCCEEDED
+
+class FakeTable:
+    def __init__(self, rows):
+        self.rows = rows
+        self.updates = []
+        self._filters = []
+        self._update = None
+
+    def select(self, columns):
+        self._update = None
+        self._filters = []
+        return self
+
+    def update(self, values):
+        self._update = values
+        self._filters = []
+        return self
+
+    def upsert(self, record):
+        self.rows = [row for row in self.rows if row["id"] != record["id"]] + [dict(record)]
+        self._update = None
+        self._filters = []
+        return self
+
+    def in_(self, column, values):
+        self._filters.append((column, set(values)))
+        return self
+
+    def eq(self, column, value):
+        return self.in_(column, [value])
+
+    def execute(self):
+        matched = [r for r in self.rows if all(r.get(c) in v for c, v in self._filters)]
+        if self._update is not None:
+            for row in matched:
+                row.update(self._update)
+            self.updates.append([row["id"] for row in matched])
+        return type("Response", (), {"data": matched})()
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.jobs = FakeTable(rows)
+
+    def table(self, name):
+        return self.jobs
+
+def test_stop_fails_queued_jobs_and_runs_cleanup():
+    async def scenario():
+        runner = JobRunner("test", max_workers=1)
+        started = asyncio.Event()
+        cleaned = []
+
+        async def block(job):
+            started.set()
+            await asyncio.sleep(60)
+
+        running = await runner.submit(block, kind="test", cleanup=lambda: cleaned.append("running"))
+        queued = await runner.submit(block, kind="test", cleanup=lambda: cleaned.append("queued"))
+        await started.wait()
+        await runner.stop()
+
+        assert running.status == JOB_FAILED
+        assert queued.status == JOB_FAILED
+        assert sorted(cleaned) == ["queued", "running"]
+    asyncio.run(scenario())
+
+def test_cleanup_runs_once_after_success():
+    async def scenario():
+        runner = JobRunner("test", max_workers=1)
+        cleaned = []
+
+        async def work(job):
+            return {"ok": True}
+
+        job = await runner.submit(work, kind="test", cleanup=lambda: cleaned.append(job.id))
+        await runner._queue.join()
+        await runner.stop()
+        assert job.status == JOB_SUCCEEDED
+        assert cleaned == [job.id]
+    asyncio.run(scenario())
+
+def test_get_hides_other_users_jobs():
+    async def scenario():
+        runner = JobRunner("test", max_workers=1)
+
+        async def work(job):
+            return None
+
+        job = await runner.submit(work, kind="test", user_id="alice")
+        shared = await runner.submit(work, kind="test")
+        assert await runner.get(job.id, user_id="alice") is job
+        assert await runner.get(job.id, user_id="bob") is None
+        assert await runner.get(job.id) is None
+        assert await runner.get(shared.id) is shared
+        await runner.stop()
+    asyncio.run(scenario())
+
+def test_start_fails_orphaned_jobs():
+    async def scenario():
+        host = socket.gethostname()
+        now = datetime.now(timezone.utc)
+        # A pid that is not running: a short-lived child that has been reaped
+        dead_pid = os.fork()
+        if dead_pid == 0:
+            os._exit(0)
+        os.waitpid(dead_pid, 0)
+
+        rows = [
+            {"id": "dead-local", "status": "running", "worker": f"{host}:{dead_pid}", "updated_at": now.isoformat()},
+            {"id": "live-local", "status": "queued", "worker": f"{host}:{os.getpid()}", "updated_at": now.isoformat()},
+            {"id": "stale-remote", "status": "queued", "worker": "other-host:1",
+             "updated_at": (now - timedelta(days=2)).isoformat()},
+            {"id": "fresh-remote", "status": "running", "worker": "other-host:1", "updated_at": now.isoformat()},
+            {"id": "finished", "status": "succeeded", "worker": f"{host}:{dead_pid}", "updated_at": now.isoformat()},
+        ]
+        supabase = FakeSupabase(rows)
+        runner = JobRunner("test", get_supabase=lambda: supabase, table="jobs")
+        await runner.start()
+        await runner.stop()
+
+        statuses = {row["id"]: row["status"] for row in supabase.jobs.rows}
+        assert statuses == {
+            "dead-local": JOB_FAILED,
+            "live-local": "queued",
+            "stale-remote": JOB_FAILED,
+            "fresh-remote": "running",
+            "finished": "succeeded",
+        }
+    asyncio.run(scenario())
+
+def test_queued_record_never_overwrites_later_status():
+    class SlowQueuedTable(FakeTable):
+        def upsert(self, record):
+            # The initial write is slow; a worker's later writes must not overtake it
+            if record["status"] == "queued":
+                time.sleep(0.05)
+            return super().upsert(record)
+
+    async def scenario():
+        supabase = FakeSupabase([])
+        supabase.jobs = SlowQueuedTable([])
+        runner = JobRunner("test", max_workers=1, get_supabase=lambda: supabase, table="jobs")
+
+        async def work(job):
+            return {"ok": True}
+
+        job = await runner.submit(work, kind="test")
+        await runner._queue.join()
+        await runner.stop()
+        assert [row["status"] for row in supabase.jobs.rows if row["id"] == job.id] == [JOB_SUCCEEDED]
+    asyncio.run(scenario())
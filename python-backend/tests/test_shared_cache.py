@@ -0,0 +1,27 @@
+import threading
+from app.services.shared_cache import SharedCache
+
+def stored_bytes(cache: SharedCache) -> int:
+    return cache._conn().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+def test_large_entries_stay_within_max_bytes(tmp_path):
+    cache = SharedCache(path=str(tmp_path / "cache.sqlite3"), max_bytes=10_000)
+    for i in range(20):
+        cache.set("audio", f"clip-{i}", b"x" * 3_000)
+        assert stored_bytes(cache) <= cache.max_bytes
+    # The newest entry survives eviction
+    assert cache.get("audio", "clip-19") is not None
+
+def test_concurrent_writes_keep_the_estimate(tmp_path):
+    cache = SharedCache(path=str(tmp_path / "cache.sqlite3"), max_bytes=10_000_000)
+
+    def write(worker: int):
+        for i in range(50):
+            cache.set("answers", f"{worker}-{i}", b"x" * 100)
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache._estimated_bytes == stored_bytes(cache) == 8 * 50 * 100
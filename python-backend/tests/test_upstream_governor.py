@@ -0,0 +1,147 @@
+# Run from python-backend with: python -m pytest tests
+import asyncio
+import pytest
+from app.services.upstream_governor import CircuitBreaker, UpstreamGovernor, UpstreamUnavailableError
+
+class FakeStatusError(Exception):
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        super().__init__(f"HTTP {status_code}")
+
+def open_breaker(governor: UpstreamGovernor, provider: str) -> CircuitBreaker:
+    breaker = governor.breaker(provider)
+    breaker.failure_threshold = 1
+    breaker.recovery_timeout = 0.0
+    breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+async def fail(governor: UpstreamGovernor, provider: str, status_code: int):
+    async with governor.call(provider):
+        raise FakeStatusError(status_code)
+
+async def succeed(governor: UpstreamGovernor, provider: str):
+    async with governor.call(provider):
+        pass
+
+def test_opens_after_consecutive_failures():
+    async def scenario():
+        governor = UpstreamGovernor()
+        breaker = governor.breaker("test")
+        breaker.failure_threshold = 2
+        breaker.recovery_timeout = 60.0
+        for _ in range(2):
+            with pytest.raises(FakeStatusError):
+                await fail(governor, "test", 503)
+        assert breaker.state == "open"
+        with pytest.raises(UpstreamUnavailableError):
+            await succeed(governor, "test")
+    asyncio.run(scenario())
+
+def test_client_errors_and_rate_limits_do_not_open():
+    async def scenario():
+        governor = UpstreamGovernor()
+        breaker = governor.breaker("test")
+        breaker.failure_threshold = 1
+        for status_code in (400, 404, 429):
+            with pytest.raises(FakeStatusError):
+                await fail(governor, "test", status_code)
+        assert breaker.state == "closed"
+    asyncio.run(scenario())
+
+def test_half_open_trial_success_closes():
+    async def scenario():
+        governor = UpstreamGovernor()
+        breaker = open_breaker(governor, "test")
+        await succeed(governor, "test")
+        assert breaker.state == "closed"
+    asyncio.run(scenario())
+
+def test_half_open_trial_failure_reopens():
+    async def scenario():
+        governor = UpstreamGovernor()
+        breaker = open_breaker(governor, "test")
+        breaker.recovery_timeout = 0.0
+        with pytest.raises(FakeStatusError):
+            await fail(governor, "test", 500)
+        assert breaker.state == "open"
+    asyncio.run(scenario())
+
+def test_half_open_admits_one_trial():
+    async def scenario():
+        governor = UpstreamGovernor()
+        open_breaker(governor, "test")
+        async with governor.call("test"):
+            with pytest.raises(UpstreamUnavailableError):
+                await succeed(governor, "test")
+    asyncio.run(scenario())
+
+def test_cancelled_trial_frees_the_slot():
+    async def scenario():
+        governor = UpstreamGovernor()
+        breaker = open_breaker(governor, "test")
+        entered = asyncio.Event()
+
+        async def hang():
+            async with governor.call("test"):
+                entered.set()
+                await asyncio.sleep(60)
+
+        task = asyncio.create_task(hang())
+        await entered.wait()
+        assert breaker.state == "half_open"
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # Cancellation is not a failure: still half-open, and the next call is the trial
+        assert breaker.state == "half_open"
+        assert breaker.failures == 1
+        await succeed(governor, "test")
+        assert breaker.state == "closed"
+    asyncio.run(scenario())
+
+def test_cancelled_while_waiting_for_a_token_frees_the_slot():
+    async def scenario():
+        governor = UpstreamGovernor()
+        breaker = open_breaker(governor, "test")
+        bucket = governor.bucket("test")
+        bucket.tokens = 0.0
+        bucket.rate = 0.1
+
+        task = asyncio.create_task(succeed(governor, "test"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        bucket.tokens = 10.0
+        bucket.rate = bucket.base_rate
+        await succeed(governor, "test")
+        assert breaker.state == "closed"
+    asyncio.run(scenario())
+
+def test_cancelling_a_non_trial_call_leaves_the_trial_alone():
+    async def scenario():
+        governor = UpstreamGovernor()
+        breaker = governor.breaker("test")
+        entered = asyncio.Event()
+
+        async def hang():
+            async with governor.call("test"):
+                entered.set()
+                await asyncio.sleep(60)
+
+        # Admitted while closed, then the circuit opens and a trial starts
+        task = asyncio.create_task(hang())
+        await entered.wait()
+        breaker.failure_threshold = 1
+        breaker.recovery_timeout = 0.0
+        breaker.record_failure()
+        async with governor.call("test"):
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            with pytest.raises(UpstreamUnavailableError):
+                await succeed(governor, "test")
+    asyncio.run(scenario())
@@ -16,14 +16,33 @@ export async function POST(request: Request) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        // Lets the AI service apply per-user admission limits
+        ...(body.user_id ? { 'X-User-Id': body.user_id } : {}),
+        // The per-client limit is keyed on the browser's address, not ours
+        ...(request.headers.get('x-forwarded-for')
+          ? { 'X-Forwarded-For': request.headers.get('x-forwarded-for') as string }
+          : {}),
       },
       body: JSON.stringify({
         message: body.message,
         avatar_name: body.avatar_name,
-        avatar_instructions: body.avatar_instructions || null
+        avatar_instructions: body.avatar_instructions || null,
+        user_id: body.user_id || null
       }),
     });
 
+    if (response.status === 429 || response.status === 503) {
+      // Load shedding: pass the status and retry hint through to the client
+      const errorData = await response.json().catch(() => ({}));
+      return NextResponse.json(
+        { error: errorData.detail || 'AI service is busy, please retry' },
+        {
+          status: response.status,
+          headers: { 'Retry-After': response.headers.get('Retry-After') || '1' }
+        }
+      );
+    }
+
     if (!response.ok) {
       const errorText = await response.text();
       console.error('Python API error:', errorText);
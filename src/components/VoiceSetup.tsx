@@ -34,6 +34,9 @@ interface User {
 }
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL;
+// Voice training job polling: interval, and how long to wait before giving up
+const TRAINING_POLL_MS = 2000;
+const TRAINING_TIMEOUT_MS = 5 * 60 * 1000;
 
 export function VoiceSetup() {
   const [loading, setLoading] = useState(false);
@@ -292,7 +295,11 @@ export function VoiceSetup() {
         new Map(
           data
             .filter((voice: Voice) => voice.category === 'premade')
-            .map((voice: Voice) => [voice.voice_id, voice])
+            // Prefer our precomputed, long-cached preview when one exists
+            .map((voice: Voice & { cached_preview_url?: string }) => [
+              voice.voice_id,
+              { ...voice, preview_url: voice.cached_preview_url || voice.preview_url }
+            ])
         ).values()
       ) as Voice[];
       
@@ -519,7 +526,29 @@ export function VoiceSetup() {
         throw new Error(`Failed to train voice: ${errorData}`);
       }
       
-      const data = await response.json();
+      const { job_id } = await response.json();
+      console.log('Training job queued:', job_id);
+
+      // Training runs in the background; poll the job until it finishes
+      let data: any = null;
+      const deadline = Date.now() + TRAINING_TIMEOUT_MS;
+      while (!data) {
+        if (Date.now() > deadline) {
+          throw new Error('Voice training is taking too long. Please check back later or try again.');
+        }
+        await new Promise(resolve => setTimeout(resolve, TRAINING_POLL_MS));
+        const jobResponse = await fetch(`http://localhost:8000/voices/jobs/${job_id}?user_id=${user.id}`);
+        if (!jobResponse.ok) {
+          throw new Error(`Failed to get training status: ${await jobResponse.text()}`);
+        }
+        const job = await jobResponse.json();
+        if (job.status === 'failed') {
+          throw new Error(`Failed to train voice: ${job.error}`);
+        }
+        if (job.status === 'succeeded') {
+          data = job.result;
+        }
+      }
       console.log('Training response:', data);
       
       if (data.voice_preference) {
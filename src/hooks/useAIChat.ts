@@ -87,7 +87,8 @@ export function useAIChat(targetUserId: string) {
       const requestBody = {
         message,
         avatar_name: targetUserName,
-        avatar_instructions: avatarSettings?.instructions || null
+        avatar_instructions: avatarSettings?.instructions || null,
+        user_id: user.id
       };
 
       console.log('Debug - Request body:', requestBody);
@@ -12,6 +12,8 @@ export interface Citation {
     isDirectMessage?: boolean;
     receiverId?: string;
     receiverName?: string;
+    documentId?: string;
+    page?: number;
   }
 }
 
@@ -456,6 +456,255 @@ CREATE TABLE public.voice_preferences (
 CREATE INDEX idx_voice_preferences_user_id ON public.voice_preferences(user_id);
 CREATE INDEX idx_voice_preferences_voice_id ON public.voice_preferences(voice_id);
 
+-- Voice training jobs (background job state, written by the Python backend)
+CREATE TABLE IF NOT EXISTS public.voice_training_jobs (
+    id uuid primary key,
+    kind text not null,
+    user_id uuid references public.users(id) on delete cascade,
+    status text not null check (status in ('queued', 'running', 'succeeded', 'failed')),
+    step text,
+    result jsonb,
+    error text,
+    created_at timestamptz default now(),
+    updated_at timestamptz default now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_voice_training_jobs_user_id ON public.voice_training_jobs(user_id);
+
+-- Worker (host:pid) holding the job; unfinished jobs of exited workers are failed at startup
+ALTER TABLE public.voice_training_jobs ADD COLUMN IF NOT EXISTS worker text;
+
+-- Precomputed voice previews (one current content-hashed object per voice)
+CREATE TABLE IF NOT EXISTS public.voice_previews (
+    voice_id text primary key,  -- ElevenLabs voice ID
+    owner text not null,  -- 'stock' or the user ID of a custom voice
+    content_hash text not null,  -- Hash of voice samples, preview text and model
+    object_path text not null,  -- Path inside the voice-samples bucket
+    preview_url text not null,
+    preview_text text not null,
+    model_id text not null,
+    updated_at timestamptz default now()
+);
+
+-- Documents ingested into the avatar knowledge base (vector index manifest)
+CREATE TABLE IF NOT EXISTS public.ingested_documents (
+    source text primary key,  -- Original file name or path
+    document_id text not null,  -- ID used in doc_<document_id>#<n> vector IDs, from owner and source
+    content_hash text not null,  -- SHA-256 of the file, used to skip unchanged files
+    chunk_count integer not null,
+    user_id uuid references public.users(id) on delete set null,
+    ingested_at timestamptz default now()
+);
+
+-- Document ingest jobs (background job state, written by the Python backend)
+CREATE TABLE IF NOT EXISTS public.document_ingest_jobs (
+    id uuid primary key,
+    kind text not null,
+    user_id uuid references public.users(id) on delete cascade,
+    status text not null check (status in ('queued', 'running', 'succeeded', 'failed')),
+    step text,
+    result jsonb,
+    error text,
+    created_at timestamptz default now(),
+    updated_at timestamptz default now()
+);
+
+ALTER TABLE public.document_ingest_jobs ADD COLUMN IF NOT EXISTS worker text;
+
+-- Index maintenance jobs such as shard rebuilds (written by the Python backend)
+CREATE TABLE IF NOT EXISTS public.index_jobs (
+    id uuid primary key,
+    kind text not null,
+    user_id uuid references public.users(id) on delete cascade,
+    status text not null check (status in ('queued', 'running', 'succeeded', 'failed')),
+    step text,
+    result jsonb,
+    error text,
+    worker text,
+    created_at timestamptz default now(),
+    updated_at timestamptz default now()
+);
+
+-- Documents are keyed by document_id (owner and source): same-named files of
+-- different users are separate documents
+ALTER TABLE public.ingested_documents DROP CONSTRAINT IF EXISTS ingested_documents_pkey;
+ALTER TABLE public.ingested_documents ADD PRIMARY KEY (document_id);
+
+-- Message vectors in the search index (manifest used for edits, deletes and reconciliation)
+CREATE TABLE IF NOT EXISTS public.message_vectors (
+    message_id text primary key,  -- ID used in msg_<message_id>[#n] vector IDs
+    content_hash text not null,  -- SHA-256 of the embedded content
+    chunk_count integer not null,
+    source_updated_at timestamptz,  -- messages.updated_at when last indexed
+    indexed_at timestamptz default now()
+);
+
+-- Pinecone namespace (message shard) holding the chunks; see SHARD_KEY
+ALTER TABLE public.message_vectors ADD COLUMN IF NOT EXISTS namespace text not null default 'messages';
+CREATE INDEX IF NOT EXISTS message_vectors_namespace_idx ON public.message_vectors (namespace);
+
+-- Per-channel sum of chunk vectors; its direction is the channel centroid
+-- used to pick channels before searching messages
+CREATE TABLE IF NOT EXISTS public.channel_centroids (
+    channel_id text primary key,
+    namespace text not null default 'messages',  -- message shard of the channel
+    vector_sum float8[] not null,
+    vector_count integer not null default 0,
+    updated_at timestamptz default now()
+);
+
+-- Atomically add newly indexed vectors to a channel's sum; a dimension
+-- change starts the sum over
+CREATE OR REPLACE FUNCTION public.add_to_channel_centroid(
+  p_channel_id text,
+  p_namespace text,
+  p_delta float8[],
+  p_count integer
+)
+RETURNS void AS $$
+BEGIN
+  INSERT INTO public.channel_centroids AS c (channel_id, namespace, vector_sum, vector_count, updated_at)
+  VALUES (p_channel_id, p_namespace, p_delta, p_count, now())
+  ON CONFLICT (channel_id) DO UPDATE SET
+    namespace = excluded.namespace,
+    vector_sum = CASE
+      WHEN cardinality(c.vector_sum) = cardinality(excluded.vector_sum) THEN (
+        SELECT array_agg(a + b ORDER BY i)
+        FROM unnest(c.vector_sum, excluded.vector_sum) WITH ORDINALITY AS t(a, b, i)
+      )
+      ELSE excluded.vector_sum
+    END,
+    vector_count = CASE
+      WHEN cardinality(c.vector_sum) = cardinality(excluded.vector_sum) THEN c.vector_count + excluded.vector_count
+      ELSE excluded.vector_count
+    END,
+    updated_at = now();
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keep updated_at current so reconciliation and the backend's name cache
+-- only look at touched rows
+CREATE OR REPLACE FUNCTION public.touch_updated_at()
+RETURNS trigger AS $$
+BEGIN
+  NEW.updated_at = now();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS touch_message_updated_at_trigger ON public.messages;
+CREATE TRIGGER touch_message_updated_at_trigger
+  BEFORE UPDATE ON public.messages
+  FOR EACH ROW
+  EXECUTE FUNCTION public.touch_updated_at();
+
+DROP TRIGGER IF EXISTS touch_user_updated_at_trigger ON public.users;
+CREATE TRIGGER touch_user_updated_at_trigger
+  BEFORE UPDATE ON public.users
+  FOR EACH ROW
+  EXECUTE FUNCTION public.touch_updated_at();
+
+DROP TRIGGER IF EXISTS touch_channel_updated_at_trigger ON public.channels;
+CREATE TRIGGER touch_channel_updated_at_trigger
+  BEFORE UPDATE ON public.channels
+  FOR EACH ROW
+  EXECUTE FUNCTION public.touch_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_messages_updated_at ON public.messages(updated_at);
+CREATE INDEX IF NOT EXISTS idx_users_updated_at ON public.users(updated_at);
+CREATE INDEX IF NOT EXISTS idx_channels_updated_at ON public.channels(updated_at);
+
+-- Change data capture for message indexing: every insert, delete and
+-- update of indexed columns is queued here and announced with NOTIFY; the
+-- backend consumer (CDC_ENABLED) embeds them in batches and stamps
+-- consumed_at, which is its resume position.
+--
+-- The trigger records changes whether or not a consumer runs (CDC_ENABLED
+-- defaults to false), so it also prunes the table itself, every 1000th
+-- change: consumed rows after a day, and unconsumed rows after 7 days. A
+-- consumer that was down longer than that has lost changes and needs a
+-- full reconcile (POST /api/chat/reconcile). Quarantined rows (failed_at)
+-- are kept until requeued.
+CREATE TABLE IF NOT EXISTS public.message_changes (
+    id bigint generated always as identity primary key,
+    message_id uuid not null,
+    op text not null check (op in ('INSERT', 'UPDATE', 'DELETE')),
+    changed_at timestamptz default now(),
+    consumed_at timestamptz
+);
+
+-- Set on changes the consumer gave up on after repeated failures; they are
+-- kept past retention until requeued with scripts/cdc_consumer.py --requeue-failed
+ALTER TABLE public.message_changes
+    ADD COLUMN IF NOT EXISTS failed_at timestamptz,
+    ADD COLUMN IF NOT EXISTS error text;
+
+CREATE INDEX IF NOT EXISTS idx_message_changes_pending
+    ON public.message_changes(id) WHERE consumed_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_message_changes_changed_at
+    ON public.message_changes(changed_at);
+
+CREATE OR REPLACE FUNCTION public.record_message_change()
+RETURNS trigger AS $$
+DECLARE
+  change_id bigint;
+BEGIN
+  -- Edits that leave the indexed text and scope alone (pins, reactions) are skipped
+  IF TG_OP = 'UPDATE'
+     AND NEW.content IS NOT DISTINCT FROM OLD.content
+     AND NEW.channel_id IS NOT DISTINCT FROM OLD.channel_id
+     AND NEW.is_direct_message IS NOT DISTINCT FROM OLD.is_direct_message THEN
+    RETURN NULL;
+  END IF;
+
+  INSERT INTO public.message_changes (message_id, op)
+  VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END, TG_OP)
+  RETURNING id INTO change_id;
+  -- Delivered on commit; the payload is informational
+  PERFORM pg_notify('message_changes', change_id::text);
+
+  -- Bounds the table when no consumer is running (see above)
+  IF change_id % 1000 = 0 THEN
+    DELETE FROM public.message_changes
+    WHERE failed_at IS NULL
+      AND changed_at < now() - interval '1 day'
+      AND (consumed_at IS NOT NULL OR changed_at < now() - interval '7 days');
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS record_message_change_trigger ON public.messages;
+CREATE TRIGGER record_message_change_trigger
+  AFTER INSERT OR UPDATE OR DELETE ON public.messages
+  FOR EACH ROW
+  EXECUTE FUNCTION public.record_message_change();
+
+-- Avatar conversation memory (written by the Python backend)
+CREATE TABLE IF NOT EXISTS public.conversation_turns (
+    id bigint generated always as identity primary key,
+    user_id uuid references public.users(id) on delete cascade,
+    avatar_name text not null,
+    role text not null check (role in ('user', 'assistant')),
+    content text not null,
+    token_count integer not null,
+    summarized boolean default false,  -- Folded into conversation_summaries
+    created_at timestamptz default now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversation_turns_open
+    ON public.conversation_turns(user_id, avatar_name, id) WHERE NOT summarized;
+
+CREATE TABLE IF NOT EXISTS public.conversation_summaries (
+    user_id uuid references public.users(id) on delete cascade,
+    avatar_name text not null,
+    summary text not null,  -- Running summary of all summarized turns
+    summarized_through timestamptz,
+    updated_at timestamptz default now(),
+    primary key (user_id, avatar_name)
+);
+
 -- Update storage policies for voice-samples bucket to be public
 UPDATE storage.buckets 
 SET public = true 